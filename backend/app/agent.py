@@ -3,19 +3,43 @@ Módulo del Agente LangGraph para NL to SQL
 Implementa un agente básico con herramientas estructuradas usando LangGraph
 """
 import os
+import re
+import asyncio
+import atexit
+import operator
 import time
-from typing import TypedDict, Optional, List, Dict, Any, Annotated, Sequence
+import hashlib
+import orjson
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypedDict, Optional, List, Dict, Any, Annotated, Sequence, Union, AsyncIterator
 from langchain_core.tools import tool
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
 from langchain_google_vertexai import ChatVertexAI
-from langgraph.graph import StateGraph, END
+from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import ToolNode
 from langgraph.graph.message import add_messages
+from langgraph.types import Send
 
-from app.db import get_table_schema, get_dimensions_info, execute_query
-from app.llm import nl_to_sql, recommend_chart_type
-from app.prompts import get_prompt
-from app.logger import log_info, log_error, log_warning
+from app.db import get_table_schema, get_current_dimensions, execute_query, SqlCostExceeded
+from app.llm import nl_to_sql, recommend_chart_type, decompose_question
+from app.prompts import build_prompt_fn, HISTORY_WINDOW
+from app.metrics import metric_aggregator, METRICS_PRECOMPUTE_ENABLED
+from app.logger import log_info, log_error, log_warning, timed_step
+
+
+# ⚡ Pool de threads compartido para los fan-outs paralelos del agente
+# Reutilizado entre requests: evita crear threads por request y acota el total de threads
+_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("AGENT_POOL_SIZE", "8")),
+    thread_name_prefix="agent"
+)
+atexit.register(_EXECUTOR.shutdown, wait=False)
+
+# Filas de muestra que se envían al LLM para recomendar el gráfico
+# ⚡ Se recortan antes de serializar: las filas que el LLM no ve no se copian ni se codifican
+_CHART_MAX_ROWS_SAMPLE = int(os.getenv("CHART_MAX_ROWS_SAMPLE", "10"))
 
 
 # ============================================================================
@@ -39,117 +63,77 @@ class AgentState(TypedDict):
 
 
 # ============================================================================
-# Herramientas del Agente
+# Implementaciones de las Herramientas
 # ============================================================================
+# ⚡ Las implementaciones retornan dicts de Python. run_agent las llama directamente
+# para evitar serializar/parsear JSON entre pasos; solo los wrappers @tool (usados
+# por el LLM a través del ToolNode) convierten a JSON string.
 
-@tool
-def get_schema_tool() -> str:
-    """
-    Obtiene el schema de la tabla principal de BigQuery.
-    Esta herramienta debe ser llamada primero para obtener la estructura de la tabla.
-    
-    Returns:
-        JSON string con 'schema' (texto del schema) y 'table_id' (ID completo de la tabla)
-    """
-    import json
+def _get_schema_impl() -> Dict[str, Any]:
+    """Obtiene el schema de la tabla principal. Retorna dict con 'schema', 'table_id' y 'success'"""
     try:
         log_info("🔧 [Tool] Getting schema from BigQuery...")
         schema_text, table_id = get_table_schema(use_cache=True)
-        log_info(f"✅ [Tool] Schema obtained: {table_id}")
-        result = {
+        log_info("✅ [Tool] Schema obtained: %s", table_id)
+        return {
             "schema": schema_text,
             "table_id": table_id,
             "success": True
         }
-        return json.dumps(result)
     except Exception as e:
         log_error(f"❌ [Tool] Error getting schema", e)
-        result = {
+        return {
             "schema": None,
             "table_id": None,
             "success": False,
             "error": str(e)
         }
-        return json.dumps(result)
 
 
-@tool
-def get_dimensions_tool() -> str:
-    """
-    Obtiene información de las tablas de dimensiones disponibles.
-    Estas tablas contienen información descriptiva (nombres, descripciones) que se pueden usar en JOINs.
-    
-    Returns:
-        JSON string con información de dimensiones o None si no hay disponibles
-    """
-    import json
+def _get_dimensions_impl() -> Dict[str, Any]:
+    """Obtiene información de dimensiones. Retorna dict con 'dimensions', 'success' y 'count'"""
     try:
         log_info("🔧 [Tool] Getting dimension information...")
-        dimensions_info = get_dimensions_info(use_cache=True, force_refresh=False)
+        # ⚡ Lectura directa de las dimensiones vigentes (se refrescan fuera del request)
+        dimensions_info = get_current_dimensions()
         
         if dimensions_info.get("dimensions") and len(dimensions_info["dimensions"]) > 0:
             dim_names = list(dimensions_info["dimensions"].keys())
-            log_info(f"✅ [Tool] {len(dim_names)} dimension tables available: {', '.join(dim_names)}")
-            result = {
+            log_info("✅ [Tool] %s dimension tables available: %s", len(dim_names), ', '.join(dim_names))
+            return {
                 "dimensions": dimensions_info,
                 "success": True,
                 "count": len(dimensions_info["dimensions"])
             }
         else:
             log_info("ℹ️  [Tool] No dimension tables available")
-            result = {
+            return {
                 "dimensions": None,
                 "success": True,
                 "count": 0
             }
-        return json.dumps(result)
     except Exception as e:
-        log_warning(f"⚠️  [Tool] Error getting dimensions: {e}")
-        result = {
+        log_warning("⚠️  [Tool] Error getting dimensions: %s", e)
+        return {
             "dimensions": None,
             "success": False,
             "error": str(e)
         }
-        return json.dumps(result)
 
 
-@tool
-def generate_sql_tool(
+def _generate_sql_impl(
     question: str,
     schema: str,
     table_id: str,
-    dimensions_info: Optional[str] = None,
-    conversation_history: Optional[str] = None
-) -> str:
+    dimensions_info: Optional[Dict] = None,
+    conversation_history: Optional[List[Dict]] = None
+) -> Dict[str, Any]:
     """
-    Genera SQL desde una pregunta en lenguaje natural usando Gemini.
-    
-    Args:
-        question: Pregunta del usuario en lenguaje natural
-        schema: Schema de la tabla principal (obtenido con get_schema_tool, como JSON string)
-        table_id: ID completo de la tabla (project.dataset.table)
-        dimensions_info: Información de tablas de dimensiones (opcional, como JSON string)
-        conversation_history: Historial de conversación anterior (opcional, como JSON string)
-    
-    Returns:
-        JSON string con 'sql' generado y metadata
+    Genera SQL con Gemini. Recibe objetos Python ya parseados:
+    schema como texto, dimensions_info como dict y conversation_history como lista.
     """
-    import json
     try:
-        log_info(f"🔧 [Tool] Generating SQL for: {question[:50]}...")
-        
-        # Parsear inputs JSON
-        schema_data = json.loads(schema) if isinstance(schema, str) else schema
-        schema_text = schema_data.get("schema") if isinstance(schema_data, dict) else schema
-        
-        dim_info = None
-        if dimensions_info:
-            dim_data = json.loads(dimensions_info) if isinstance(dimensions_info, str) else dimensions_info
-            dim_info = dim_data.get("dimensions") if isinstance(dim_data, dict) else dim_data
-        
-        conv_history = None
-        if conversation_history:
-            conv_history = json.loads(conversation_history) if isinstance(conversation_history, str) else conversation_history
+        log_info("🔧 [Tool] Generating SQL for: %s...", question[:50])
         
         # Extraer project_id, dataset, table del table_id
         parts = table_id.split('.')
@@ -158,155 +142,282 @@ def generate_sql_tool(
         
         project_id, dataset, table = parts
         
-        # Construir prompt
-        prompt = get_prompt(
-            question=question,
-            schema=schema_text,
-            project_id=project_id,
-            dataset=dataset,
-            table=table,
-            dimensions_info=dim_info,
-            conversation_history=conv_history
-        )
+        # ⚡ Construir prompt: la parte estática (schema + dimensiones) ya viene pre-formateada
+        prompt_fn = build_prompt_fn(schema, project_id, dataset, table, dimensions_info)
+        prompt = prompt_fn(question, conversation_history)
         
         # Generar SQL
         llm_result = nl_to_sql(prompt)
         sql = llm_result['sql']
         
-        log_info(f"✅ [Tool] SQL generated: {sql[:100]}...")
+        log_info("✅ [Tool] SQL generated: %s...", sql[:100])
         
-        result = {
+        return {
             "sql": sql,
             "success": True,
             "duration_ms": llm_result.get('duration_ms'),
             "tokens_used": llm_result.get('tokens_used'),
             "model_used": llm_result.get('model_used')
         }
-        return json.dumps(result)
     except Exception as e:
         log_error(f"❌ [Tool] Error generating SQL", e)
-        result = {
+        return {
             "sql": None,
             "success": False,
             "error": str(e)
         }
-        return json.dumps(result)
 
 
-@tool
-def execute_query_tool(sql: str, max_rows: int = 100) -> str:
-    """
-    Ejecuta una consulta SQL en BigQuery.
-    
-    Args:
-        sql: Consulta SQL a ejecutar (puede venir como JSON string con campo "sql" o directamente)
-        max_rows: Número máximo de filas a retornar (default: 100)
-    
-    Returns:
-        JSON string con resultados de la consulta (columns, rows, total_rows, etc.)
-    """
-    import json
+def _execute_query_impl(sql: str, max_rows: int = 100) -> Dict[str, Any]:
+    """Ejecuta SQL en BigQuery. Retorna dict con columns, rows, total_rows y success"""
     try:
-        log_info(f"🔧 [Tool] Executing SQL in BigQuery...")
-        
-        # Parsear SQL si viene como JSON
-        sql_query = sql
-        if isinstance(sql, str) and sql.strip().startswith("{"):
-            try:
-                sql_data = json.loads(sql)
-                sql_query = sql_data.get("sql", sql)
-            except:
-                pass
+        log_info("🔧 [Tool] Executing SQL in BigQuery...")
+        log_info("SQL: %s...", sql[:200])
         
-        log_info(f"SQL: {sql_query[:200]}...")
+        result = execute_query(sql, max_rows=max_rows)
         
-        result = execute_query(sql_query, max_rows=max_rows)
+        log_info("✅ [Tool] Query executed: %s rows returned", result['total_rows'])
         
-        log_info(f"✅ [Tool] Query executed: {result['total_rows']} rows returned")
-        
-        output = {
+        return {
             "success": True,
             "columns": result.get("columns", []),
             "rows": result.get("rows", []),
             "total_rows": result.get("total_rows", 0),
             "bytes_processed": result.get("bytes_processed")
         }
-        return json.dumps(output)
+    except SqlCostExceeded as e:
+        # El agente puede reintentar con una query más acotada (filtros, menos columnas)
+        log_warning("⚠️  [Tool] Query too expensive, not executed: %s", e)
+        return {
+            "success": False,
+            "error": "cost_gate",
+            "message": str(e),
+            "estimated_bytes": e.estimated_bytes,
+            "columns": [],
+            "rows": [],
+            "total_rows": 0
+        }
     except Exception as e:
         log_error(f"❌ [Tool] Error executing query", e)
-        output = {
+        return {
             "success": False,
             "error": str(e),
             "columns": [],
             "rows": [],
             "total_rows": 0
         }
-        return json.dumps(output)
 
 
-@tool
-def recommend_chart_tool(
-    question: str,
-    columns: str,
-    rows: str,
-    max_rows_sample: int = 20
-) -> str:
+def _is_numeric_column(rows: List[List[Any]], col_index: int, sample_size: int = 5) -> bool:
     """
-    Analiza los resultados de una consulta y recomienda el tipo de gráfico más apropiado.
-    
-    Args:
-        question: Pregunta original del usuario
-        columns: Lista de nombres de columnas (como JSON string)
-        rows: Lista de filas de datos (como JSON string)
-        max_rows_sample: Número máximo de filas a analizar (default: 20)
-    
-    Returns:
-        JSON string con 'chart_type' y 'chart_config' o None si no se recomienda gráfico
+    Detecta si una columna es numérica mirando como máximo las primeras `sample_size` filas.
+    NUMERIC/BIGNUMERIC llegan como string desde execute_query, así que se intentan parsear.
+    """
+    seen = 0
+    for row in rows[:sample_size]:
+        value = row[col_index] if col_index < len(row) else None
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            return False
+        if not isinstance(value, (int, float)):
+            try:
+                float(value)
+            except (TypeError, ValueError):
+                return False
+        seen += 1
+    return seen > 0
+
+
+def _is_chartable(columns: List[str], rows: List[List[Any]]) -> bool:
     """
-    import json
+    Pre-filtro local: descarta resultados que nunca son graficables
+    (una sola fila, una sola columna o sin columnas numéricas) sin llamar a Gemini
+    """
+    if len(columns) < 2 or len(rows) < 2:
+        return False
+    return any(_is_numeric_column(rows, i) for i in range(len(columns)))
+
+
+def _recommend_chart_impl(
+    question: str,
+    columns: List[str],
+    rows: List[List[Any]],
+    max_rows_sample: int = _CHART_MAX_ROWS_SAMPLE
+) -> Dict[str, Any]:
+    """Recomienda un tipo de gráfico. Retorna dict con chart_type, chart_config y success"""
     try:
-        # Parsear inputs JSON
-        cols = json.loads(columns) if isinstance(columns, str) else columns
-        rws = json.loads(rows) if isinstance(rows, str) else rows
+        if not columns or not rows or len(rows) == 0:
+            return {
+                "success": True,
+                "chart_type": None,
+                "chart_config": None
+            }
         
-        if not cols or not rws or len(rws) == 0:
-            result = {
+        # ⚡ Evitar la llamada a Gemini cuando el resultado claramente no es graficable
+        if not _is_chartable(columns, rows):
+            log_info("ℹ️  [Tool] Data not chartable (single row/column or no numeric values), skipping LLM")
+            return {
                 "success": True,
                 "chart_type": None,
                 "chart_config": None
             }
-            return json.dumps(result)
         
-        log_info(f"🔧 [Tool] Analyzing data for chart recommendation...")
+        log_info("🔧 [Tool] Analyzing data for chart recommendation...")
         
         recommendation = recommend_chart_type(
             question=question,
-            columns=cols,
-            rows=rws,
+            columns=columns,
+            rows=rows[:max_rows_sample],
             max_rows_sample=max_rows_sample
         )
         
         chart_type = recommendation.get("chart_type")
         if chart_type:
-            log_info(f"✅ [Tool] Chart recommended: {chart_type}")
+            log_info("✅ [Tool] Chart recommended: %s", chart_type)
         else:
             log_info("ℹ️  [Tool] Visualization not recommended for this data")
         
-        result = {
+        return {
             "success": True,
             "chart_type": chart_type,
             "chart_config": recommendation.get("chart_config")
         }
-        return json.dumps(result)
     except Exception as e:
-        log_warning(f"⚠️  [Tool] Error recommending chart: {e}")
-        result = {
+        log_warning("⚠️  [Tool] Error recommending chart: %s", e)
+        return {
             "success": False,
             "chart_type": None,
             "chart_config": None,
             "error": str(e)
         }
-        return json.dumps(result)
+
+
+# ============================================================================
+# Herramientas del Agente
+# ============================================================================
+
+def _to_json(obj: Any) -> str:
+    """
+    Serializa a JSON string con orjson (más rápido que json de stdlib, sobre todo con muchas filas).
+    default=str cubre tipos que BigQuery puede devolver, como Decimal.
+    """
+    return orjson.dumps(obj, default=str).decode()
+
+
+@tool
+def get_schema_tool() -> str:
+    """
+    Obtiene el schema de la tabla principal de BigQuery.
+    Esta herramienta debe ser llamada primero para obtener la estructura de la tabla.
+    
+    Returns:
+        JSON string con 'schema' (texto del schema) y 'table_id' (ID completo de la tabla)
+    """
+    return _to_json(_get_schema_impl())
+
+
+@tool
+def get_dimensions_tool() -> str:
+    """
+    Obtiene información de las tablas de dimensiones disponibles.
+    Estas tablas contienen información descriptiva (nombres, descripciones) que se pueden usar en JOINs.
+    
+    Returns:
+        JSON string con información de dimensiones o None si no hay disponibles
+    """
+    return _to_json(_get_dimensions_impl())
+
+
+@tool
+def generate_sql_tool(
+    question: str,
+    schema: str,
+    table_id: str,
+    dimensions_info: Optional[str] = None,
+    conversation_history: Optional[str] = None
+) -> str:
+    """
+    Genera SQL desde una pregunta en lenguaje natural usando Gemini.
+    
+    Args:
+        question: Pregunta del usuario en lenguaje natural
+        schema: Schema de la tabla principal (obtenido con get_schema_tool, como JSON string)
+        table_id: ID completo de la tabla (project.dataset.table)
+        dimensions_info: Información de tablas de dimensiones (opcional, como JSON string)
+        conversation_history: Historial de conversación anterior (opcional, como JSON string)
+    
+    Returns:
+        JSON string con 'sql' generado y metadata
+    """
+    try:
+        # Parsear inputs JSON
+        schema_data = orjson.loads(schema) if isinstance(schema, str) else schema
+        schema_text = schema_data.get("schema") if isinstance(schema_data, dict) else schema
+        
+        dim_info = None
+        if dimensions_info:
+            dim_data = orjson.loads(dimensions_info) if isinstance(dimensions_info, str) else dimensions_info
+            dim_info = dim_data.get("dimensions") if isinstance(dim_data, dict) else dim_data
+        
+        conv_history = None
+        if conversation_history:
+            conv_history = orjson.loads(conversation_history) if isinstance(conversation_history, str) else conversation_history
+    except Exception as e:
+        log_error(f"❌ [Tool] Error parsing generate_sql_tool inputs", e)
+        return _to_json({"sql": None, "success": False, "error": str(e)})
+    
+    return _to_json(_generate_sql_impl(question, schema_text, table_id, dim_info, conv_history))
+
+
+@tool
+def execute_query_tool(sql: Union[str, Dict[str, Any]], max_rows: int = 100) -> str:
+    """
+    Ejecuta una consulta SQL en BigQuery.
+    
+    Args:
+        sql: Consulta SQL a ejecutar. Pasar el SQL crudo como string
+             (también se acepta el objeto resultado de generate_sql_tool, con campo "sql")
+        max_rows: Número máximo de filas a retornar (default: 100)
+    
+    Returns:
+        JSON string con resultados de la consulta (columns, rows, total_rows, etc.)
+    """
+    # ⚡ Despacho por tipo: el schema del tool ya distingue string de objeto,
+    # no hace falta adivinar si un string "parece" JSON
+    sql_query = sql.get("sql", "") if isinstance(sql, dict) else sql
+    
+    return _to_json(_execute_query_impl(sql_query, max_rows=max_rows))
+
+
+@tool
+def recommend_chart_tool(
+    question: str,
+    columns: str,
+    rows: str,
+    max_rows_sample: int = _CHART_MAX_ROWS_SAMPLE
+) -> str:
+    """
+    Analiza los resultados de una consulta y recomienda el tipo de gráfico más apropiado.
+    
+    Args:
+        question: Pregunta original del usuario
+        columns: Lista de nombres de columnas (como JSON string)
+        rows: Lista de filas de datos (como JSON string)
+        max_rows_sample: Número máximo de filas a analizar (default: CHART_MAX_ROWS_SAMPLE)
+    
+    Returns:
+        JSON string con 'chart_type' y 'chart_config' o None si no se recomienda gráfico
+    """
+    try:
+        # Parsear inputs JSON
+        cols = orjson.loads(columns) if isinstance(columns, str) else columns
+        rws = orjson.loads(rows) if isinstance(rows, str) else rows
+    except Exception as e:
+        log_warning("⚠️  [Tool] Error parsing recommend_chart_tool inputs: %s", e)
+        return _to_json({"success": False, "chart_type": None, "chart_config": None, "error": str(e)})
+    
+    return _to_json(_recommend_chart_impl(question, cols, rws, max_rows_sample=max_rows_sample))
 
 
 # Lista de todas las herramientas disponibles
@@ -319,6 +430,68 @@ TOOLS = [
 ]
 
 
+# ============================================================================
+# Ejecutor de Herramientas
+# ============================================================================
+
+# Herramientas idempotentes (solo lectura) que se pueden ejecutar en paralelo
+_PARALLEL_SAFE_TOOLS = frozenset({
+    "get_schema_tool",
+    "get_dimensions_tool",
+    "generate_sql_tool",
+    "execute_query_tool",
+    "recommend_chart_tool",
+})
+
+
+class FastToolNode:
+    """
+    Ejecutor especializado para nuestras herramientas conocidas.
+    
+    Los tool calls de herramientas de confianza se despachan directo a su función,
+    sin re-validar los argumentos contra el schema Pydantic de cada herramienta.
+    Si el LLM pide una herramienta desconocida, se delega al ToolNode genérico.
+    """
+    
+    def __init__(self, tools: List):
+        self._tools = {t.name: t for t in tools}
+        self._fallback = ToolNode(tools)
+    
+    def __call__(self, state: AgentState) -> Dict[str, Any]:
+        messages = state.get("messages", [])
+        last_message = messages[-1] if messages else None
+        tool_calls = getattr(last_message, "tool_calls", None) or []
+        
+        if any(tc["name"] not in self._tools for tc in tool_calls):
+            return self._fallback.invoke(state)
+        
+        # ⚡ Si el LLM pidió varias herramientas en un mismo turno y todas son seguras
+        # para correr en paralelo, el turno tarda max(t_i) en lugar de sum(t_i).
+        # map preserva el orden, así cada ToolMessage conserva su tool_call_id.
+        if len(tool_calls) > 1 and all(tc["name"] in _PARALLEL_SAFE_TOOLS for tc in tool_calls):
+            return {"messages": list(_EXECUTOR.map(self._run_one, tool_calls))}
+        
+        return {"messages": [self._run_one(tc) for tc in tool_calls]}
+    
+    def _run_one(self, tool_call: Dict[str, Any]) -> ToolMessage:
+        """Ejecuta un tool call y lo envuelve en un ToolMessage"""
+        tool_ = self._tools[tool_call["name"]]
+        try:
+            # Validar con el schema del tool (como hace ToolNode): Vertex manda los números como
+            # float (max_rows=100.0) y sin coerción terminarían en el SQL ("LIMIT 100.0")
+            args = tool_.args_schema.model_validate(tool_call.get("args", {}))
+            content = tool_.func(**{name: getattr(args, name) for name in tool_.args_schema.model_fields})
+        except Exception as e:
+            log_error(f"❌ [Tool] Error running {tool_call['name']}", e)
+            content = _to_json({"success": False, "error": str(e)})
+        
+        return ToolMessage(
+            content=content,
+            name=tool_call["name"],
+            tool_call_id=tool_call["id"]
+        )
+
+
 # ============================================================================
 # Nodos del Grafo
 # ============================================================================
@@ -326,7 +499,7 @@ TOOLS = [
 def start_node(state: AgentState) -> AgentState:
     """Nodo inicial: prepara el estado del agente"""
     request_id = state.get("request_id", "unknown")
-    log_info(f"[{request_id}] 🚀 Starting LangGraph agent")
+    log_info("[%s] 🚀 Starting LangGraph agent", request_id)
     
     # Inicializar mensajes si no existen
     if "messages" not in state or not state["messages"]:
@@ -344,7 +517,7 @@ def agent_node(state: AgentState, model: ChatVertexAI) -> AgentState:
     Nodo principal del agente: el LLM decide qué herramienta usar
     """
     request_id = state.get("request_id", "unknown")
-    log_info(f"[{request_id}] 🤖 Agent deciding next action...")
+    log_info("[%s] 🤖 Agent deciding next action...", request_id)
     
     messages = state.get("messages", [])
     
@@ -367,11 +540,11 @@ def should_continue(state: AgentState) -> str:
     
     # Si el último mensaje tiene tool_calls, ejecutar herramientas
     if hasattr(last_message, 'tool_calls') and last_message.tool_calls:
-        log_info(f"[{request_id}] 🔧 Agent decided to use tools: {[tc['name'] for tc in last_message.tool_calls]}")
+        log_info("[%s] 🔧 Agent decided to use tools: %s", request_id, [tc['name'] for tc in last_message.tool_calls])
         return "tools"
     
     # Si no hay tool_calls, finalizar
-    log_info(f"[{request_id}] ✅ Agent completed without more tools")
+    log_info("[%s] ✅ Agent completed without more tools", request_id)
     return "end"
 
 
@@ -380,7 +553,7 @@ def finalize_node(state: AgentState) -> AgentState:
     Nodo final: prepara la respuesta final del agente
     """
     request_id = state.get("request_id", "unknown")
-    log_info(f"[{request_id}] 📦 Finalizing agent response...")
+    log_info("[%s] 📦 Finalizing agent response...", request_id)
     
     messages = state.get("messages", [])
     
@@ -400,25 +573,47 @@ def finalize_node(state: AgentState) -> AgentState:
 # Construcción del Grafo
 # ============================================================================
 
-def create_agent_graph() -> StateGraph:
+# ⚡ El modelo con herramientas y el grafo compilado se construyen una sola vez por proceso
+# (bind_tools re-serializa los schemas de todas las herramientas)
+# ⚡ Grafo compilado y modelo con herramientas, reutilizados entre requests
+# Se identifican por (modelo, herramientas): solo se recompilan si cambia GEMINI_MODEL
+_MODEL_WITH_TOOLS = None
+_COMPILED_GRAPH = None
+_COMPILED_GRAPH_KEY: Optional[tuple] = None
+_COMPILED_GRAPH_LOCK = threading.Lock()
+
+
+def _get_model_name() -> str:
+    """Nombre del modelo Gemini configurado"""
+    return os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
+
+
+def _get_model_with_tools(model_name: Optional[str] = None):
+    """Retorna el modelo Gemini con las herramientas bindeadas (memoizado)"""
+    global _MODEL_WITH_TOOLS
+    if _MODEL_WITH_TOOLS is None:
+        # Inicializar el modelo LLM con Vertex AI Gemini
+        project_id = os.getenv("PROJECT_ID")
+        location = os.getenv("VERTEX_LOCATION", "us-central1")
+        
+        model = ChatVertexAI(
+            model_name=model_name or _get_model_name(),
+            project=project_id,
+            location=location,
+            temperature=0,
+            max_tokens=1024,
+        )
+        
+        # Bindear herramientas al modelo
+        _MODEL_WITH_TOOLS = model.bind_tools(TOOLS)
+    return _MODEL_WITH_TOOLS
+
+
+def create_agent_graph(model_name: Optional[str] = None) -> StateGraph:
     """
     Crea y retorna el grafo del agente LangGraph
     """
-    # Inicializar el modelo LLM con Vertex AI Gemini
-    project_id = os.getenv("PROJECT_ID")
-    location = os.getenv("VERTEX_LOCATION", "us-central1")
-    model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
-    
-    model = ChatVertexAI(
-        model_name=model_name,
-        project=project_id,
-        location=location,
-        temperature=0,
-        max_tokens=1024,
-    )
-    
-    # Bindear herramientas al modelo
-    model_with_tools = model.bind_tools(TOOLS)
+    model_with_tools = _get_model_with_tools(model_name)
     
     # Crear grafo
     workflow = StateGraph(AgentState)
@@ -426,7 +621,7 @@ def create_agent_graph() -> StateGraph:
     # Agregar nodos
     workflow.add_node("start", start_node)
     workflow.add_node("agent", lambda state: agent_node(state, model_with_tools))
-    workflow.add_node("tools", ToolNode(TOOLS))
+    workflow.add_node("tools", FastToolNode(TOOLS))
     workflow.add_node("finalize", finalize_node)
     
     # Definir edges
@@ -446,6 +641,426 @@ def create_agent_graph() -> StateGraph:
     return workflow.compile()
 
 
+def get_compiled_graph():
+    """
+    Retorna el grafo del agente compilado (singleton por modelo + herramientas).
+    Se compila una sola vez; si cambia GEMINI_MODEL se descarta y se vuelve a compilar.
+    """
+    global _MODEL_WITH_TOOLS, _COMPILED_GRAPH, _COMPILED_GRAPH_KEY
+    model_name = _get_model_name()
+    key = (model_name, tuple(t.name for t in TOOLS))
+    if _COMPILED_GRAPH is not None and _COMPILED_GRAPH_KEY == key:
+        return _COMPILED_GRAPH
+    
+    with _COMPILED_GRAPH_LOCK:
+        if _COMPILED_GRAPH is None or _COMPILED_GRAPH_KEY != key:
+            if _COMPILED_GRAPH_KEY is not None:
+                log_info("🔄 Model changed to %s, recompiling agent graph", model_name)
+            _MODEL_WITH_TOOLS = None
+            _COMPILED_GRAPH = create_agent_graph(model_name)
+            _COMPILED_GRAPH_KEY = key
+    return _COMPILED_GRAPH
+
+
+# ============================================================================
+# Caché de SQL generado (NL → SQL)
+# ============================================================================
+
+# ⚡ Preguntas repetidas (o casi idénticas) no vuelven a llamar a Gemini
+# Límites de memoria: máximo 512 entradas, con expiración por TTL
+_MAX_SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_MAX_SIZE", "512"))
+_SQL_CACHE_TTL_SECONDS = int(os.getenv("SQL_CACHE_TTL_SECONDS", "3600"))
+_SQL_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (sql, stored_at)
+_SQL_CACHE_STATS = {"hits": 0, "misses": 0}
+_SQL_CACHE_LOCK = threading.Lock()
+
+
+# Solo se descartan los signos de apertura/cierre de la pregunta: operadores (<, >, =),
+# decimales, comas y guiones cambian el significado y deben seguir en la clave
+_QUESTION_EDGE_PUNCTUATION = "¿¡?!. "
+
+
+def _normalize_question(question: str) -> str:
+    """
+    Forma canónica de la pregunta: espacios colapsados, sin ¿¡ iniciales ni ?!. finales.
+    Conserva mayúsculas: los literales ('ACME' vs 'acme') cambian el SQL en BigQuery.
+    """
+    return re.sub(r'\s+', ' ', question).strip(_QUESTION_EDGE_PUNCTUATION)
+
+
+def _sql_cache_key(
+    question: str,
+    table_full_id: str,
+    schema: str,
+    conversation_history: Optional[List[Dict]] = None,
+    dimensions_info: Optional[Dict] = None
+) -> tuple:
+    """
+    Construye la clave del caché de SQL.
+    Incluye los hashes del schema y de las dimensiones para invalidar automáticamente si
+    cambian (el prompt depende de ambos), y el historial porque preguntas como
+    "the same by month" dependen del contexto.
+    """
+    schema_hash = hashlib.md5(schema.encode()).hexdigest()
+    return (
+        _normalize_question(question), table_full_id, schema_hash,
+        _dimensions_digest(dimensions_info), _history_digest(conversation_history)
+    )
+
+
+def _dimensions_digest(dimensions_info: Optional[Dict]) -> Optional[str]:
+    """Hash de las dimensiones que ve el prompt (None si no hay)"""
+    if not dimensions_info:
+        return None
+    return hashlib.md5(orjson.dumps(dimensions_info, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
+
+def _history_digest(conversation_history: Optional[List[Dict]]) -> Optional[str]:
+    """
+    Hash del historial tal como lo ve el prompt: solo los últimos HISTORY_WINDOW mensajes
+    y solo los campos que usa el prompt (role, content, primeros 100 caracteres del SQL).
+    
+    ⚡ El costo queda acotado por la ventana, no por el largo de la sesión: en chats
+    largos ya no se re-serializa toda la conversación en cada request. Además, dos
+    historiales que producen el mismo prompt comparten la entrada del caché.
+    """
+    if not conversation_history:
+        return None
+    window = [
+        (msg.get("role"), msg.get("content", ""), (msg.get("sql") or "")[:100])
+        for msg in conversation_history[-HISTORY_WINDOW:]
+    ]
+    return hashlib.md5(orjson.dumps(window, default=str)).hexdigest()
+
+
+def _get_cached_sql(key: tuple) -> Optional[str]:
+    """Retorna el SQL cacheado para la clave, o None si no existe o expiró"""
+    with _SQL_CACHE_LOCK:
+        entry = _SQL_CACHE.get(key)
+        if entry is not None and time.time() - entry[1] > _SQL_CACHE_TTL_SECONDS:
+            del _SQL_CACHE[key]
+            entry = None
+        if entry is None:
+            _SQL_CACHE_STATS["misses"] += 1
+            return None
+        _SQL_CACHE_STATS["hits"] += 1
+        _SQL_CACHE.move_to_end(key)
+        return entry[0]
+
+
+def _store_cached_sql(key: tuple, sql: str):
+    """Guarda el SQL generado en el caché (LRU)"""
+    with _SQL_CACHE_LOCK:
+        _SQL_CACHE[key] = (sql, time.time())
+        _SQL_CACHE.move_to_end(key)
+        if len(_SQL_CACHE) > _MAX_SQL_CACHE_SIZE:
+            _SQL_CACHE.popitem(last=False)
+
+
+def clear_sql_cache():
+    """Limpia el caché de SQL generado"""
+    with _SQL_CACHE_LOCK:
+        count = len(_SQL_CACHE)
+        _SQL_CACHE.clear()
+    log_info("🧹 SQL cache cleared: %s entries", count)
+
+
+def get_sql_cache_stats() -> Dict[str, Any]:
+    """Obtiene estadísticas del caché de SQL para monitoreo de memoria"""
+    return {
+        "sql_cache_size": len(_SQL_CACHE),
+        "sql_cache_max": _MAX_SQL_CACHE_SIZE,
+        "sql_cache_ttl_seconds": _SQL_CACHE_TTL_SECONDS,
+        "sql_cache_hits": _SQL_CACHE_STATS["hits"],
+        "sql_cache_misses": _SQL_CACHE_STATS["misses"]
+    }
+
+
+# ============================================================================
+# Pipeline NL → SQL (grafo con fan-out paralelo)
+# ============================================================================
+
+class PipelineState(TypedDict):
+    """Estado del pipeline determinista que usa run_agent"""
+    question: str
+    conversation_history: Optional[List[Dict]]
+    request_id: str
+    schema: Optional[str]
+    table_full_id: Optional[str]
+    dimensions_info: Optional[Dict]
+    sql: Optional[str]
+    sql_cache_key: Optional[tuple]
+    sub_questions: Optional[List[str]]
+    query_result: Optional[Dict]
+    chart_recommendation: Optional[Dict]
+    # Las ramas paralelas agregan sus pasos a la misma lista
+    steps: Annotated[List[Dict], operator.add]
+
+
+def fan_out_context(state: PipelineState) -> List[Send]:
+    """
+    Lanza en paralelo las ramas de schema y dimensiones.
+    ⚡ Son independientes, así que el tiempo total es max(t1, t2) en lugar de t1 + t2
+    """
+    request_id = state.get("request_id", "unknown")
+    log_info("[%s] Steps 1-2: Getting schema and dimensions in parallel...", request_id)
+    return [Send("schema_branch", state), Send("dims_branch", state)]
+
+
+def schema_branch(state: PipelineState) -> Dict[str, Any]:
+    """Rama paralela: obtiene el schema de la tabla principal"""
+    with timed_step("Get Schema") as step:
+        schema_result = _get_schema_impl()
+    
+    if not schema_result.get("schema"):
+        raise Exception("No se pudo obtener el schema de la tabla")
+    
+    return {
+        "schema": schema_result["schema"],
+        "table_full_id": schema_result.get("table_id"),
+        "steps": [step]
+    }
+
+
+def dims_branch(state: PipelineState) -> Dict[str, Any]:
+    """Rama paralela: obtiene las dimensiones (opcional, nunca falla el pipeline)"""
+    with timed_step("Get Dimensions") as step:
+        dim_result = _get_dimensions_impl()
+    
+    return {
+        "dimensions_info": dim_result.get("dimensions") if dim_result.get("success") else None,
+        "steps": [step]
+    }
+
+
+# ⚡ Descomposición de preguntas compuestas (QueryDecomposer)
+# Solo se consulta a Gemini si la pregunta contiene palabras de comparación
+_DECOMPOSE_ENABLED = os.getenv("AGENT_DECOMPOSE_ENABLED", "false").lower() == "true"
+_COMPARISON_PATTERN = re.compile(
+    r'\b(compare|compared|comparing|comparison|versus|vs|against|comparar|compara|comparado|comparación|frente a)\b',
+    re.IGNORECASE
+)
+
+
+def plan_node(state: PipelineState) -> Dict[str, Any]:
+    """Decide si la pregunta se resuelve con una sola query o con sub-queries en paralelo"""
+    question = state["question"]
+    if not _DECOMPOSE_ENABLED or not _COMPARISON_PATTERN.search(question):
+        return {"sub_questions": None}
+    
+    request_id = state.get("request_id", "unknown")
+    with timed_step("Decompose Question") as step:
+        log_info("[%s] Step 3a: Checking if question can be decomposed...", request_id)
+        sub_questions = decompose_question(question)
+    
+    return {
+        "sub_questions": sub_questions if len(sub_questions) > 1 else None,
+        "steps": [step]
+    }
+
+
+def route_plan(state: PipelineState) -> str:
+    """Enrutamiento: sub-queries en paralelo o flujo de una sola query"""
+    return "decomposed" if state.get("sub_questions") else "single"
+
+
+def _merge_sub_results(sub_questions: List[str], sub_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Apila los resultados de las sub-queries alineando columnas por nombre.
+    Agrega una primera columna 'sub_question' para identificar el origen de cada fila.
+    """
+    columns: List[str] = []
+    for result in sub_results:
+        for col in result.get("columns", []):
+            if col not in columns:
+                columns.append(col)
+    
+    rows = []
+    for sub_question, result in zip(sub_questions, sub_results):
+        col_index = {col: i for i, col in enumerate(result.get("columns", []))}
+        for row in result.get("rows", []):
+            rows.append([sub_question] + [
+                row[col_index[col]] if col in col_index else None for col in columns
+            ])
+    
+    return {
+        "success": True,
+        "columns": ["sub_question"] + columns,
+        "rows": rows,
+        "total_rows": len(rows)
+    }
+
+
+def decomposed_node(state: PipelineState) -> Dict[str, Any]:
+    """Genera y ejecuta el SQL de cada sub-pregunta en paralelo y combina los resultados"""
+    request_id = state.get("request_id", "unknown")
+    sub_questions = state["sub_questions"]
+    conversation_history = state.get("conversation_history")
+    
+    def _solve(sub_question: str) -> Dict[str, Any]:
+        cache_key = _sql_cache_key(
+            sub_question, state["table_full_id"], state["schema"], conversation_history, state.get("dimensions_info")
+        )
+        sql = _get_cached_sql(cache_key)
+        if not sql:
+            sql_result = _generate_sql_impl(
+                question=sub_question,
+                schema=state["schema"],
+                table_id=state["table_full_id"],
+                dimensions_info=state.get("dimensions_info"),
+                conversation_history=conversation_history
+            )
+            sql = sql_result.get("sql")
+            if not sql:
+                raise Exception(f"Error generando SQL: {sql_result.get('error', 'Unknown error')}")
+        query_result = _execute_query_impl(sql)
+        if not query_result.get("success"):
+            raise Exception(f"Error ejecutando query: {query_result.get('error', 'Unknown error')}")
+        _store_cached_sql(cache_key, sql)
+        return {"sql": sql, "query_result": query_result}
+    
+    with timed_step("Generate + Execute Sub-queries") as step:
+        log_info("[%s] Steps 3-4: Solving %s sub-questions in parallel...", request_id, len(sub_questions))
+        solved = list(_EXECUTOR.map(_solve, sub_questions))
+    
+    return {
+        "sql": ";\n\n".join(s["sql"] for s in solved),
+        "query_result": _merge_sub_results(sub_questions, [s["query_result"] for s in solved]),
+        "steps": [step]
+    }
+
+
+def sql_node(state: PipelineState) -> Dict[str, Any]:
+    """Genera el SQL (o lo reutiliza del caché) una vez que ambas ramas terminaron"""
+    request_id = state.get("request_id", "unknown")
+    question = state["question"]
+    conversation_history = state.get("conversation_history")
+    
+    with timed_step("Generate SQL") as step:
+        cache_key = _sql_cache_key(
+            question, state["table_full_id"], state["schema"], conversation_history, state.get("dimensions_info")
+        )
+        sql = _get_cached_sql(cache_key)
+        
+        if sql:
+            log_info("[%s] Step 3: ✨ SQL obtained from cache", request_id)
+            step["name"] = "Generate SQL (cache)"
+        else:
+            log_info("[%s] Step 3: Generating SQL...", request_id)
+            sql_result = _generate_sql_impl(
+                question=question,
+                schema=state["schema"],
+                table_id=state["table_full_id"],
+                dimensions_info=state.get("dimensions_info"),
+                conversation_history=conversation_history
+            )
+            sql = sql_result.get("sql")
+    
+    if not sql:
+        raise Exception(f"Error generando SQL: {sql_result.get('error', 'Unknown error')}")
+    
+    return {
+        "sql": sql,
+        "sql_cache_key": cache_key,
+        "steps": [step]
+    }
+
+
+def query_node(state: PipelineState) -> Dict[str, Any]:
+    """Ejecuta el SQL en BigQuery"""
+    request_id = state.get("request_id", "unknown")
+    with timed_step("Execute Query") as step:
+        log_info("[%s] Step 4: Executing query...", request_id)
+        query_result = _execute_query_impl(state["sql"])
+    
+    if not query_result.get("success"):
+        error = query_result.get("message") or query_result.get("error", "Unknown error")
+        raise Exception(f"Error ejecutando query: {error}")
+    
+    # Solo cachear SQL que BigQuery ejecutó correctamente
+    _store_cached_sql(state["sql_cache_key"], state["sql"])
+    
+    return {
+        "query_result": query_result,
+        "steps": [step]
+    }
+
+
+def should_recommend_chart(state: PipelineState) -> str:
+    """Enrutamiento: solo recomendar chart si hay resultados (y no demasiados)"""
+    query_result = state.get("query_result") or {}
+    total_rows = query_result.get("total_rows", 0)
+    if 0 < total_rows <= 100 and _is_chartable(query_result.get("columns", []), query_result.get("rows", [])):
+        return "chart"
+    return "end"
+
+
+def chart_node(state: PipelineState) -> Dict[str, Any]:
+    """Recomienda el tipo de gráfico para los resultados"""
+    request_id = state.get("request_id", "unknown")
+    query_result = state["query_result"]
+    with timed_step("Recommend Chart") as step:
+        log_info("[%s] Step 5: Recommending chart...", request_id)
+        chart_result = _recommend_chart_impl(
+            question=state["question"],
+            columns=query_result.get("columns", []),
+            rows=query_result.get("rows", [])[:_CHART_MAX_ROWS_SAMPLE],
+            max_rows_sample=_CHART_MAX_ROWS_SAMPLE
+        )
+    
+    return {
+        "chart_recommendation": chart_result if chart_result.get("success") else None,
+        "steps": [step]
+    }
+
+
+def create_pipeline_graph():
+    """
+    Crea el grafo del pipeline NL → SQL:
+    
+        START ─┬─ schema_branch ─┬─ plan_node ─┬─ sql_node → query_node ─┬─(si hay filas)→ chart_node → END
+               └─ dims_branch ───┘             └─ decomposed_node ────────┘
+    """
+    workflow = StateGraph(PipelineState)
+    
+    workflow.add_node("schema_branch", schema_branch)
+    workflow.add_node("dims_branch", dims_branch)
+    workflow.add_node("plan_node", plan_node)
+    workflow.add_node("decomposed_node", decomposed_node)
+    workflow.add_node("sql_node", sql_node)
+    workflow.add_node("query_node", query_node)
+    workflow.add_node("chart_node", chart_node)
+    
+    # Fan-out con Send y join: sql_node espera a que terminen ambas ramas
+    workflow.add_conditional_edges(START, fan_out_context, ["schema_branch", "dims_branch"])
+    workflow.add_edge(["schema_branch", "dims_branch"], "plan_node")
+    workflow.add_conditional_edges(
+        "plan_node",
+        route_plan,
+        {
+            "single": "sql_node",
+            "decomposed": "decomposed_node"
+        }
+    )
+    workflow.add_edge("sql_node", "query_node")
+    for node in ("query_node", "decomposed_node"):
+        workflow.add_conditional_edges(
+            node,
+            should_recommend_chart,
+            {
+                "chart": "chart_node",
+                "end": END
+            }
+        )
+    workflow.add_edge("chart_node", END)
+    
+    return workflow.compile()
+
+
+# El pipeline no depende de variables de entorno, así que se compila una sola vez al importar
+_PIPELINE_GRAPH = create_pipeline_graph()
+
+
 # ============================================================================
 # Función Principal para Ejecutar el Agente
 # ============================================================================
@@ -458,9 +1073,8 @@ def run_agent(
     """
     Ejecuta el agente LangGraph para procesar una pregunta y generar resultados.
     
-    Por ahora, usa un enfoque simplificado que ejecuta las herramientas en secuencia
-    pero usando LangGraph como orquestador. Esto asegura compatibilidad mientras
-    el agente se ajusta para tomar decisiones más inteligentes.
+    Usa el pipeline compilado (ver create_pipeline_graph): schema y dimensiones se
+    obtienen en paralelo, luego se genera el SQL, se ejecuta y se recomienda un gráfico.
     
     Args:
         question: Pregunta del usuario en lenguaje natural
@@ -470,110 +1084,220 @@ def run_agent(
     Returns:
         Dict con los resultados: sql, columns, rows, total_rows, chart_type, chart_config, etc.
     """
-    start_time = time.time()
-    log_info(f"[{request_id}] 🎯 Running LangGraph agent for: {question[:50]}...")
+    start_ns = time.perf_counter_ns()
+    log_info("[%s] 🎯 Running LangGraph agent for: %s...", request_id, question[:50])
+    
+    # ⚡ Preguntas de métricas canónicas: responder desde memoria (sin Gemini ni BigQuery)
+    if not conversation_history:
+        metric_result = _answer_from_metrics(question, request_id, start_ns)
+        if metric_result:
+            return metric_result
     
     try:
-        # Por ahora, usar flujo secuencial pero estructurado con herramientas
-        # Esto permite migración gradual a un agente más inteligente
-        steps = []
-        
-        # Paso 1: Obtener schema
-        step_start = time.time()
-        log_info(f"[{request_id}] Step 1: Getting schema...")
-        schema_result_str = get_schema_tool.invoke({})
-        import json
-        schema_result = json.loads(schema_result_str)
-        schema = schema_result.get("schema")
-        table_full_id = schema_result.get("table_id")
-        step_duration = (time.time() - step_start) * 1000
-        steps.append({"name": "Get Schema", "duration_ms": step_duration})
-        
-        if not schema:
-            raise Exception("No se pudo obtener el schema de la tabla")
-        
-        # Paso 2: Obtener dimensiones (opcional)
-        step_start = time.time()
-        log_info(f"[{request_id}] Step 2: Getting dimensions...")
-        dim_result_str = get_dimensions_tool.invoke({})
-        dim_result = json.loads(dim_result_str)
-        dimensions_info = dim_result.get("dimensions") if dim_result.get("success") else None
-        step_duration = (time.time() - step_start) * 1000
-        steps.append({"name": "Get Dimensions", "duration_ms": step_duration})
-        
-        # Paso 3: Generar SQL
-        step_start = time.time()
-        log_info(f"[{request_id}] Step 3: Generating SQL...")
-        # Preparar inputs para generate_sql_tool
-        schema_json = json.dumps({"schema": schema, "table_id": table_full_id})
-        dim_json = json.dumps({"dimensions": dimensions_info}) if dimensions_info else None
-        conv_json = json.dumps(conversation_history) if conversation_history else None
-        
-        sql_result_str = generate_sql_tool.invoke({
+        final_state = _PIPELINE_GRAPH.invoke({
             "question": question,
-            "schema": schema_json,
-            "table_id": table_full_id,
-            "dimensions_info": dim_json,
-            "conversation_history": conv_json
+            "conversation_history": conversation_history,
+            "request_id": request_id,
+            "steps": []
         })
-        sql_result = json.loads(sql_result_str)
-        sql = sql_result.get("sql")
-        step_duration = (time.time() - step_start) * 1000
-        steps.append({"name": "Generate SQL", "duration_ms": step_duration})
-        
-        if not sql:
-            raise Exception(f"Error generando SQL: {sql_result.get('error', 'Unknown error')}")
-        
-        # Paso 4: Ejecutar query
-        step_start = time.time()
-        log_info(f"[{request_id}] Step 4: Executing query...")
-        query_result_str = execute_query_tool.invoke({"sql": sql})
-        query_result = json.loads(query_result_str)
-        step_duration = (time.time() - step_start) * 1000
-        steps.append({"name": "Execute Query", "duration_ms": step_duration})
-        
-        if not query_result.get("success"):
-            raise Exception(f"Error ejecutando query: {query_result.get('error', 'Unknown error')}")
-        
-        # Paso 5: Recomendar chart (opcional, solo si hay resultados)
-        chart_recommendation = None
-        if query_result.get("total_rows", 0) > 0 and query_result.get("total_rows", 0) <= 100:
-            step_start = time.time()
-            log_info(f"[{request_id}] Step 5: Recommending chart...")
-            chart_result_str = recommend_chart_tool.invoke({
-                "question": question,
-                "columns": json.dumps(query_result.get("columns", [])),
-                "rows": json.dumps(query_result.get("rows", []))
-            })
-            chart_result = json.loads(chart_result_str)
-            chart_recommendation = chart_result if chart_result.get("success") else None
-            step_duration = (time.time() - step_start) * 1000
-            steps.append({"name": "Recommend Chart", "duration_ms": step_duration})
-        
-        # Preparar respuesta final
-        total_time_ms = (time.time() - start_time) * 1000
-        
-        result = {
-            "sql": sql,
-            "columns": query_result.get("columns", []),
-            "rows": query_result.get("rows", []),
-            "total_rows": query_result.get("total_rows", 0),
-            "chart_type": chart_recommendation.get("chart_type") if chart_recommendation else None,
-            "chart_config": chart_recommendation.get("chart_config") if chart_recommendation else None,
-            "duration_ms": total_time_ms,
-            "steps": steps
-        }
-        
-        log_info(f"[{request_id}] ✅ Agent completed in {total_time_ms/1000:.2f}s")
-        return result
+        return _build_agent_result(final_state, start_ns, request_id)
         
     except Exception as e:
         log_error(f"[{request_id}] ❌ Error running agent", e)
         # Fallback al flujo tradicional
-        log_info(f"[{request_id}] 🔄 Using traditional flow as fallback...")
+        log_info("[%s] 🔄 Using traditional flow as fallback...", request_id)
         return _fallback_traditional_flow(question, conversation_history, request_id)
 
 
+async def run_agent_async(
+    question: str,
+    conversation_history: Optional[List[Dict]] = None,
+    request_id: str = "unknown"
+) -> Dict[str, Any]:
+    """
+    Versión async de run_agent para usar directamente desde los endpoints de FastAPI.
+    
+    ⚡ El pipeline se ejecuta con ainvoke: mientras se espera a Gemini y BigQuery el
+    event loop queda libre para atender otros requests. Los nodos (síncronos) corren en
+    threads y el fan-out de schema/dimensiones sigue siendo paralelo.
+    
+    Args:
+        question: Pregunta del usuario en lenguaje natural
+        conversation_history: Historial de conversación anterior (opcional)
+        request_id: ID único del request para logging
+    
+    Returns:
+        Dict con los resultados (mismo formato que run_agent)
+    """
+    start_ns = time.perf_counter_ns()
+    log_info("[%s] 🎯 Running LangGraph agent (async) for: %s...", request_id, question[:50])
+    
+    if not conversation_history:
+        metric_result = await asyncio.to_thread(_answer_from_metrics, question, request_id, start_ns)
+        if metric_result:
+            return metric_result
+    
+    try:
+        final_state = await _PIPELINE_GRAPH.ainvoke({
+            "question": question,
+            "conversation_history": conversation_history,
+            "request_id": request_id,
+            "steps": []
+        })
+        return _build_agent_result(final_state, start_ns, request_id)
+        
+    except Exception as e:
+        log_error(f"[{request_id}] ❌ Error running agent", e)
+        log_info("[%s] 🔄 Using traditional flow as fallback...", request_id)
+        return await asyncio.to_thread(_fallback_traditional_flow, question, conversation_history, request_id)
+
+
+def _rows_event(query_result: Dict[str, Any]) -> Dict[str, Any]:
+    """Evento de streaming con las filas de un resultado de query"""
+    return {
+        "type": "rows",
+        "columns": query_result.get("columns", []),
+        "rows": query_result.get("rows", []),
+        "total_rows": query_result.get("total_rows", 0)
+    }
+
+
+def _chart_event(chart_type: Optional[str], chart_config: Optional[Dict]) -> Dict[str, Any]:
+    """Evento de streaming con la recomendación de gráfico"""
+    return {"type": "chart", "chart_type": chart_type, "chart_config": chart_config}
+
+
+def _result_events(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Eventos de streaming de un resultado ya completo (métrica pre-calculada o flujo tradicional)"""
+    events = [{"type": "sql", "sql": result["sql"]}, _rows_event(result)]
+    if result.get("chart_type"):
+        events.append(_chart_event(result["chart_type"], result.get("chart_config")))
+    return events
+
+
+async def stream_agent_async(
+    question: str,
+    conversation_history: Optional[List[Dict]] = None,
+    request_id: str = "unknown"
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Versión streaming de run_agent_async: emite eventos a medida que avanza el pipeline.
+    
+    ⚡ El cliente recibe el SQL apenas se genera y las filas apenas responde BigQuery,
+    sin esperar a la recomendación de gráfico.
+    
+    Yields:
+        Dicts con "type": "sql", "rows", "chart" (solo si hay recomendación) y por último
+        "done" con duration_ms y steps
+    """
+    start_ns = time.perf_counter_ns()
+    log_info("[%s] 🎯 Running LangGraph agent (stream) for: %s...", request_id, question[:50])
+    
+    if not conversation_history:
+        metric_result = await asyncio.to_thread(_answer_from_metrics, question, request_id, start_ns)
+        if metric_result:
+            for event in _result_events(metric_result):
+                yield event
+            yield {"type": "done", "duration_ms": metric_result["duration_ms"], "steps": metric_result["steps"]}
+            return
+    
+    steps = []
+    emitted = set()  # tipos de evento ya enviados al cliente
+    try:
+        async for update in _PIPELINE_GRAPH.astream({
+            "question": question,
+            "conversation_history": conversation_history,
+            "request_id": request_id,
+            "steps": []
+        }, stream_mode="updates"):
+            for node_update in update.values():
+                if not node_update:
+                    continue
+                steps.extend(node_update.get("steps", []))
+                # decomposed_node trae SQL y filas en la misma actualización
+                events = []
+                if node_update.get("sql"):
+                    events.append({"type": "sql", "sql": node_update["sql"]})
+                if node_update.get("query_result") is not None:
+                    events.append(_rows_event(node_update["query_result"]))
+                chart_recommendation = node_update.get("chart_recommendation")
+                if chart_recommendation:
+                    events.append(_chart_event(chart_recommendation.get("chart_type"), chart_recommendation.get("chart_config")))
+                for event in events:
+                    emitted.add(event["type"])
+                    yield event
+        
+    except Exception as e:
+        log_error(f"[{request_id}] ❌ Error running agent", e)
+        if emitted:
+            # El cliente ya recibió parte del resultado: un fallback mandaría SQL/filas duplicados
+            yield {"type": "error", "detail": f"Error procesando la pregunta: {str(e)}"}
+        else:
+            log_info("[%s] 🔄 Using traditional flow as fallback...", request_id)
+            result = await asyncio.to_thread(_fallback_traditional_flow, question, conversation_history, request_id)
+            for event in _result_events(result):
+                yield event
+    
+    total_time_ms = (time.perf_counter_ns() - start_ns) / 1_000_000
+    log_info("[%s] ✅ Agent stream completed in %.2fs", request_id, total_time_ms / 1000)
+    yield {"type": "done", "duration_ms": total_time_ms, "steps": steps}
+
+
+def _build_agent_result(final_state: Dict[str, Any], start_ns: int, request_id: str) -> Dict[str, Any]:
+    """Arma la respuesta final a partir del estado final del pipeline"""
+    query_result = final_state["query_result"]
+    chart_recommendation = final_state.get("chart_recommendation")
+    
+    # Preparar respuesta final
+    total_time_ms = (time.perf_counter_ns() - start_ns) / 1_000_000
+    
+    result = {
+        "sql": final_state["sql"],
+        "columns": query_result.get("columns", []),
+        "rows": query_result.get("rows", []),
+        "total_rows": query_result.get("total_rows", 0),
+        "chart_type": chart_recommendation.get("chart_type") if chart_recommendation else None,
+        "chart_config": chart_recommendation.get("chart_config") if chart_recommendation else None,
+        "duration_ms": total_time_ms,
+        "steps": final_state.get("steps", [])
+    }
+    
+    log_info("[%s] ✅ Agent completed in %.2fs", request_id, total_time_ms / 1000)
+    return result
+
+
+def _answer_from_metrics(question: str, request_id: str, start_ns: int) -> Optional[Dict[str, Any]]:
+    """
+    Si la pregunta coincide con una métrica registrada, retorna el resultado pre-calculado.
+    Retorna None si el atajo está apagado, si no hay coincidencia o si la métrica no pudo calcularse.
+    """
+    if not METRICS_PRECOMPUTE_ENABLED:
+        return None
+    # Los patrones de métricas están en minúsculas
+    metric_name = metric_aggregator.match(_normalize_question(question).lower())
+    if not metric_name:
+        return None
+    
+    with timed_step("Metric cache hit") as step:
+        metric_value = metric_aggregator.get(metric_name)
+    if not metric_value:
+        return None
+    
+    total_time_ms = (time.perf_counter_ns() - start_ns) / 1_000_000
+    log_info("[%s] 📈 Answered from pre-computed metric '%s' in %.1fms", request_id, metric_name, total_time_ms)
+    
+    return {
+        "sql": metric_value["sql"],
+        "columns": metric_value["columns"],
+        "rows": metric_value["rows"],
+        "total_rows": metric_value["total_rows"],
+        "chart_type": None,
+        "chart_config": None,
+        "duration_ms": total_time_ms,
+        "steps": [step]
+    }
+
+
 def _fallback_traditional_flow(
     question: str,
     conversation_history: Optional[List[Dict]],
@@ -582,15 +1306,15 @@ def _fallback_traditional_flow(
     """
     Flujo tradicional como fallback si el agente falla
     """
-    log_info(f"[{request_id}] 🔄 Using traditional flow as fallback...")
+    log_info("[%s] 🔄 Using traditional flow as fallback...", request_id)
     
-    # Obtener schema
-    schema_text, table_full_id = get_table_schema()
+    # Obtener schema (con caché: el schema cambia muy poco)
+    schema_text, table_full_id = get_table_schema(use_cache=True)
     
     # Obtener dimensiones
     dimensions_info = None
     try:
-        dimensions_info = get_dimensions_info(force_refresh=False)
+        dimensions_info = get_current_dimensions()
         if not dimensions_info.get("dimensions"):
             dimensions_info = None
     except:
@@ -601,15 +1325,8 @@ def _fallback_traditional_flow(
     dataset = os.getenv("BQ_DATASET")
     table = os.getenv("BQ_TABLE")
     
-    prompt = get_prompt(
-        question=question,
-        schema=schema_text,
-        project_id=project_id,
-        dataset=dataset,
-        table=table,
-        dimensions_info=dimensions_info,
-        conversation_history=conversation_history
-    )
+    prompt_fn = build_prompt_fn(schema_text, project_id, dataset, table, dimensions_info)
+    prompt = prompt_fn(question, conversation_history)
     
     # Generar SQL
     llm_result = nl_to_sql(prompt)
@@ -625,7 +1342,8 @@ def _fallback_traditional_flow(
             chart_recommendation = recommend_chart_type(
                 question=question,
                 columns=bq_result["columns"],
-                rows=bq_result["rows"]
+                rows=bq_result["rows"][:_CHART_MAX_ROWS_SAMPLE],
+                max_rows_sample=_CHART_MAX_ROWS_SAMPLE
             )
         except:
             pass
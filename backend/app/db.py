@@ -2,86 +2,577 @@
 Módulo para ejecutar queries SQL en BigQuery
 """
 import os
+import re
+import json
+import asyncio
 import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from google.cloud import bigquery
-from typing import Dict, List, Any, Tuple
+from google.api_core import exceptions as gcp_exceptions
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Any, Tuple, Optional, Iterator, Callable, Protocol
 from app.logger import log_info, log_error, log_warning
 
+# Intentar importar el cliente de BigQuery Storage Read API (opcional)
+try:
+    import pyarrow as pa
+    from google.cloud import bigquery_storage
+    BQ_STORAGE_AVAILABLE = True
+except ImportError:
+    bigquery_storage = None
+    BQ_STORAGE_AVAILABLE = False
+
+# Intentar importar el cliente de Redis (opcional, caché compartido entre workers con REDIS_URL)
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    redis = None
+    REDIS_AVAILABLE = False
+
 # ⚡ Caché del schema para evitar consultas repetidas a BigQuery
-# Límites de memoria: máximo 50 schemas en caché
+# Límites de memoria: máximo 50 schemas en caché, con expulsión LRU (el menos usado recientemente)
+# y expiración por TTL para que un cambio de DDL se vea sin reiniciar
 _MAX_SCHEMA_CACHE_SIZE = 50
-_SCHEMA_CACHE: Dict[str, str] = {}
+_SCHEMA_CACHE_TTL_SECONDS = int(os.getenv("SCHEMA_CACHE_TTL_SECONDS", "300"))  # 5 minutos
+_SCHEMA_CACHE: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # table_id -> (schema, stored_at)
+_SCHEMA_LOCK = threading.RLock()
+_SCHEMA_FETCH_LOCKS: Dict[str, threading.Lock] = {}
+# ⚡ Refresh-ahead: si una entrada pasó el 90% de su TTL se sirve igual y se refresca en background,
+# así las requests no pagan el get_table en el camino crítico al vencer el TTL
+_SCHEMA_REFRESH_AHEAD_SECONDS = _SCHEMA_CACHE_TTL_SECONDS * float(os.getenv("SCHEMA_REFRESH_AHEAD_RATIO", "0.9"))
+_SCHEMA_REFRESH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SCHEMA_REFRESH_WORKERS", "4")),
+    thread_name_prefix="schema-refresh"
+)
+_SCHEMA_REFRESHING: set = set()  # table_ids con un refresh en curso (evita encolar duplicados)
 _DIMENSIONS_CACHE: Dict[str, Dict[str, str]] = {}
-_DIMENSIONS_NOT_FOUND_CACHE: set = set()  # Cachear tablas que no existen para no intentar cargarlas repetidamente
+_DIMENSIONS_LOCK = threading.RLock()
+# Cachear tablas que no existen para no intentar cargarlas repetidamente (set LRU: solo importan las claves)
+_DIMENSIONS_NOT_FOUND_CACHE: "OrderedDict[str, None]" = OrderedDict()
 _MAX_DIMENSIONS_NOT_FOUND_CACHE_SIZE = 100  # Máximo 100 tablas "no encontradas" en caché
 
+# ⚡ Versión del dataset de dimensiones (último last_modified_time de sus tablas)
+# El caché de dimensiones solo se invalida cuando esa versión cambia, no por tiempo.
+# La versión se re-verifica como mucho cada DIMENSIONS_VERSION_CHECK_SECONDS.
+_DIMENSIONS_VERSION_CHECK_SECONDS = int(os.getenv("DIMENSIONS_VERSION_CHECK_SECONDS", "300"))  # 5 minutos
+_DIMENSIONS_VERSION: Dict[str, Tuple[Optional[str], float]] = {}  # cache_key -> (versión, verificado_en)
+
+# ⚡ Máximo de get_table concurrentes al cargar dimensiones (límite de concurrencia hacia la API de BigQuery)
+_MAX_DIMENSION_WORKERS = int(os.getenv("DIMENSIONS_MAX_WORKERS", "10"))
+
+# Relaciones fact table -> dimensiones (hardcodeadas según la especificación)
+# ⚡ Constante de módulo: no se reconstruye en cada llamada a get_dimensions_info
+_RELATIONSHIPS: Tuple[Dict[str, str], ...] = (
+    {
+        "fact_column": "product_id",
+        "dim_table": "DimProducts",
+        "dim_column": "product_id"
+    },
+    {
+        "fact_column": "province_id",
+        "dim_table": "DimProvince",
+        "dim_column": "province_id"
+    },
+    {
+        "fact_column": "agreement_date",
+        "dim_table": "DimTime",
+        "dim_column": "date_id"
+    }
+)
+
+
+@lru_cache(maxsize=1)
+def _get_dim_tables() -> Dict[str, str]:
+    """Tablas de dimensiones configuradas (nombre lógico -> nombre de tabla); se leen una sola vez"""
+    return {
+        "DimProducts": os.getenv("BQ_DIM_PRODUCTS", "DimProducts"),
+        "DimProvince": os.getenv("BQ_DIM_PROVINCE", "DimProvince"),
+        "DimTime": os.getenv("BQ_DIM_TIME", "DimTime")
+    }
+
+# ⚡ Caché persistente del schema en disco: sobrevive reinicios y se comparte entre workers
+_SCHEMA_DISK_CACHE_ENABLED = os.getenv("SCHEMA_DISK_CACHE_ENABLED", "true").lower() == "true"
+_SCHEMA_DISK_CACHE_DIR = os.getenv("SCHEMA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "nl2sql_schema_cache"))
+_SCHEMA_DISK_CACHE_TTL_SECONDS = int(os.getenv("SCHEMA_DISK_CACHE_TTL_SECONDS", "900"))  # 15 minutos
+
+# ⚡ Caché compartido entre workers/instancias (Redis, opcional): se activa definiendo REDIS_URL
+# Los dicts en memoria de cada worker quedan como L1 delante de Redis (sin round-trip en lecturas repetidas)
+_SHARED_CACHE_TTL_SECONDS = int(os.getenv("REDIS_CACHE_TTL_SECONDS", "900"))  # 15 minutos
+_SHARED_CACHE_PREFIX = os.getenv("REDIS_CACHE_PREFIX", "nl2sql:")
+
+# ⚡ Cliente de BigQuery compartido por todo el proceso (reutiliza conexiones TCP/TLS)
+_BQ_HTTP_POOL_SIZE = int(os.getenv("BQ_HTTP_POOL_SIZE", "16"))
+_BQ_CLIENT: Optional[bigquery.Client] = None
+_BQ_CLIENT_LOCK = threading.Lock()
+
+# ⚡ Storage Read API: descarga los resultados en bloques Arrow en lugar de paginar JSON por REST
+# Solo conviene para resultados grandes; hasta BQ_STORAGE_API_MIN_ROWS se usa jobs.query (query_and_wait),
+# que resuelve query + primera página en un solo RPC sin crear la sesión de lectura de la Storage API
+_USE_STORAGE_API = os.getenv("BQ_USE_STORAGE_API", "false").lower() in ("1", "true")
+_STORAGE_API_MIN_ROWS = int(os.getenv("BQ_STORAGE_API_MIN_ROWS", "1000"))
+_BQ_STORAGE_CLIENT = None
+
+# ⚡ Control de costo: dry-run antes de ejecutar (BigQuery estima los bytes sin escanear)
+# Si la query generada escanearía más de BQ_COST_GATE_MAX_BYTES se rechaza sin ejecutarla
+_COST_GATE_ENABLED = os.getenv("BQ_COST_GATE_ENABLED", "true").lower() == "true"
+_COST_GATE_MAX_BYTES = int(os.getenv("BQ_COST_GATE_MAX_BYTES", str(10 * 1024 ** 3)))  # 10 GB
+
+# ⚡ Límite de facturación del job: BigQuery aborta server-side la query que lo supere
+# (protege aunque el dry-run esté deshabilitado o la estimación falle). 0 = sin límite
+_MAX_BYTES_BILLED = int(os.getenv("BQ_MAX_BYTES_BILLED", str(10 * 1024 ** 3)))  # 10 GB
+
+# ⚡ Caché corto de resultados por SQL: la misma query repetida en segundos (varios usuarios con
+# la misma pregunta, re-envíos) no vuelve a pagar dry-run + jobs.query. 0 = deshabilitado
+_QUERY_RESULT_CACHE_TTL_SECONDS = int(os.getenv("QUERY_RESULT_CACHE_TTL_SECONDS", "60"))
+_MAX_QUERY_RESULT_CACHE_SIZE = int(os.getenv("QUERY_RESULT_CACHE_MAX_SIZE", "128"))
+_QUERY_RESULT_CACHE: "OrderedDict[bytes, tuple]" = OrderedDict()  # hash -> (resultado, guardado_en)
+_QUERY_RESULT_CACHE_LOCK = threading.Lock()
+_QUERY_RESULT_CACHE_STATS = {"hits": 0, "misses": 0}
+
+
+class SqlCostExceeded(Exception):
+    """La query escanearía más bytes que el máximo permitido por el control de costo"""
+
+    def __init__(self, estimated_bytes: int, max_bytes: int):
+        self.estimated_bytes = estimated_bytes
+        self.max_bytes = max_bytes
+        super().__init__(
+            f"La query escanearía {estimated_bytes / 1024 ** 3:.2f} GB "
+            f"(máximo permitido: {max_bytes / 1024 ** 3:.2f} GB)"
+        )
+
 
 def get_bigquery_client() -> bigquery.Client:
     """
-    Crea y retorna un cliente de BigQuery
+    Retorna el cliente de BigQuery compartido (se crea una sola vez por proceso)
+    
+    ⚡ Crear un cliente por llamada implica resolver credenciales y abrir una conexión
+    nueva (handshake TCP+TLS) en cada request. El cliente compartido mantiene un pool
+    de conexiones HTTP keep-alive que usan todos los threads.
     
     Returns:
         Cliente configurado de BigQuery
     """
-    project_id = os.getenv("PROJECT_ID")
-    if not project_id:
-        raise ValueError("PROJECT_ID no está configurado")
+    global _BQ_CLIENT
+    if _BQ_CLIENT is not None:
+        return _BQ_CLIENT
     
-    return bigquery.Client(project=project_id)
+    with _BQ_CLIENT_LOCK:
+        if _BQ_CLIENT is None:
+            project_id = os.getenv("PROJECT_ID")
+            if not project_id:
+                raise ValueError("PROJECT_ID no está configurado")
+            
+            client = bigquery.Client(project=project_id)
+            
+            # Ampliar el pool de conexiones: por defecto requests mantiene solo 10 por host,
+            # insuficiente cuando el agente lanza consultas en paralelo
+            adapter = HTTPAdapter(pool_connections=_BQ_HTTP_POOL_SIZE, pool_maxsize=_BQ_HTTP_POOL_SIZE)
+            client._http.mount("https://", adapter)
+            
+            _BQ_CLIENT = client
+            log_info("🔌 BigQuery client created (HTTP pool size: %s)", _BQ_HTTP_POOL_SIZE)
+    
+    return _BQ_CLIENT
 
 
-def _get_single_table_schema(table_id: str, use_cache: bool = True) -> str:
+def get_bigquery_storage_client():
     """
-    Obtiene el schema de una tabla específica en formato texto
+    Retorna el cliente compartido de BigQuery Storage Read API, o None si está
+    deshabilitado (BQ_USE_STORAGE_API) o el paquete no está instalado
+    """
+    global _BQ_STORAGE_CLIENT
+    if not (_USE_STORAGE_API and BQ_STORAGE_AVAILABLE):
+        return None
+    if _BQ_STORAGE_CLIENT is not None:
+        return _BQ_STORAGE_CLIENT
     
-    Args:
-        table_id: ID completo de la tabla (project.dataset.table)
-        use_cache: Si True, usa el caché del schema
+    with _BQ_CLIENT_LOCK:
+        if _BQ_STORAGE_CLIENT is None:
+            _BQ_STORAGE_CLIENT = bigquery_storage.BigQueryReadClient()
+            log_info("🔌 BigQuery Storage Read API client created")
+    
+    return _BQ_STORAGE_CLIENT
+
+
+def reset_bigquery_client():
+    """Descarta los clientes compartidos (ej: tests o cambio de credenciales); el próximo uso crea uno nuevo"""
+    global _BQ_CLIENT, _BQ_STORAGE_CLIENT
+    with _BQ_CLIENT_LOCK:
+        client, _BQ_CLIENT = _BQ_CLIENT, None
+        # El cliente de Storage API usa las mismas credenciales: recrearlo también
+        _BQ_STORAGE_CLIENT = None
+    if client is not None:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+def _schema_disk_path(table_id: str) -> str:
+    """Ruta del archivo de caché en disco para una tabla"""
+    file_name = hashlib.md5(table_id.encode()).hexdigest() + ".json"
+    return os.path.join(_SCHEMA_DISK_CACHE_DIR, file_name)
+
+
+def _read_schema_from_disk(table_id: str) -> Optional[Tuple[str, float]]:
+    """
+    Lee el schema del caché en disco si existe y no expiró
     
     Returns:
-        Schema en formato texto compacto
+        Tupla (schema en formato texto, momento en que se obtuvo de BigQuery), o None si no hay entrada válida
     """
-    # ⚡ Verificar caché primero
-    if use_cache and table_id in _SCHEMA_CACHE:
-        return _SCHEMA_CACHE[table_id]
+    if not _SCHEMA_DISK_CACHE_ENABLED:
+        return None
+    try:
+        with open(_schema_disk_path(table_id), "r") as f:
+            entry = json.load(f)
+        if entry.get("table_id") != table_id:
+            return None
+        fetched_at = entry.get("fetched_at", 0)
+        if time.time() - fetched_at > _SCHEMA_DISK_CACHE_TTL_SECONDS or not entry.get("schema"):
+            return None
+        return entry["schema"], fetched_at
+    except (OSError, ValueError):
+        return None
+
+
+def _read_schema_from_shared(table_id: str) -> Optional[Tuple[str, float]]:
+    """Lee el schema del caché compartido: (schema, momento en que se obtuvo de BigQuery), o None"""
+    if not _SHARED_CACHE:
+        return None
+    value = _SHARED_CACHE.get(f"schema:{table_id}")
+    if not value:
+        return None
+    try:
+        entry = json.loads(value)
+        return entry["schema"], entry["fetched_at"]
+    except (ValueError, TypeError, KeyError):
+        # Formato anterior (solo el texto, sin fecha): se trata como miss
+        return None
+
+
+def _write_schema_to_disk(table_id: str, schema_text: str, schema_version: Optional[str], fetched_at: float):
+    """Guarda el schema en el caché en disco (escritura atómica)"""
+    if not _SCHEMA_DISK_CACHE_ENABLED:
+        return
+    try:
+        os.makedirs(_SCHEMA_DISK_CACHE_DIR, exist_ok=True)
+        entry = {
+            "table_id": table_id,
+            "schema": schema_text,
+            # last_modified_time de la tabla en BigQuery, útil para diagnosticar cambios de schema
+            "schema_version": schema_version,
+            "fetched_at": fetched_at
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=_SCHEMA_DISK_CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, _schema_disk_path(table_id))
+    except OSError as e:
+        log_warning("Could not write schema disk cache for %s: %s", table_id, e)
+
+
+def _clear_schema_disk_cache() -> int:
+    """Elimina los archivos del caché en disco. Retorna la cantidad eliminada"""
+    removed = 0
+    if not os.path.isdir(_SCHEMA_DISK_CACHE_DIR):
+        return removed
+    for file_name in os.listdir(_SCHEMA_DISK_CACHE_DIR):
+        if file_name.endswith(".json"):
+            try:
+                os.remove(os.path.join(_SCHEMA_DISK_CACHE_DIR, file_name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+class CacheBackend(Protocol):
+    """Backend de caché compartido (L2) para valores de texto con expiración"""
+
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        ...
+
+    def clear(self) -> int:
+        ...
+
+
+class RedisCacheBackend:
+    """Caché compartido en Redis (SETEX con TTL). Los errores de Redis se loguean y se tratan como miss"""
+
+    def __init__(self, url: str, prefix: str = _SHARED_CACHE_PREFIX):
+        # from_url no abre la conexión todavía: se conecta en el primer comando
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5, decode_responses=True)
+        self._prefix = prefix
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            return self._client.get(self._prefix + key)
+        except redis.RedisError as e:
+            log_warning("Redis cache get failed for %s: %s", key, str(e)[:100])
+            return None
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        try:
+            self._client.setex(self._prefix + key, ttl, value)
+        except redis.RedisError as e:
+            log_warning("Redis cache set failed for %s: %s", key, str(e)[:100])
+
+    def clear(self) -> int:
+        removed = 0
+        try:
+            for key in self._client.scan_iter(match=self._prefix + "*"):
+                removed += self._client.delete(key)
+        except redis.RedisError as e:
+            log_warning("Redis cache clear failed: %s", str(e)[:100])
+        return removed
+
+
+def _create_shared_cache() -> Optional[CacheBackend]:
+    """Crea el caché compartido si REDIS_URL está configurada (None = solo caché en memoria y disco)"""
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        return None
+    if not REDIS_AVAILABLE:
+        log_warning("⚠️ REDIS_URL is set but the 'redis' package is not installed, shared cache disabled")
+        return None
+    log_info("🗄️ Shared schema cache enabled (Redis)")
+    return RedisCacheBackend(redis_url)
+
+
+_SHARED_CACHE: Optional[CacheBackend] = _create_shared_cache()
+
+
+def _get_schema_from_cache(table_id: str) -> Optional[str]:
+    """Retorna el schema cacheado en memoria si existe y no expiró (y lo marca como usado recientemente)"""
+    with _SCHEMA_LOCK:
+        entry = _SCHEMA_CACHE.get(table_id)
+        if entry is None:
+            return None
+        schema_text, stored_at = entry
+        if time.time() - stored_at > _SCHEMA_CACHE_TTL_SECONDS:
+            del _SCHEMA_CACHE[table_id]
+            return None
+        _SCHEMA_CACHE.move_to_end(table_id)
+        return schema_text
+
+
+def _schedule_schema_refresh(table_id: str, client: Optional[bigquery.Client] = None):
+    """Encola un refresh en background si la entrada en memoria está cerca de expirar (una sola vez por tabla)"""
+    with _SCHEMA_LOCK:
+        entry = _SCHEMA_CACHE.get(table_id)
+        if entry is None or table_id in _SCHEMA_REFRESHING:
+            return
+        if time.time() - entry[1] < _SCHEMA_REFRESH_AHEAD_SECONDS:
+            return
+        _SCHEMA_REFRESHING.add(table_id)
+    try:
+        _SCHEMA_REFRESH_EXECUTOR.submit(_refresh_schema_in_background, table_id, client)
+    except RuntimeError:
+        # Executor cerrado (apagado del proceso): la próxima request lo obtiene de forma síncrona
+        with _SCHEMA_LOCK:
+            _SCHEMA_REFRESHING.discard(table_id)
+
+
+def _refresh_schema_in_background(table_id: str, client: Optional[bigquery.Client] = None):
+    """Vuelve a consultar el schema en BigQuery y actualiza los cachés (corre en _SCHEMA_REFRESH_EXECUTOR)"""
+    try:
+        with _schema_fetch_lock(table_id):
+            _fetch_and_store_schema(table_id, client)
+        log_info("🔄 Schema for %s refreshed in background", table_id)
+    except gcp_exceptions.NotFound:
+        # La tabla ya no existe: invalidar la entrada en lugar de seguir sirviendo un schema viejo
+        _drop_schema_from_cache(table_id)
+        log_warning("⚠️ Table %s no longer exists, schema cache entry dropped", table_id)
+    except Exception as e:
+        # Error transitorio: se sigue sirviendo la entrada hasta que venza el TTL
+        log_warning("Background schema refresh failed for %s: %s", table_id, str(e)[:100])
+    finally:
+        with _SCHEMA_LOCK:
+            _SCHEMA_REFRESHING.discard(table_id)
+
+
+def _drop_schema_from_cache(table_id: str):
+    """Elimina un schema del caché en memoria"""
+    with _SCHEMA_LOCK:
+        _SCHEMA_CACHE.pop(table_id, None)
+
+
+def _store_schema_in_cache(table_id: str, schema_text: str, fetched_at: Optional[float] = None):
+    """
+    Guarda un schema en el caché en memoria; si está lleno, expulsa el menos usado recientemente (LRU).
+    El TTL cuenta desde fetched_at (cuándo se obtuvo de BigQuery), no desde que entra a memoria.
+    """
+    with _SCHEMA_LOCK:
+        _SCHEMA_CACHE[table_id] = (schema_text, fetched_at if fetched_at is not None else time.time())
+        _SCHEMA_CACHE.move_to_end(table_id)
+        if len(_SCHEMA_CACHE) > _MAX_SCHEMA_CACHE_SIZE:
+            oldest_key, _ = _SCHEMA_CACHE.popitem(last=False)
+            log_info("🧹 Schema cache full, removed: %s", oldest_key)
+
+
+def _schema_fetch_lock(table_id: str) -> threading.Lock:
+    """Lock por tabla: solo un thread consulta BigQuery por tabla, el resto espera su resultado"""
+    with _SCHEMA_LOCK:
+        lock = _SCHEMA_FETCH_LOCKS.get(table_id)
+        if lock is None:
+            lock = _SCHEMA_FETCH_LOCKS[table_id] = threading.Lock()
+        return lock
+
+
+def _is_known_not_found(table_id: str) -> bool:
+    """True si la tabla está en el caché de "no encontradas" (y la marca como usada recientemente)"""
+    with _SCHEMA_LOCK:
+        if table_id in _DIMENSIONS_NOT_FOUND_CACHE:
+            _DIMENSIONS_NOT_FOUND_CACHE.move_to_end(table_id)
+            return True
+        return False
+
+
+def _remember_not_found(table_id: str) -> bool:
+    """
+    Registra una tabla inexistente en el caché de "no encontradas" (LRU)
+    
+    Returns:
+        True si la tabla no estaba registrada
+    """
+    with _SCHEMA_LOCK:
+        if table_id in _DIMENSIONS_NOT_FOUND_CACHE:
+            return False
+        # Limpiar caché si está lleno (LRU: eliminar el menos usado recientemente)
+        if len(_DIMENSIONS_NOT_FOUND_CACHE) >= _MAX_DIMENSIONS_NOT_FOUND_CACHE_SIZE:
+            _DIMENSIONS_NOT_FOUND_CACHE.popitem(last=False)
+        _DIMENSIONS_NOT_FOUND_CACHE[table_id] = None
+        return True
+
+
+def _forget_not_found(table_id: str):
+    """Quita una tabla del caché de "no encontradas" para que se vuelva a consultar"""
+    with _SCHEMA_LOCK:
+        _DIMENSIONS_NOT_FOUND_CACHE.pop(table_id, None)
+
+
+def _fetch_schema_uncached(table_id: str, client: Optional[bigquery.Client] = None) -> Tuple[str, Optional[str]]:
+    """
+    Consulta el schema de una tabla directamente en BigQuery (sin caché)
     
-    # Si no está en caché, consultar BigQuery
-    client = get_bigquery_client()
+    Returns:
+        Tupla con (schema_texto, versión de la tabla)
+    """
+    client = client or get_bigquery_client()
     
     try:
         bq_table = client.get_table(table_id)
         
         # ⚡ Formatear schema de forma ultra-compacta para Gemini
-        schema_parts = []
-        for field in bq_table.schema:
-            # Formato compacto: nombre:tipo (sin mode info extra)
-            schema_parts.append(f"{field.name}:{field.field_type}")
-        
-        # Unir todo en una sola línea separado por comas
-        schema_text = ", ".join(schema_parts)
+        # Formato compacto: nombre:tipo (sin mode info extra), en una sola línea separado por comas
+        schema_text = ", ".join(f"{field.name}:{field.field_type}" for field in bq_table.schema)
+        schema_version = bq_table.modified.isoformat() if bq_table.modified else None
         
-        # ⚡ Guardar en caché con límite de memoria
-        # Si el caché está lleno, eliminar el más antiguo (FIFO)
-        if len(_SCHEMA_CACHE) >= _MAX_SCHEMA_CACHE_SIZE:
-            # Eliminar el primer elemento (más antiguo)
-            oldest_key = next(iter(_SCHEMA_CACHE))
-            del _SCHEMA_CACHE[oldest_key]
-            log_info(f"🧹 Schema cache full, removed: {oldest_key}")
-        
-        _SCHEMA_CACHE[table_id] = schema_text
-        
-        return schema_text
+        return schema_text, schema_version
         
+    except gcp_exceptions.NotFound:
+        # Recordar la tabla inexistente para no repetir el 404 en la próxima llamada
+        _remember_not_found(table_id)
+        raise
+    except gcp_exceptions.GoogleAPICallError:
+        # Propagar el error tipado de la API (NotFound, Forbidden...) para que el caller lo clasifique
+        raise
     except Exception as e:
         raise Exception(f"Error obteniendo schema de {table_id}: {str(e)}")
 
 
-def get_table_schema(use_cache: bool = True) -> Tuple[str, str]:
+def _get_single_table_schema(
+    table_id: str,
+    use_cache: bool = True,
+    client: Optional[bigquery.Client] = None
+) -> str:
+    """
+    Obtiene el schema de una tabla específica en formato texto
+    
+    Args:
+        table_id: ID completo de la tabla (project.dataset.table)
+        use_cache: Si True, usa el caché del schema
+        client: Cliente de BigQuery (por defecto el compartido)
+    
+    Returns:
+        Schema en formato texto compacto
+    
+    Raises:
+        NotFound: Si ya se sabe que la tabla no existe (sin consultar BigQuery)
+    """
+    # ⚡ Verificar caché primero
+    if use_cache:
+        schema_text = _get_schema_from_cache(table_id)
+        if schema_text:
+            _schedule_schema_refresh(table_id, client)
+            return schema_text
+        
+        # ⚡ Tabla que ya dio 404: fallar sin otro round-trip a BigQuery
+        if _is_known_not_found(table_id):
+            raise gcp_exceptions.NotFound(f"Table {table_id} not found (cached)")
+    
+    # ⚡ Un solo request a BigQuery por tabla aunque lleguen varios a la vez (cold start)
+    with _schema_fetch_lock(table_id):
+        if use_cache:
+            # Otro thread pudo haberlo cargado mientras esperábamos el lock
+            schema_text = _get_schema_from_cache(table_id)
+            if schema_text:
+                return schema_text
+            
+            # Segundo nivel: caché compartido (Redis) o persistente en disco
+            # (otro worker o un proceso anterior ya lo obtuvo)
+            cached = _read_schema_from_shared(table_id) or _read_schema_from_disk(table_id)
+            if cached:
+                schema_text, fetched_at = cached
+                # Conserva la fecha original: una entrada ya vieja no reinicia el TTL en memoria,
+                # y si está cerca de vencer se refresca en background
+                _store_schema_in_cache(table_id, schema_text, fetched_at)
+                _schedule_schema_refresh(table_id, client)
+                return schema_text
+        
+        # Si no está en caché, consultar BigQuery
+        try:
+            return _fetch_and_store_schema(table_id, client)
+        except gcp_exceptions.NotFound:
+            _drop_schema_from_cache(table_id)
+            raise
+
+
+def _fetch_and_store_schema(table_id: str, client: Optional[bigquery.Client] = None) -> str:
+    """Consulta el schema en BigQuery y lo guarda en todos los niveles de caché (memoria, disco, compartido)"""
+    schema_text, schema_version = _fetch_schema_uncached(table_id, client)
+    _store_schema_everywhere(table_id, schema_text, schema_version)
+    return schema_text
+
+
+def _store_schema_everywhere(table_id: str, schema_text: str, schema_version: Optional[str] = None):
+    """Guarda un schema en todos los niveles de caché: memoria (con límite), disco y compartido"""
+    fetched_at = time.time()
+    _store_schema_in_cache(table_id, schema_text, fetched_at)
+    _write_schema_to_disk(table_id, schema_text, schema_version, fetched_at)
+    if _SHARED_CACHE:
+        shared_entry = json.dumps({"schema": schema_text, "fetched_at": fetched_at})
+        _SHARED_CACHE.set(f"schema:{table_id}", shared_entry, _SHARED_CACHE_TTL_SECONDS)
+
+
+def get_table_schema(use_cache: bool = True, client: Optional[bigquery.Client] = None) -> Tuple[str, str]:
     """
     Obtiene el schema de la tabla configurada en formato texto con caché
     
     Args:
         use_cache: Si True, usa el caché del schema (por defecto). Si False, fuerza recarga.
+        client: Cliente de BigQuery (por defecto el compartido)
     
     Returns:
         Tupla con (schema_texto, table_full_id)
@@ -96,23 +587,237 @@ def get_table_schema(use_cache: bool = True) -> Tuple[str, str]:
     table_id = f"{project_id}.{dataset}.{table}"
     
     start_time = time.time()
-    log_info(f"📋 Getting schema from BigQuery...")
+    log_info("📋 Getting schema from BigQuery...")
     
-    schema_text = _get_single_table_schema(table_id, use_cache)
+    schema_text = _get_single_table_schema(table_id, use_cache, client)
     
     duration_ms = (time.time() - start_time) * 1000
-    log_info(f"Schema obtained in {duration_ms/1000:.2f}s")
+    log_info("Schema obtained in %.2fs", duration_ms / 1000)
     
     return schema_text, table_id
 
 
-def get_dimensions_info(use_cache: bool = True, force_refresh: bool = False) -> Dict[str, Any]:
+def _get_dim_dataset_version(client: bigquery.Client, dataset_id: str) -> Optional[str]:
+    """
+    Obtiene la versión del dataset de dimensiones: el last_modified_time más reciente de sus tablas.
+    Es una consulta de metadata (__TABLES__), no escanea datos.
+    
+    Returns:
+        Versión como string, o None si no se pudo obtener
+    """
+    try:
+        sql = f"SELECT MAX(last_modified_time) AS version FROM `{dataset_id}.__TABLES__`"
+        rows = list(client.query(sql).result())
+        if rows and rows[0]["version"] is not None:
+            return str(rows[0]["version"])
+    except Exception as e:
+        log_warning("Could not get version of dataset %s: %s", dataset_id, str(e)[:100])
+    return None
+
+
+# Tipos de INFORMATION_SCHEMA.COLUMNS (SQL estándar) -> field_type de get_table,
+# para que el schema compacto sea idéntico venga de donde venga
+_DATA_TYPE_TO_FIELD_TYPE = {
+    "INT64": "INTEGER",
+    "FLOAT64": "FLOAT",
+    "BOOL": "BOOLEAN",
+}
+
+
+def _field_type_from_data_type(data_type: str) -> str:
+    """Convierte un data_type de INFORMATION_SCHEMA (ej: ARRAY<INT64>, NUMERIC(10, 2)) al field_type de get_table"""
+    if data_type.startswith("ARRAY<"):
+        # get_table informa el tipo del elemento (mode REPEATED, que el schema compacto no muestra)
+        data_type = data_type[len("ARRAY<"):-1]
+    if data_type.startswith("STRUCT<"):
+        return "RECORD"
+    base_type = data_type.split("(", 1)[0].strip()
+    return _DATA_TYPE_TO_FIELD_TYPE.get(base_type, base_type)
+
+
+def _fetch_dimension_schemas_batch(
+    client: bigquery.Client,
+    dataset_id: str,
+    table_names: List[str]
+) -> Optional[Dict[str, str]]:
+    """
+    ⚡ Obtiene el schema compacto de varias tablas con UNA sola query a INFORMATION_SCHEMA.COLUMNS
+    (en lugar de un get_table por tabla). Las tablas que no existen simplemente no aparecen.
+    
+    Returns:
+        Dict table_name -> schema compacto, o None si la query falló (usar el camino por tabla)
+    """
+    sql = (
+        f"SELECT table_name, column_name, data_type "
+        f"FROM `{dataset_id}.INFORMATION_SCHEMA.COLUMNS` "
+        f"WHERE table_name IN UNNEST(@names) "
+        f"ORDER BY table_name, ordinal_position"
+    )
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("names", "STRING", table_names)],
+        use_legacy_sql=False
+    )
+    try:
+        columns_by_table: Dict[str, List[str]] = {}
+        for row in client.query_and_wait(sql, job_config=job_config):
+            table_name, column_name, data_type = row[0], row[1], row[2]
+            columns_by_table.setdefault(table_name, []).append(
+                f"{column_name}:{_field_type_from_data_type(data_type)}"
+            )
+    except Exception as e:
+        log_warning("Could not read INFORMATION_SCHEMA of %s, fetching each table: %s", dataset_id, str(e)[:100])
+        return None
+    return {table_name: ", ".join(columns) for table_name, columns in columns_by_table.items()}
+
+
+def _fetch_dimension_schemas_individually(
+    client: bigquery.Client,
+    dataset_id: str,
+    tables_to_fetch: Dict[str, Tuple[str, str]],
+    use_cache: bool,
+    dim_dataset: str,
+    force_refresh: bool
+) -> Tuple[Dict[str, str], List[Tuple[str, str, str]]]:
+    """
+    Camino alternativo: list_tables + get_table en paralelo por cada dimensión
+    
+    Returns:
+        Tupla con (schemas por dim_name, tablas faltantes)
+    """
+    # ⚡ Un solo list_tables para saber qué tablas existen (sin un 404 por cada tabla faltante)
+    existing_tables = None
+    try:
+        existing_tables = {t.table_id for t in client.list_tables(dataset_id)}
+    except Exception as e:
+        log_warning("Could not list tables of %s, trying each table: %s", dataset_id, str(e)[:100])
+    
+    missing = []
+    if existing_tables is not None:
+        for dim_name, (dim_table, table_id) in tables_to_fetch.items():
+            if dim_table not in existing_tables and _mark_dimension_not_found(table_id, force_refresh):
+                missing.append((dim_name, dim_table, table_id))
+        tables_to_fetch = {
+            dim_name: tables for dim_name, tables in tables_to_fetch.items() if tables[0] in existing_tables
+        }
+    
+    # ⚡ Obtener los schemas en paralelo (el cliente de BigQuery es thread-safe)
+    # Concurrencia acotada: con muchas dimensiones no se disparan N requests simultáneos
+    schemas = {}
+    if tables_to_fetch:
+        max_workers = min(_MAX_DIMENSION_WORKERS, len(tables_to_fetch))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dims") as executor:
+            futures = {
+                executor.submit(_get_single_table_schema, table_id, use_cache, client): dim_name
+                for dim_name, (_, table_id) in tables_to_fetch.items()
+            }
+            for future in as_completed(futures):
+                dim_name = futures[future]
+                dim_table, table_id = tables_to_fetch[dim_name]
+                try:
+                    schemas[dim_name] = future.result()
+                    log_info("✅ Schema for %s obtained", dim_name)
+                except Exception as e:
+                    if _log_dimension_error(e, dim_name, dim_table, table_id, dim_dataset, force_refresh):
+                        missing.append((dim_name, dim_table, table_id))
+                    # Continuar con las otras dimensiones aunque una falle
+    
+    return schemas, missing
+
+
+def _mark_dimension_not_found(table_id: str, force_refresh: bool = False) -> bool:
+    """
+    Registra una tabla de dimensión inexistente en el caché de "no encontradas"
+    
+    Returns:
+        True si es la primera vez que se detecta (hay que avisar)
+    """
+    is_new = _remember_not_found(table_id)
+    if force_refresh:
+        _forget_not_found(table_id)
+    return is_new
+
+
+def _warn_dimensions_not_found(missing: List[Tuple[str, str, str]], dim_dataset: str):
+    """
+    Avisa en un solo log qué tablas de dimensión no existen y cómo verificarlas
+    
+    Args:
+        missing: Lista de (dim_name, dim_table, table_id)
+    """
+    if not missing:
+        return
+    lines = [f"⚠️ {len(missing)} dimension table(s) not found:"]
+    for dim_name, dim_table, table_id in missing:
+        lines.append(f"   - {dim_name}: '{dim_table}' (ID searched: {table_id})")
+    lines.append(f"   Verify:")
+    lines.append(f"     1. That the tables exist in BigQuery Console")
+    lines.append(f"     2. That the names are exact")
+    lines.append(f"     3. That they're in the dataset: {dim_dataset}")
+    lines.append(f"     4. Run: python backend/check_dimensions.py for diagnosis")
+    log_warning("\n".join(lines))
+
+
+def _log_dimension_error(
+    e: Exception,
+    dim_name: str,
+    dim_table: str,
+    table_id: str,
+    dim_dataset: str,
+    force_refresh: bool = False
+) -> bool:
+    """
+    Clasifica (por tipo de excepción) y loguea el error al obtener el schema de una tabla de dimensión
+    
+    Returns:
+        True si la tabla no existe (el aviso se agrupa y lo emite el caller)
+    """
+    if isinstance(e, gcp_exceptions.NotFound):
+        # Tabla no encontrada (_get_single_table_schema ya la registró en el caché de "no encontradas")
+        if force_refresh:
+            _forget_not_found(table_id)
+        return True
+    elif isinstance(e, gcp_exceptions.Forbidden):
+        # Error de permisos (403; PermissionDenied es subclase de Forbidden)
+        log_warning("⚠️ Insufficient permissions for %s (%s)", dim_name, table_id)
+        log_warning("   Verify you have read permissions in BigQuery")
+        log_warning("   Error: %s", str(e)[:100])
+    else:
+        # Otro tipo de error
+        log_warning("⚠️ Error getting schema for %s (%s)", dim_name, table_id)
+        log_warning("   Type: %s", type(e).__name__)
+        log_warning("   Error: %s", str(e)[:150])
+    return False
+
+
+def _get_shared_dimensions(cache_key: str, version: str) -> Optional[Dict[str, Any]]:
+    """Lee las dimensiones del caché compartido si fueron cargadas con la misma versión del dataset"""
+    shared_entry = _SHARED_CACHE.get(f"dimensions:{cache_key}")
+    if not shared_entry:
+        return None
+    try:
+        entry = json.loads(shared_entry)
+    except ValueError:
+        return None
+    if entry.get("version") != version:
+        return None
+    return {
+        "dimensions": entry.get("dimensions", {}),
+        "relationships": _RELATIONSHIPS
+    }
+
+
+def get_dimensions_info(
+    use_cache: bool = True,
+    force_refresh: bool = False,
+    client: Optional[bigquery.Client] = None
+) -> Dict[str, Any]:
     """
     Obtiene información de las tablas de dimensiones y sus relaciones
     
     Args:
         use_cache: Si True, usa el caché (por defecto). Si False, fuerza recarga.
         force_refresh: Si True, fuerza recarga ignorando cache de "no encontradas"
+        client: Cliente de BigQuery (por defecto el compartido)
     
     Returns:
         Dict con información de dimensiones:
@@ -129,6 +834,18 @@ def get_dimensions_info(use_cache: bool = True, force_refresh: bool = False) ->
             ]
         }
     """
+    # ⚡ Serializar la construcción: en cold start, un solo thread carga las dimensiones
+    # y el resto recibe el resultado cacheado
+    with _DIMENSIONS_LOCK:
+        return _load_dimensions_info(use_cache, force_refresh, client)
+
+
+def _load_dimensions_info(
+    use_cache: bool,
+    force_refresh: bool,
+    client: Optional[bigquery.Client]
+) -> Dict[str, Any]:
+    """Cuerpo de get_dimensions_info; se ejecuta con _DIMENSIONS_LOCK tomado"""
     project_id = os.getenv("PROJECT_ID")
     # Dataset de dimensiones puede ser diferente al dataset de la fact table
     dim_dataset = os.getenv("BQ_DIM_DATASET", "Dim")  # Por defecto "Dim"
@@ -142,145 +859,198 @@ def get_dimensions_info(use_cache: bool = True, force_refresh: bool = False) ->
     # Si se fuerza refresh, limpiar cache de "no encontradas" para este dataset
     if force_refresh:
         # Limpiar cache de tablas no encontradas para este dataset
-        tables_to_remove = [t for t in _DIMENSIONS_NOT_FOUND_CACHE if f"{project_id}.{dataset}" in t]
-        for t in tables_to_remove:
-            _DIMENSIONS_NOT_FOUND_CACHE.discard(t)
+        dataset_prefix = f"{project_id}.{dim_dataset}."
+        with _SCHEMA_LOCK:
+            tables_to_remove = [t for t in _DIMENSIONS_NOT_FOUND_CACHE if t.startswith(dataset_prefix)]
+            for t in tables_to_remove:
+                _DIMENSIONS_NOT_FOUND_CACHE.pop(t, None)
         # Limpiar cache de dimensiones también
         if cache_key in _DIMENSIONS_CACHE:
             del _DIMENSIONS_CACHE[cache_key]
+        _DIMENSIONS_VERSION.pop(cache_key, None)
+    
+    client = client or get_bigquery_client()
+    version = None
+    tables_changed = False
     
     # ⚡ Verificar caché primero
     if use_cache and cache_key in _DIMENSIONS_CACHE and not force_refresh:
         cached_result = _DIMENSIONS_CACHE[cache_key]
-        # Solo loguear si hay dimensiones disponibles, si no hay, ser silencioso
-        if cached_result.get("dimensions") and len(cached_result["dimensions"]) > 0:
-            log_info(f"✨ Dimensions obtained from cache ({len(cached_result['dimensions'])} tables)")
-        return cached_result
+        cached_version, checked_at = _DIMENSIONS_VERSION.get(cache_key, (None, 0.0))
+        
+        # Re-verificar la versión del dataset solo si pasó el intervalo
+        if time.time() - checked_at >= _DIMENSIONS_VERSION_CHECK_SECONDS:
+            version = _get_dim_dataset_version(client, cache_key)
+            # Si no se pudo obtener la versión, seguir sirviendo el caché
+            tables_changed = version is not None and cached_version is not None and version != cached_version
+            if not tables_changed:
+                _DIMENSIONS_VERSION[cache_key] = (version or cached_version, time.time())
+        
+        if not tables_changed:
+            # Solo loguear si hay dimensiones disponibles, si no hay, ser silencioso
+            if cached_result.get("dimensions") and len(cached_result["dimensions"]) > 0:
+                log_info("✨ Dimensions obtained from cache (%s tables)", len(cached_result['dimensions']))
+            return cached_result
+        
+        log_info("🔄 Dimension tables changed (%s → %s), reloading...", cached_version, version)
     
     start_time = time.time()
-    log_info(f"📋 Getting dimension table schemas...")
+    log_info("📋 Getting dimension table schemas...")
     
-    # Definir tablas de dimensiones (pueden ser configuradas por env vars en el futuro)
-    dim_tables = {
-        "DimProducts": os.getenv("BQ_DIM_PRODUCTS", "DimProducts"),
-        "DimProvince": os.getenv("BQ_DIM_PROVINCE", "DimProvince"),
-        "DimTime": os.getenv("BQ_DIM_TIME", "DimTime")
-    }
+    # Tablas de dimensiones (configurables por env vars)
+    dim_tables = _get_dim_tables()
     
     dimensions = {}
-    client = get_bigquery_client()
+    if version is None:
+        version = _get_dim_dataset_version(client, cache_key)
+    
+    # Segundo nivel: caché compartido (Redis) con la misma versión del dataset (otro worker ya las cargó)
+    if _SHARED_CACHE and use_cache and not force_refresh and version is not None:
+        shared_result = _get_shared_dimensions(cache_key, version)
+        if shared_result is not None:
+            _DIMENSIONS_CACHE[cache_key] = shared_result
+            _DIMENSIONS_VERSION[cache_key] = (version, time.time())
+            log_info("✨ Dimensions obtained from shared cache (%s tables)", len(shared_result['dimensions']))
+            return shared_result
     
+    tables_to_fetch = {}
     for dim_name, dim_table in dim_tables.items():
         # Las tablas de dimensiones están en el dataset "Dim", no en el dataset de la fact table
         table_id = f"{project_id}.{dim_dataset}.{dim_table}"
         
         # Si ya sabemos que esta tabla no existe, saltarla silenciosamente
-        if table_id in _DIMENSIONS_NOT_FOUND_CACHE:
+        if _is_known_not_found(table_id):
             continue
         
-        try:
-            schema_text = _get_single_table_schema(table_id, use_cache)
+        tables_to_fetch[dim_name] = (dim_table, table_id)
+    
+    # Si las tablas cambiaron, no usar el schema cacheado de cada tabla (está desactualizado)
+    use_table_cache = use_cache and not tables_changed
+    schemas = {}
+    if use_table_cache:
+        for dim_name, (_, table_id) in tables_to_fetch.items():
+            schema_text = _get_schema_from_cache(table_id)
+            if schema_text:
+                schemas[dim_name] = schema_text
+    pending = {name: tables for name, tables in tables_to_fetch.items() if name not in schemas}
+    
+    # ⚡ Tablas faltantes detectadas en esta carga: se avisan juntas en un solo log
+    missing = []
+    if pending:
+        batch_schemas = _fetch_dimension_schemas_batch(client, cache_key, [t for t, _ in pending.values()])
+        if batch_schemas is not None:
+            for dim_name, (dim_table, table_id) in pending.items():
+                schema_text = batch_schemas.get(dim_table)
+                if schema_text is None:
+                    # No aparece en INFORMATION_SCHEMA: la tabla no existe
+                    if _mark_dimension_not_found(table_id, force_refresh):
+                        missing.append((dim_name, dim_table, table_id))
+                    continue
+                schemas[dim_name] = schema_text
+                _store_schema_everywhere(table_id, schema_text)
+                log_info("✅ Schema for %s obtained", dim_name)
+        else:
+            fetched, missing = _fetch_dimension_schemas_individually(
+                client, cache_key, pending, use_table_cache, dim_dataset, force_refresh
+            )
+            schemas.update(fetched)
+    
+    _warn_dimensions_not_found(missing, dim_dataset)
+    
+    # Mantener el orden de dim_tables (el prompt queda estable entre llamadas)
+    for dim_name, (dim_table, table_id) in tables_to_fetch.items():
+        if dim_name in schemas:
             dimensions[dim_name] = {
                 "table_id": table_id,
                 "table_name": dim_table,
-                "schema": schema_text
+                "schema": schemas[dim_name]
             }
-            log_info(f"✅ Schema for {dim_name} obtained")
-        except Exception as e:
-            from google.api_core import exceptions as gcp_exceptions
-            
-            error_str = str(e)
-            error_type = type(e).__name__
-            
-            # Detectar tipo específico de error
-            if isinstance(e, gcp_exceptions.NotFound) or "404" in error_str or "Not found" in error_str or "notFound" in error_str:
-                # Tabla no encontrada
-                if table_id not in _DIMENSIONS_NOT_FOUND_CACHE:
-                    # Limpiar caché si está lleno (FIFO)
-                    if len(_DIMENSIONS_NOT_FOUND_CACHE) >= _MAX_DIMENSIONS_NOT_FOUND_CACHE_SIZE:
-                        # Eliminar el primer elemento
-                        oldest = next(iter(_DIMENSIONS_NOT_FOUND_CACHE))
-                        _DIMENSIONS_NOT_FOUND_CACHE.discard(oldest)
-                    
-                    _DIMENSIONS_NOT_FOUND_CACHE.add(table_id)
-                    log_warning(f"⚠️ Dimension table {dim_name} not found")
-                    log_warning(f"   ID searched: {table_id}")
-                    log_warning(f"   Verify:")
-                    log_warning(f"     1. That the table exists in BigQuery Console")
-                    log_warning(f"     2. That the name is exact: '{dim_table}'")
-                    log_warning(f"     3. That it's in the dataset: {dim_dataset}")
-                    log_warning(f"     4. Run: python backend/check_dimensions.py for diagnosis")
-                if force_refresh:
-                    _DIMENSIONS_NOT_FOUND_CACHE.discard(table_id)
-            elif isinstance(e, gcp_exceptions.PermissionDenied) or "403" in error_str or "Permission" in error_str:
-                # Error de permisos
-                log_warning(f"⚠️ Insufficient permissions for {dim_name} ({table_id})")
-                log_warning(f"   Verify you have read permissions in BigQuery")
-                log_warning(f"   Error: {error_str[:100]}")
-            else:
-                # Otro tipo de error
-                log_warning(f"⚠️ Error getting schema for {dim_name} ({table_id})")
-                log_warning(f"   Type: {error_type}")
-                log_warning(f"   Error: {error_str[:150]}")
-            # Continuar con las otras dimensiones aunque una falle
-    
-    # Definir relaciones (hardcodeadas según la especificación)
-    relationships = [
-        {
-            "fact_column": "product_id",
-            "dim_table": "DimProducts",
-            "dim_column": "product_id"
-        },
-        {
-            "fact_column": "province_id",
-            "dim_table": "DimProvince",
-            "dim_column": "province_id"
-        },
-        {
-            "fact_column": "agreement_date",
-            "dim_table": "DimTime",
-            "dim_column": "date_id"
-        }
-    ]
     
     result = {
         "dimensions": dimensions,
-        "relationships": relationships
+        "relationships": _RELATIONSHIPS
     }
     
-    # ⚡ Guardar en caché
+    # ⚡ Guardar en caché junto con la versión del dataset
     _DIMENSIONS_CACHE[cache_key] = result
+    _DIMENSIONS_VERSION[cache_key] = (version, time.time())
+    if _SHARED_CACHE and version is not None:
+        shared_entry = json.dumps({"version": version, "dimensions": dimensions})
+        _SHARED_CACHE.set(f"dimensions:{cache_key}", shared_entry, _SHARED_CACHE_TTL_SECONDS)
     
     duration_ms = (time.time() - start_time) * 1000
     
     # Solo loguear si hay dimensiones, si no hay, ser más silencioso
     if len(dimensions) > 0:
-        log_info(f"Dimensions loaded in {duration_ms/1000:.2f}s ({len(dimensions)} tables)")
+        log_info("Dimensions loaded in %.2fs (%s tables)", duration_ms / 1000, len(dimensions))
     # Si no hay dimensiones, no loguear nada (ya se mostraron warnings individuales)
     
     return result
 
 
+# ⚡ Dimensiones vigentes para el camino de /ask: cada request las lee sin tomar _DIMENSIONS_LOCK
+# ni re-verificar la versión del dataset. Solo se actualizan al arrancar, en /dimensions/refresh
+# y en el refresco periódico (ver main.py).
+DIMENSIONS_STATE: Dict[str, Any] = {"info": None, "loaded_at": 0.0}
+_DIMENSIONS_STATE_LOCK = threading.Lock()
+
+
+def refresh_dimensions_state(force_refresh: bool = False) -> Dict[str, Any]:
+    """Recarga las dimensiones (caché + chequeo de versión) y las publica en DIMENSIONS_STATE"""
+    dimensions_info = get_dimensions_info(use_cache=not force_refresh, force_refresh=force_refresh)
+    with _DIMENSIONS_STATE_LOCK:
+        DIMENSIONS_STATE["info"] = dimensions_info
+        DIMENSIONS_STATE["loaded_at"] = time.time()
+    return dimensions_info
+
+
+def get_current_dimensions() -> Dict[str, Any]:
+    """Dimensiones vigentes; solo se cargan acá si todavía no se cargaron (ej: fuera del servidor)"""
+    dimensions_info = DIMENSIONS_STATE["info"]
+    if dimensions_info is None:
+        dimensions_info = refresh_dimensions_state()
+    return dimensions_info
+
+
+def _reset_dimensions_state():
+    """Descarta las dimensiones vigentes: la próxima lectura las vuelve a cargar"""
+    with _DIMENSIONS_STATE_LOCK:
+        DIMENSIONS_STATE["info"] = None
+        DIMENSIONS_STATE["loaded_at"] = 0.0
+
+
 def clear_dimensions_cache():
     """Limpia el cache de dimensiones - útil para forzar recarga"""
     global _DIMENSIONS_CACHE, _DIMENSIONS_NOT_FOUND_CACHE
-    _DIMENSIONS_CACHE.clear()
-    _DIMENSIONS_NOT_FOUND_CACHE.clear()
+    with _DIMENSIONS_LOCK:
+        _DIMENSIONS_CACHE.clear()
+        _DIMENSIONS_VERSION.clear()
+        _DIMENSIONS_NOT_FOUND_CACHE.clear()
+    _reset_dimensions_state()
     log_info("🧹 Dimensions cache cleared")
 
 
 def clear_all_caches():
     """Limpia todos los cachés para liberar memoria"""
     global _SCHEMA_CACHE, _DIMENSIONS_CACHE, _DIMENSIONS_NOT_FOUND_CACHE
-    schema_count = len(_SCHEMA_CACHE)
-    dim_count = len(_DIMENSIONS_CACHE)
-    not_found_count = len(_DIMENSIONS_NOT_FOUND_CACHE)
+    with _SCHEMA_LOCK:
+        schema_count = len(_SCHEMA_CACHE)
+        _SCHEMA_CACHE.clear()
     
-    _SCHEMA_CACHE.clear()
-    _DIMENSIONS_CACHE.clear()
-    _DIMENSIONS_NOT_FOUND_CACHE.clear()
+    with _DIMENSIONS_LOCK:
+        dim_count = len(_DIMENSIONS_CACHE)
+        not_found_count = len(_DIMENSIONS_NOT_FOUND_CACHE)
+        _DIMENSIONS_CACHE.clear()
+        _DIMENSIONS_VERSION.clear()
+        _DIMENSIONS_NOT_FOUND_CACHE.clear()
+    _reset_dimensions_state()
+    with _QUERY_RESULT_CACHE_LOCK:
+        result_count = len(_QUERY_RESULT_CACHE)
+        _QUERY_RESULT_CACHE.clear()
+    disk_count = _clear_schema_disk_cache()
+    shared_count = _SHARED_CACHE.clear() if _SHARED_CACHE else 0
     
-    log_info(f"🧹 All caches cleared: {schema_count} schemas, {dim_count} dimensions, {not_found_count} 'not found'")
+    log_info("🧹 All caches cleared: %s schemas, %s dimensions, %s 'not found', %s query results, %s on disk, %s shared", schema_count, dim_count, not_found_count, result_count, disk_count, shared_count)
 
 
 def get_cache_stats() -> Dict[str, Any]:
@@ -288,19 +1058,263 @@ def get_cache_stats() -> Dict[str, Any]:
     return {
         "schema_cache_size": len(_SCHEMA_CACHE),
         "schema_cache_max": _MAX_SCHEMA_CACHE_SIZE,
+        "schema_cache_ttl_seconds": _SCHEMA_CACHE_TTL_SECONDS,
+        "schema_refresh_ahead_seconds": _SCHEMA_REFRESH_AHEAD_SECONDS,
         "dimensions_cache_size": len(_DIMENSIONS_CACHE),
         "dimensions_not_found_cache_size": len(_DIMENSIONS_NOT_FOUND_CACHE),
-        "dimensions_not_found_cache_max": _MAX_DIMENSIONS_NOT_FOUND_CACHE_SIZE
+        "dimensions_not_found_cache_max": _MAX_DIMENSIONS_NOT_FOUND_CACHE_SIZE,
+        "dimensions_version_check_seconds": _DIMENSIONS_VERSION_CHECK_SECONDS,
+        "dimensions_loaded_at": DIMENSIONS_STATE["loaded_at"],
+        "schema_disk_cache_enabled": _SCHEMA_DISK_CACHE_ENABLED,
+        "schema_disk_cache_ttl_seconds": _SCHEMA_DISK_CACHE_TTL_SECONDS,
+        "shared_cache_enabled": _SHARED_CACHE is not None,
+        "shared_cache_ttl_seconds": _SHARED_CACHE_TTL_SECONDS,
+        "cost_gate_enabled": _COST_GATE_ENABLED,
+        "cost_gate_max_bytes": _COST_GATE_MAX_BYTES,
+        "max_bytes_billed": _MAX_BYTES_BILLED,
+        "storage_api_enabled": _USE_STORAGE_API and BQ_STORAGE_AVAILABLE,
+        "query_result_cache_size": len(_QUERY_RESULT_CACHE),
+        "query_result_cache_max": _MAX_QUERY_RESULT_CACHE_SIZE,
+        "query_result_cache_ttl_seconds": _QUERY_RESULT_CACHE_TTL_SECONDS,
+        "query_result_cache_hits": _QUERY_RESULT_CACHE_STATS["hits"],
+        "query_result_cache_misses": _QUERY_RESULT_CACHE_STATS["misses"]
     }
 
 
-def execute_query(sql: str, max_rows: int = 100) -> Dict[str, Any]:
+def _row_to_list(row) -> List[Any]:
+    """Convierte una fila de BigQuery a lista serializable (manejando tipos especiales)"""
+    return _values_to_list(row.values())
+
+
+def _values_to_list(values) -> List[Any]:
+    """Convierte los valores de una fila a lista serializable (manejando tipos especiales)"""
+    return [_convert_value(value) for value in values]
+
+
+# ⚡ Tipos que ya son serializables: un solo lookup por type() resuelve el caso común
+_PASSTHROUGH_TYPES = frozenset((int, float, bool, str, type(None)))
+
+
+def _convert_value(value: Any) -> Any:
+    """Convierte un valor de cualquier tipo a serializable (fallback cuando no se conoce el tipo de la columna)"""
+    if type(value) in _PASSTHROUGH_TYPES:
+        return value
+    if hasattr(value, 'isoformat'):  # Fechas/timestamps
+        return value.isoformat()
+    return value if isinstance(value, (int, float)) else str(value)
+
+
+def _passthrough(value: Any) -> Any:
+    """Valores ya serializables (enteros, floats, booleanos, strings)"""
+    return value
+
+
+def _to_iso(value: Any) -> Optional[str]:
+    """Fechas/timestamps a ISO 8601"""
+    return value.isoformat() if value is not None else None
+
+
+def _to_str(value: Any) -> Optional[str]:
+    """NUMERIC/BIGNUMERIC (Decimal), BYTES, STRUCT, ARRAY a string"""
+    return str(value) if value is not None else None
+
+
+# ⚡ Conversor por tipo de columna: el tipo se resuelve una vez por columna, no por celda
+_CONVERTER_BY_TYPE: Dict[str, Callable[[Any], Any]] = {
+    "INTEGER": _passthrough,
+    "INT64": _passthrough,
+    "FLOAT": _passthrough,
+    "FLOAT64": _passthrough,
+    "BOOLEAN": _passthrough,
+    "BOOL": _passthrough,
+    "STRING": _passthrough,
+    "TIMESTAMP": _to_iso,
+    "DATETIME": _to_iso,
+    "DATE": _to_iso,
+    "TIME": _to_iso,
+    "NUMERIC": _to_str,
+    "BIGNUMERIC": _to_str,
+    "BYTES": _to_str,
+    "RECORD": _to_str,
+    "STRUCT": _to_str,
+}
+
+
+def _converters_for_schema(schema) -> List[Callable[[Any], Any]]:
+    """Lista de conversores (uno por columna) según el schema del resultado"""
+    return [
+        _to_str if field.mode == "REPEATED" else _CONVERTER_BY_TYPE.get(field.field_type, _convert_value)
+        for field in schema
+    ]
+
+
+def _convert_rows(rows_iterable, converters: List[Callable[[Any], Any]]) -> List[List[Any]]:
+    """
+    Convierte filas de BigQuery a listas serializables aplicando el conversor de cada columna.
+    Se itera la fila por índice: Row.values() hace un deepcopy de todos los valores en cada fila.
+    """
+    # ⚡ Caso común (agregaciones: solo números/strings): no hay nada que convertir celda por celda
+    if all(convert is _passthrough for convert in converters):
+        return [list(row) for row in rows_iterable]
+    return [[convert(value) for convert, value in zip(converters, row)] for row in rows_iterable]
+
+
+def _arrow_column_to_list(column) -> List[Any]:
+    """
+    Convierte una columna Arrow a lista serializable con el mismo formato que _row_to_list.
+    ⚡ El tipo se resuelve una vez por columna (no por celda) y las conversiones simples
+    se hacen en C dentro de Arrow.
+    """
+    arrow_type = column.type
+    if (pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type)
+            or pa.types.is_boolean(arrow_type) or pa.types.is_string(arrow_type)):
+        return column.to_pylist()
+    if pa.types.is_date(arrow_type) or pa.types.is_decimal(arrow_type):
+        # Cast vectorizado: date -> "YYYY-MM-DD", decimal -> representación exacta
+        return column.cast(pa.string()).to_pylist()
+    if pa.types.is_timestamp(arrow_type) or pa.types.is_time(arrow_type):
+        # isoformat de Python para mantener el formato del camino REST (ej: "+00:00")
+        return [value.isoformat() if value is not None else None for value in column.to_pylist()]
+    # Tipos complejos (STRUCT, ARRAY, BYTES, GEOGRAPHY...): mismo tratamiento que _row_to_list
+    return [str(value) if value is not None else None for value in column.to_pylist()]
+
+
+def _read_rows_with_storage_api(results, max_rows: int, bqstorage_client) -> List[List[Any]]:
+    """
+    Lee hasta max_rows filas usando la Storage Read API (bloques Arrow).
+    Deja de leer bloques en cuanto se alcanza max_rows.
+    """
+    batches = []
+    total = 0
+    for batch in results.to_arrow_iterable(bqstorage_client=bqstorage_client):
+        batches.append(batch)
+        total += batch.num_rows
+        if total >= max_rows:
+            break
+    if not batches:
+        return []
+    
+    table = pa.Table.from_batches(batches).slice(0, max_rows)
+    columns = [_arrow_column_to_list(column) for column in table.columns]
+    return [list(values) for values in zip(*columns)]
+
+
+# ⚡ LIMIT final de la query (con OFFSET opcional y ";" al final)
+_RE_TRAILING_LIMIT = re.compile(r'\blimit\s+\d+(\s+offset\s+\d+)?\s*;?\s*$', re.IGNORECASE)
+_RE_SELECT_START = re.compile(r'^\s*\(?\s*(select|with)\b', re.IGNORECASE)
+
+
+def _apply_row_limit(sql: str, max_rows: int) -> str:
+    """
+    Agrega LIMIT max_rows a un SELECT que no tenga LIMIT final, para que BigQuery no materialice
+    (ni ordene/transfiera) más filas de las que se van a leer. Los demás statements no se tocan.
+    """
+    if not _RE_SELECT_START.match(sql) or _RE_TRAILING_LIMIT.search(sql):
+        return sql
+    # En una línea nueva: si la query termina con un comentario "--", el LIMIT no queda comentado
+    return f"{sql.rstrip().rstrip(';').rstrip()}\nLIMIT {max_rows}"
+
+
+def _query_job_config() -> bigquery.QueryJobConfig:
+    """
+    Configuración común de los jobs de query: SQL estándar, tope de bytes facturados,
+    prioridad interactiva y caché de resultados de BigQuery explícito (el mismo SQL
+    repetido, ej: por el LLM con temperature=0, se sirve gratis desde el caché)
+    """
+    return bigquery.QueryJobConfig(
+        maximum_bytes_billed=_MAX_BYTES_BILLED or None,
+        use_query_cache=True,
+        use_legacy_sql=False,
+        priority=bigquery.QueryPriority.INTERACTIVE,
+        dry_run=False
+    )
+
+
+def _query_stats(results, client: bigquery.Client) -> Tuple[Optional[bool], Optional[int]]:
+    """
+    (cache_hit, bytes procesados) de un resultado de query_and_wait.
+    El RowIterator no los expone como atributos: se leen de la respuesta de jobs.query (primera página).
+    Si query_and_wait cayó a jobs.insert esa respuesta no está, y se leen del QueryJob.
+    """
+    response = getattr(results, "_first_page_response", None) or {}
+    if "cacheHit" in response or "totalBytesProcessed" in response:
+        bytes_processed = response.get("totalBytesProcessed")
+        return response.get("cacheHit"), int(bytes_processed) if bytes_processed is not None else None
+    
+    if not results.job_id:
+        return None, None
+    try:
+        job = client.get_job(results.job_id, project=results.project, location=results.location)
+        return job.cache_hit, job.total_bytes_processed
+    except Exception as e:
+        log_warning("Could not read stats for job %s: %s", results.job_id, e)
+        return None, None
+
+
+def estimate_query_bytes(sql: str, client: Optional[bigquery.Client] = None) -> int:
+    """
+    Estima los bytes que procesaría una query usando dry-run (no se cobra ni escanea datos)
+    
+    Args:
+        sql: Query SQL a estimar
+        client: Cliente de BigQuery (por defecto el compartido)
+        
+    Returns:
+        Bytes estimados a procesar
+        
+    Raises:
+        Exception: Si el SQL es inválido (BigQuery lo valida en el dry-run)
+    """
+    client = client or get_bigquery_client()
+    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False, use_legacy_sql=False)
+    dry_run_job = client.query(sql, job_config=job_config)
+    return dry_run_job.total_bytes_processed or 0
+
+
+def _query_result_cache_key(sql: str, max_rows: int) -> bytes:
+    """Hash del SQL (tal como se recibió) + límite de filas"""
+    return hashlib.blake2b(f"{max_rows}\x00{sql}".encode(), digest_size=16).digest()
+
+
+def _get_cached_query_result(key: bytes) -> Optional[Dict[str, Any]]:
+    """Retorna el resultado cacheado si existe y no expiró"""
+    with _QUERY_RESULT_CACHE_LOCK:
+        entry = _QUERY_RESULT_CACHE.get(key)
+        if entry is not None and time.time() - entry[1] > _QUERY_RESULT_CACHE_TTL_SECONDS:
+            del _QUERY_RESULT_CACHE[key]
+            entry = None
+        if entry is None:
+            _QUERY_RESULT_CACHE_STATS["misses"] += 1
+            return None
+        _QUERY_RESULT_CACHE_STATS["hits"] += 1
+        _QUERY_RESULT_CACHE.move_to_end(key)
+        return entry[0]
+
+
+def _store_query_result(key: bytes, result: Dict[str, Any]):
+    """Guarda un resultado en el caché (LRU)"""
+    with _QUERY_RESULT_CACHE_LOCK:
+        _QUERY_RESULT_CACHE[key] = (result, time.time())
+        _QUERY_RESULT_CACHE.move_to_end(key)
+        if len(_QUERY_RESULT_CACHE) > _MAX_QUERY_RESULT_CACHE_SIZE:
+            _QUERY_RESULT_CACHE.popitem(last=False)
+
+
+def execute_query(
+    sql: str,
+    max_rows: int = 100,
+    client: Optional[bigquery.Client] = None,
+    dry_run: bool = False
+) -> Dict[str, Any]:
     """
     Ejecuta una query SQL en BigQuery y retorna los resultados
     
     Args:
         sql: Query SQL a ejecutar
         max_rows: Máximo número de filas a retornar
+        client: Cliente de BigQuery (por defecto el compartido)
+        dry_run: Si es True no ejecuta la query: solo valida el SQL y retorna
+            bytes_processed estimado (sin filas, sin costo de escaneo)
         
     Returns:
         Dict con:
@@ -311,83 +1325,216 @@ def execute_query(sql: str, max_rows: int = 100) -> Dict[str, Any]:
             - bytes_processed: bytes procesados por BigQuery
             
     Raises:
+        SqlCostExceeded: Si el dry-run estima más bytes que BQ_COST_GATE_MAX_BYTES
         Exception: Si hay error en la ejecución
     """
     start_time = time.time()
-    log_info(f"🔵 [BQ] Inicio execute_query")
+    log_info("🔵 [BQ] Inicio execute_query")
+    
+    # Solo se cachean ejecuciones reales con el cliente compartido
+    result_cache_key = None
+    if not dry_run and client is None and _QUERY_RESULT_CACHE_TTL_SECONDS > 0:
+        result_cache_key = _query_result_cache_key(sql, max_rows)
+        cached_result = _get_cached_query_result(result_cache_key)
+        if cached_result is not None:
+            duration_ms = (time.time() - start_time) * 1000
+            log_info("✨ [BQ] Result served from query result cache (%s rows)", cached_result['total_rows'])
+            return {**cached_result, "duration_ms": duration_ms, "result_cache_hit": True}
     
     client_start = time.time()
-    client = get_bigquery_client()
-    log_info(f"🔵 [BQ] Cliente obtenido en {(time.time()-client_start):.3f}s")
+    client = client or get_bigquery_client()
+    log_info("🔵 [BQ] Cliente obtenido en %.3fs", time.time() - client_start)
+    
+    log_info("Executing query in BigQuery (max %s rows)", max_rows)
+    log_info("Query: %s%s", sql[:100], "..." if len(sql) > 100 else "")
     
-    log_info(f"Executing query in BigQuery (max {max_rows} rows)")
-    log_info(f"Query: {sql[:100]}..." if len(sql) > 100 else f"Query: {sql}")
+    limited_sql = _apply_row_limit(sql, max_rows)
+    if limited_sql != sql:
+        log_info("🔵 [BQ] LIMIT %s pushed into the query (original had no LIMIT)", max_rows)
+        sql = limited_sql
     
     try:
+        if dry_run:
+            estimated_bytes = estimate_query_bytes(sql, client)
+            duration_ms = (time.time() - start_time) * 1000
+            log_info("🔵 [BQ] Dry-run only: %.2f MB estimados", estimated_bytes / 1024 / 1024)
+            return {
+                "columns": [],
+                "rows": [],
+                "total_rows": 0,
+                "duration_ms": duration_ms,
+                "bytes_processed": estimated_bytes,
+                "dry_run": True
+            }
+        
+        # ⚡ Control de costo: estimar con dry-run antes de pagar el escaneo completo
+        estimated_bytes = None
+        if _COST_GATE_ENABLED:
+            estimated_bytes = estimate_query_bytes(sql, client)
+            log_info("🔵 [BQ] Dry-run: %.2f MB estimados", estimated_bytes / 1024 / 1024)
+            if estimated_bytes > _COST_GATE_MAX_BYTES:
+                raise SqlCostExceeded(estimated_bytes, _COST_GATE_MAX_BYTES)
+        
         # Ejecutar la query
         query_start = time.time()
-        log_info(f"🔵 [BQ] Enviando query a BigQuery...")
-        query_job = client.query(sql)
-        log_info(f"🔵 [BQ] Query enviada, esperando resultados...")
-        results = query_job.result(max_results=max_rows)
-        log_info(f"🔵 [BQ] Resultados recibidos en {(time.time()-query_start):.3f}s")
-        
-        # Extraer columnas
-        columns = [field.name for field in results.schema]
+        log_info("🔵 [BQ] Enviando query a BigQuery...")
         
-        # Extraer filas
-        rows = []
-        for row in results:
-            # Convertir cada fila a lista (manejando tipos especiales)
-            row_list = []
-            for value in row.values():
-                # Convertir tipos especiales a strings
-                if hasattr(value, 'isoformat'):  # Fechas/timestamps
-                    row_list.append(value.isoformat())
-                elif value is None:
-                    row_list.append(None)
-                else:
-                    row_list.append(str(value) if not isinstance(value, (int, float, bool)) else value)
-            rows.append(row_list)
+        bqstorage_client = get_bigquery_storage_client() if max_rows > _STORAGE_API_MIN_ROWS else None
+        if bqstorage_client:
+            # La Storage API no se usa si se pasa max_results: se corta la lectura por bloques
+            query_job = client.query(sql, job_config=_query_job_config())
+            results = query_job.result()
+            log_info("🔵 [BQ] Resultados listos en %.3fs (Storage Read API)", time.time() - query_start)
+            columns = [field.name for field in results.schema]
+            rows = _read_rows_with_storage_api(results, max_rows, bqstorage_client)
+            bytes_processed = query_job.total_bytes_processed
+            cache_hit = query_job.cache_hit
+        else:
+            # ⚡ jobs.query: un solo round-trip que ya trae la primera página de resultados
+            # (en lugar de jobs.insert + polling de jobs.getQueryResults)
+            results = client.query_and_wait(sql, job_config=_query_job_config(), max_results=max_rows)
+            log_info("🔵 [BQ] Resultados recibidos en %.3fs", time.time() - query_start)
+            
+            # Extraer columnas
+            columns = [field.name for field in results.schema]
+            
+            # Extraer filas (conversión resuelta por tipo de columna)
+            rows = _convert_rows(results, _converters_for_schema(results.schema))
+            
+            # query_and_wait no expone el job: tomar las estadísticas de la respuesta de jobs.query
+            # (o del job, si hubo uno) y, si no vienen, usar la estimación del dry-run
+            cache_hit, bytes_processed = _query_stats(results, client)
+            if bytes_processed is None:
+                bytes_processed = 0 if cache_hit else estimated_bytes
         
         duration_ms = (time.time() - start_time) * 1000
         
-        # Obtener estadísticas del job
-        bytes_processed = None
-        if query_job.done():
-            bytes_processed = query_job.total_bytes_processed
-            if bytes_processed:
-                log_info(f"Bytes procesados: {bytes_processed:,} ({bytes_processed / 1024 / 1024:.2f} MB)")
+        if cache_hit is not None:
+            log_info("🔵 [BQ] cache_hit=%s", cache_hit)
+        if bytes_processed:
+            log_info("Bytes procesados: %s (%.2f MB)", format(bytes_processed, ","), bytes_processed / 1024 / 1024)
         
-        log_info(f"Query executed successfully in {duration_ms/1000:.2f}s")
-        log_info(f"Rows returned: {len(rows)}")
+        log_info("Query executed successfully in %.2fs", duration_ms / 1000)
+        log_info("Rows returned: %s", len(rows))
         
-        return {
+        result = {
             "columns": columns,
             "rows": rows,
             "total_rows": len(rows),
             "duration_ms": duration_ms,
-            "bytes_processed": bytes_processed
+            "bytes_processed": bytes_processed,
+            "cache_hit": cache_hit
         }
+        if result_cache_key is not None:
+            _store_query_result(result_cache_key, result)
+        return result
         
+    except SqlCostExceeded as e:
+        log_warning("💸 Query rejected by cost gate: %s", e)
+        raise
     except Exception as e:
         duration_ms = (time.time() - start_time) * 1000
         log_error(f"Error executing query after {duration_ms/1000:.2f}s", e)
         raise Exception(f"Error ejecutando query en BigQuery: {str(e)}")
 
 
+async def execute_query_async(
+    sql: str,
+    max_rows: int = 100,
+    client: Optional[bigquery.Client] = None,
+    dry_run: bool = False
+) -> Dict[str, Any]:
+    """
+    Versión async de execute_query para handlers async (FastAPI)
+    
+    ⚡ La espera del RPC y la conversión de filas corren en un thread,
+    así el event loop sigue atendiendo otras requests mientras tanto.
+    """
+    return await asyncio.to_thread(execute_query, sql, max_rows, client, dry_run)
+
+
+def execute_query_stream(
+    sql: str,
+    max_rows: int = 10000,
+    chunk_size: int = 500,
+    client: Optional[bigquery.Client] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Ejecuta una query y entrega los resultados por partes, sin materializar todas las filas.
+    Pensado para resultados grandes que se envían directamente al cliente (ej: StreamingResponse).
+    
+    Args:
+        sql: Query SQL a ejecutar
+        max_rows: Máximo número de filas a leer
+        chunk_size: Filas por página pedida a BigQuery (y por chunk entregado)
+        client: Cliente de BigQuery (por defecto el compartido)
+        
+    Yields:
+        Primero {"columns": [...]}, luego {"rows": [...]} por cada página de resultados
+    """
+    client = client or get_bigquery_client()
+    log_info("Streaming query results from BigQuery (max %s rows, chunks of %s)", max_rows, chunk_size)
+    
+    try:
+        results = client.query_and_wait(
+            sql, job_config=_query_job_config(), max_results=max_rows, page_size=chunk_size
+        )
+        
+        yield {"columns": [field.name for field in results.schema]}
+        
+        converters = _converters_for_schema(results.schema)
+        for page in results.pages:
+            yield {"rows": _convert_rows(page, converters)}
+    except Exception as e:
+        log_error("Error streaming query results", e)
+        raise Exception(f"Error ejecutando query en BigQuery: {str(e)}")
+
+
+# ⚡ Resultado del health check cacheado (positivo o negativo) durante BQ_HEALTHCHECK_TTL segundos
+_HEALTHCHECK_TTL_SECONDS = int(os.getenv("BQ_HEALTHCHECK_TTL", "30"))
+_HEALTHCHECK_RESULT: Optional[Tuple[bool, float]] = None  # (ok, checked_at)
+_HEALTHCHECK_LOCK = threading.Lock()
+
+
+def _healthcheck_cached() -> Optional[bool]:
+    """Resultado del último health check si todavía está vigente"""
+    result = _HEALTHCHECK_RESULT
+    if result is not None and time.time() - result[1] < _HEALTHCHECK_TTL_SECONDS:
+        return result[0]
+    return None
+
+
 def test_connection() -> bool:
     """
-    Prueba la conexión a BigQuery con una query simple
+    Prueba la conexión a BigQuery con un dry-run de SELECT 1
+    
+    ⚡ El dry-run valida credenciales, permisos y el endpoint sin crear un job ni
+    ejecutar nada (~50 ms en lugar de ~500 ms de una query real).
+    El resultado se cachea durante BQ_HEALTHCHECK_TTL segundos y los chequeos
+    concurrentes comparten el mismo chequeo en curso.
     
     Returns:
         True si la conexión funciona
     """
-    try:
-        client = get_bigquery_client()
-        query = "SELECT 1 as test"
-        results = list(client.query(query).result())
-        return len(results) > 0
-    except Exception:
-        return False
+    global _HEALTHCHECK_RESULT
+    cached = _healthcheck_cached()
+    if cached is not None:
+        return cached
+    
+    with _HEALTHCHECK_LOCK:
+        # Otro thread pudo haber hecho el chequeo mientras esperábamos el lock
+        cached = _healthcheck_cached()
+        if cached is not None:
+            return cached
+        
+        try:
+            client = get_bigquery_client()
+            job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False, use_legacy_sql=False)
+            client.query("SELECT 1", job_config=job_config)
+            ok = True
+        except Exception:
+            ok = False
+        
+        _HEALTHCHECK_RESULT = (ok, time.time())
+        return ok
 
@@ -2,15 +2,64 @@
 Módulo para interactuar con Vertex AI Gemini
 Responsable de convertir lenguaje natural a SQL
 """
+import io
 import os
 import re
+import csv
 import time
+import orjson
+import random
+import hashlib
+import threading
 import vertexai
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import lru_cache
 from vertexai.generative_models import GenerativeModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from google.api_core import exceptions as google_exceptions
 from app.logger import log_info, log_error, log_warning
 
+# ⚡ Regex compiladas una sola vez al importar (se usan en cada generación de SQL)
+# Ruido alrededor del SQL: fences markdown (```sql / ```) y comentarios de una línea, en una sola pasada
+_RE_SQL_NOISE = re.compile(r'```(?:sql)?\s*|--[^\n]*')
+_RE_WS = re.compile(r'\s+')
+_RE_TABLE_FROM_PROMPT = re.compile(r'TABLA PRINCIPAL.*?: `([^`]+)`')
+# Referencias a tablas en el SQL: con backticks completos, o sin backticks
+_RE_BACKTICK_TABLE = re.compile(r'`([^`]+\.(?:Gold|Dim)\.[^`]+)`', re.IGNORECASE)
+_RE_BARE_TABLE = re.compile(r'([a-zA-Z0-9\-]+\.[a-zA-Z0-9\-]+\.[a-zA-Z0-9_\-]+)', re.IGNORECASE)
+_TABLE_PATTERNS = (_RE_BACKTICK_TABLE, _RE_BARE_TABLE)
+# Bloque JSON dentro de un fence markdown (```json ... ``` o ``` ... ```)
+_RE_JSON_FENCE = re.compile(r'```(?:json)?\s*(.*?)\s*```', re.DOTALL)
+
+# ⚡ Configuración ultra-optimizada para velocidad máxima (generación de SQL)
+_SQL_GENERATION_CONFIG = {
+    "temperature": 0,           # Determinista
+    "top_p": 0.8,              # Muy enfocado
+    "top_k": 10,               # Pocas opciones = más rápido
+    "max_output_tokens": 256,  # SQL es corto
+    "candidate_count": 1,      # Solo una respuesta
+    "stop_sequences": [";"],   # El decoder corta al terminar la sentencia (no paga tokens de más)
+}
+
+# Descomposición de preguntas: misma configuración pero sin stop (la respuesta es JSON)
+_DECOMPOSE_GENERATION_CONFIG = {
+    "temperature": 0,
+    "top_p": 0.8,
+    "top_k": 10,
+    "max_output_tokens": 256,
+    "candidate_count": 1,
+}
+
+# Recomendación de gráficos: un poco más de variación
+_CHART_GENERATION_CONFIG = {
+    "temperature": 0.3,
+    "top_p": 0.8,
+    "top_k": 10,
+    "max_output_tokens": 256,
+    "candidate_count": 1,
+}
+
 
 def init_vertex_ai():
     """Inicializa Vertex AI con las credenciales del proyecto"""
@@ -20,10 +69,191 @@ def init_vertex_ai():
     if not project_id:
         raise ValueError("PROJECT_ID no está configurado en las variables de entorno")
     
-    log_info(f"Initializing Vertex AI - Project: {project_id}, Location: {location}")
+    log_info("Initializing Vertex AI - Project: %s, Location: %s", project_id, location)
     vertexai.init(project=project_id, location=location)
 
 
+# ⚡ Caché de respuestas de nl_to_sql por hash del prompt normalizado
+# El prompt ya incluye schema y dimensiones: si cambian, cambia la clave.
+# Además, cada entrada expira por TTL y tras LLM_CACHE_MAX_HITS lecturas (red de seguridad).
+_MAX_LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_MAX_SIZE", "1024"))
+_LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "600"))
+_LLM_CACHE_MAX_HITS = int(os.getenv("LLM_CACHE_MAX_HITS", "500"))
+_LLM_CACHE: "OrderedDict[bytes, list]" = OrderedDict()  # hash -> [resultado, expira_en, hits]
+_LLM_CACHE_LOCK = threading.Lock()
+_LLM_CACHE_STATS = {"hits": 0, "misses": 0}
+# Época del caché: se incrementa al refrescar schemas/dimensiones e invalida todas las claves anteriores
+_LLM_CACHE_EPOCH = 0
+
+
+def _llm_cache_key(prompt: str, model_name: str) -> bytes:
+    """Hash del prompt con espacios colapsados + modelo + época del caché"""
+    # Sin pasar a minúsculas: los literales del prompt ('ACME' vs 'acme') cambian el SQL en BigQuery
+    normalized = ' '.join(prompt.split())
+    key_source = f"{_LLM_CACHE_EPOCH}\x00{model_name}\x00{normalized}"
+    return hashlib.blake2b(key_source.encode(), digest_size=16).digest()
+
+
+def _get_cached_llm_result(key: bytes) -> Optional[Dict[str, Any]]:
+    """Retorna el resultado cacheado si existe, no expiró y no superó el máximo de lecturas"""
+    with _LLM_CACHE_LOCK:
+        entry = _LLM_CACHE.get(key)
+        if entry is not None and (time.time() > entry[1] or entry[2] >= _LLM_CACHE_MAX_HITS):
+            del _LLM_CACHE[key]
+            entry = None
+        if entry is None:
+            _LLM_CACHE_STATS["misses"] += 1
+            return None
+        _LLM_CACHE_STATS["hits"] += 1
+        result, _, hits = entry
+        entry[2] = hits + 1
+        _LLM_CACHE.move_to_end(key)
+        return result
+
+
+def _store_llm_result(key: bytes, result: Dict[str, Any]):
+    """Guarda un resultado en el caché (LRU)"""
+    with _LLM_CACHE_LOCK:
+        _LLM_CACHE[key] = [result, time.time() + _LLM_CACHE_TTL_SECONDS, 0]
+        _LLM_CACHE.move_to_end(key)
+        if len(_LLM_CACHE) > _MAX_LLM_CACHE_SIZE:
+            _LLM_CACHE.popitem(last=False)
+
+
+# ⚡ Llamadas a Gemini en vuelo por clave de caché: requests concurrentes con el mismo prompt
+# esperan la misma respuesta en vez de disparar una llamada cada uno (single-flight)
+_LLM_INFLIGHT: Dict[bytes, Future] = {}
+_LLM_INFLIGHT_LOCK = threading.Lock()
+_LLM_INFLIGHT_JOINED = 0
+
+
+def _join_inflight(key: bytes) -> Tuple[Future, bool]:
+    """Retorna (future, es_líder): el líder hace la llamada, el resto espera su future"""
+    global _LLM_INFLIGHT_JOINED
+    with _LLM_INFLIGHT_LOCK:
+        future = _LLM_INFLIGHT.get(key)
+        if future is not None:
+            _LLM_INFLIGHT_JOINED += 1
+            return future, False
+        future = Future()
+        _LLM_INFLIGHT[key] = future
+        return future, True
+
+
+def _leave_inflight(key: bytes):
+    """Quita la llamada del registro de llamadas en vuelo (la hace el líder al terminar)"""
+    with _LLM_INFLIGHT_LOCK:
+        _LLM_INFLIGHT.pop(key, None)
+
+
+def clear_llm_cache():
+    """Invalida el caché de respuestas del LLM (ej: después de refrescar schemas o dimensiones)"""
+    global _LLM_CACHE_EPOCH
+    with _LLM_CACHE_LOCK:
+        _LLM_CACHE_EPOCH += 1
+        count = len(_LLM_CACHE)
+        _LLM_CACHE.clear()
+    log_info("🧹 LLM cache cleared (%s entries)", count)
+
+
+def get_llm_cache_stats() -> Dict[str, Any]:
+    """Estadísticas del caché de respuestas del LLM"""
+    return {
+        "llm_cache_size": len(_LLM_CACHE),
+        "llm_cache_max": _MAX_LLM_CACHE_SIZE,
+        "llm_cache_ttl_seconds": _LLM_CACHE_TTL_SECONDS,
+        "llm_cache_epoch": _LLM_CACHE_EPOCH,
+        "llm_cache_hits": _LLM_CACHE_STATS["hits"],
+        "llm_cache_misses": _LLM_CACHE_STATS["misses"],
+        "llm_inflight": len(_LLM_INFLIGHT),
+        "llm_inflight_joined": _LLM_INFLIGHT_JOINED
+    }
+
+
+# Backoff ante 429: tope de espera por reintento (segundos)
+_RETRY_MAX_WAIT_SECONDS = float(os.getenv("GEMINI_RETRY_MAX_WAIT_SECONDS", "16"))
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """Espera sugerida por el servidor (header Retry-After o RetryInfo de gRPC), si viene en el error"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        try:
+            return float(headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            pass
+    for detail in getattr(error, "details", None) or []:
+        retry_delay = getattr(detail, "retry_delay", None)
+        if retry_delay is not None:
+            return retry_delay.seconds + retry_delay.nanos / 1e9
+    return None
+
+
+def _backoff_seconds(retry_count: int, error: Exception) -> float:
+    """
+    ⚡ Backoff exponencial con jitter completo: random(0, min(tope, 2^n)).
+    Evita que clientes concurrentes reintenten todos al mismo tiempo y vuelvan a disparar el 429.
+    Si el servidor indica cuánto esperar, se respeta como mínimo.
+    """
+    wait_time = random.uniform(0, min(_RETRY_MAX_WAIT_SECONDS, 2 ** retry_count))
+    retry_after = _retry_after_seconds(error)
+    if retry_after is not None:
+        wait_time = max(wait_time, retry_after)
+    return wait_time
+
+
+@lru_cache(maxsize=8)
+def _build_model(model_name: str, config_items: tuple) -> GenerativeModel:
+    """Construye un GenerativeModel una sola vez por (modelo, configuración)"""
+    generation_config = {key: list(value) if isinstance(value, tuple) else value for key, value in config_items}
+    return GenerativeModel(model_name, generation_config=generation_config)
+
+
+def _get_model(model_name: str, generation_config: Dict[str, Any]) -> GenerativeModel:
+    """
+    ⚡ Retorna el GenerativeModel cacheado para el modelo y la configuración dados
+    (evita re-inicializar stubs y validar la configuración en cada llamada)
+    """
+    config_items = tuple(sorted(
+        (key, tuple(value) if isinstance(value, list) else value)
+        for key, value in generation_config.items()
+    ))
+    return _build_model(model_name, config_items)
+
+
+def _generate_sql_text(model: GenerativeModel, prompt: str) -> Tuple[str, Any]:
+    """
+    ⚡ Genera el SQL en modo streaming y corta apenas llega el fin de la sentencia (";")
+    
+    Returns:
+        Tupla con (texto generado, usage_metadata del último chunk o None)
+    """
+    parts = []
+    usage_metadata = None
+    responses = model.generate_content(prompt, stream=True)
+    try:
+        for chunk in responses:
+            usage_metadata = getattr(chunk, "usage_metadata", None) or usage_metadata
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk sin texto (ej: solo finish_reason)
+                continue
+            parts.append(text)
+            if ";" in text:
+                break
+    finally:
+        # Cortar el stream si salimos antes de consumirlo completo
+        close = getattr(responses, "close", None)
+        if close:
+            close()
+    
+    text = "".join(parts)
+    # Descartar lo que venga después del ";" (el server también corta con stop_sequences)
+    return text.split(";", 1)[0], usage_metadata
+
+
 def nl_to_sql(prompt: str, model_name: Optional[str] = None, max_retries: int = 3) -> Dict[str, Any]:
     """
     Convierte una pregunta en lenguaje natural a SQL usando Gemini
@@ -43,7 +273,41 @@ def nl_to_sql(prompt: str, model_name: Optional[str] = None, max_retries: int =
         model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
     
     start_time = time.time()
-    log_info(f"Generating SQL with model: {model_name}")
+    
+    # ⚡ Pregunta repetida (mismo prompt normalizado): responder sin llamar a Gemini
+    cache_key = _llm_cache_key(prompt, model_name)
+    cached_result = _get_cached_llm_result(cache_key)
+    if cached_result is not None:
+        duration_ms = (time.time() - start_time) * 1000
+        log_info("✨ SQL obtained from LLM cache in %.1fms", duration_ms)
+        return {**cached_result, 'duration_ms': duration_ms, 'retry_count': 0, 'cached': True}
+    
+    # El mismo prompt ya se está generando en otro request: esperar ese resultado
+    future, is_leader = _join_inflight(cache_key)
+    if not is_leader:
+        log_info("⏳ Same prompt already in flight - waiting for its result")
+        result = future.result()
+        duration_ms = (time.time() - start_time) * 1000
+        return {**result, 'duration_ms': duration_ms, 'retry_count': 0, 'cached': True}
+    
+    try:
+        result = _generate_sql_with_retries(prompt, model_name, max_retries, start_time)
+        _store_llm_result(cache_key, result)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        _leave_inflight(cache_key)
+
+
+def _generate_sql_with_retries(prompt: str, model_name: str, max_retries: int, start_time: float) -> Dict[str, Any]:
+    """Llama a Gemini con reintentos ante 429 y arma el resultado de nl_to_sql"""
+    log_info("Generating SQL with model: %s", model_name)
+    
+    # El modelo se construye (o se toma del caché) una sola vez, fuera del loop de reintentos
+    model = _get_model(model_name, _SQL_GENERATION_CONFIG)
     
     # Retry logic con backoff exponencial
     retry_count = 0
@@ -51,32 +315,20 @@ def nl_to_sql(prompt: str, model_name: Optional[str] = None, max_retries: int =
     
     while retry_count <= max_retries:
         try:
-            # ⚡ Configuración ultra-optimizada para velocidad máxima
-            model = GenerativeModel(
-                model_name,
-                generation_config={
-                    "temperature": 0,           # Determinista
-                    "top_p": 0.8,              # Muy enfocado
-                    "top_k": 10,               # Pocas opciones = más rápido
-                    "max_output_tokens": 256,  # SQL es corto
-                    "candidate_count": 1,      # Solo una respuesta
-                }
-            )
-            
             # Generar el SQL
             if retry_count > 0:
-                log_warning(f"Retry {retry_count}/{max_retries} - Calling Gemini...")
+                log_warning("Retry %s/%s - Calling Gemini...", retry_count, max_retries)
             else:
                 log_info("⏳ Calling Gemini to generate SQL...")
             
             # Medir tiempo de llamada a la API
             api_start = time.time()
-            response = model.generate_content(prompt)
+            response_text, usage_metadata = _generate_sql_text(model, prompt)
             api_duration = (time.time() - api_start) * 1000
-            log_info(f"⚡ Response received from Gemini in {api_duration/1000:.2f}s")
+            log_info("⚡ Response received from Gemini in %.2fs", api_duration / 1000)
         
             # Extraer solo el SQL de la respuesta
-            sql = extract_sql_from_response(response.text)
+            sql = extract_sql_from_response(response_text)
             
             # Validar y corregir el nombre de la tabla si es necesario
             sql = validate_and_fix_table_name(sql, prompt)
@@ -86,24 +338,24 @@ def nl_to_sql(prompt: str, model_name: Optional[str] = None, max_retries: int =
             # Intentar extraer metadata de uso (si está disponible)
             tokens_used = None
             try:
-                if hasattr(response, 'usage_metadata'):
+                if usage_metadata is not None:
                     tokens_used = {
-                        'prompt_tokens': getattr(response.usage_metadata, 'prompt_token_count', None),
-                        'candidates_tokens': getattr(response.usage_metadata, 'candidates_token_count', None),
-                        'total_tokens': getattr(response.usage_metadata, 'total_token_count', None)
+                        'prompt_tokens': getattr(usage_metadata, 'prompt_token_count', None),
+                        'candidates_tokens': getattr(usage_metadata, 'candidates_token_count', None),
+                        'total_tokens': getattr(usage_metadata, 'total_token_count', None)
                     }
-                    log_info(f"Tokens used: {tokens_used}")
+                    log_info("Tokens used: %s", tokens_used)
             except:
                 pass
             
             if retry_count > 0:
-                log_info(f"✅ Success after {retry_count} retry(s) in {duration_ms/1000:.2f}s")
+                log_info("✅ Success after %s retry(s) in %.2fs", retry_count, duration_ms / 1000)
             else:
-                log_info(f"SQL generated successfully in {duration_ms/1000:.2f}s")
+                log_info("SQL generated successfully in %.2fs", duration_ms / 1000)
             
-            log_info(f"SQL: {sql[:100]}..." if len(sql) > 100 else f"SQL: {sql}")
+            log_info("SQL: %s%s", sql[:100], "..." if len(sql) > 100 else "")
             
-            return {
+            result = {
                 'sql': sql,
                 'model_used': model_name,
                 'duration_ms': duration_ms,
@@ -112,6 +364,7 @@ def nl_to_sql(prompt: str, model_name: Optional[str] = None, max_retries: int =
                 'sql_length': len(sql),
                 'retry_count': retry_count
             }
+            return result
             
         except google_exceptions.ResourceExhausted as e:
             # Error 429 - Rate limit excedido
@@ -119,9 +372,8 @@ def nl_to_sql(prompt: str, model_name: Optional[str] = None, max_retries: int =
             last_error = e
             
             if retry_count <= max_retries:
-                # Backoff exponencial: 2^retry_count segundos
-                wait_time = 2 ** retry_count
-                log_warning(f"⚠️  Error 429 (Rate Limit) - Waiting {wait_time}s before retrying...")
+                wait_time = _backoff_seconds(retry_count, e)
+                log_warning("⚠️  Error 429 (Rate Limit) - Waiting %.2fs before retrying...", wait_time)
                 time.sleep(wait_time)
             else:
                 duration_ms = (time.time() - start_time) * 1000
@@ -139,11 +391,28 @@ def nl_to_sql(prompt: str, model_name: Optional[str] = None, max_retries: int =
             raise Exception(f"Error al generar SQL con Gemini: {str(e)}")
 
 
+def _parse_json_response(response_text: str) -> Any:
+    """Parsea el JSON de una respuesta del modelo, quitando el fence markdown si existe"""
+    match = _RE_JSON_FENCE.search(response_text)
+    payload = match.group(1) if match else response_text.strip()
+    return orjson.loads(payload)
+
+
+def _rows_to_csv(columns: list, rows: list) -> str:
+    """Serializa columnas + filas a CSV compacto (None -> campo vacío)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    width = len(columns)
+    writer.writerows(row[:width] for row in rows)
+    return buffer.getvalue().rstrip("\n")
+
+
 def recommend_chart_type(
     question: str,
     columns: list,
     rows: list,
-    max_rows_sample: int = 20
+    max_rows_sample: int = 10
 ) -> Dict[str, Any]:
     """
     Usa Gemini para analizar los datos y recomendar el tipo de gráfico más apropiado
@@ -163,13 +432,8 @@ def recommend_chart_type(
     # Limitar filas para no exceder tokens
     sample_rows = rows[:max_rows_sample]
     
-    # Preparar datos en formato legible
-    data_sample = []
-    for row in sample_rows:
-        row_dict = {}
-        for i, col in enumerate(columns):
-            row_dict[col] = row[i] if i < len(row) else None
-        data_sample.append(row_dict)
+    # ⚡ Muestra en CSV (encabezado + filas): muchos menos tokens que el repr de una lista de dicts
+    data_block = _rows_to_csv(columns, sample_rows)
     
     prompt = f"""Analyze the following query results and determine if a chart would be helpful for visualization.
 
@@ -177,8 +441,8 @@ User Question: "{question}"
 
 Columns: {', '.join(columns)}
 Total Rows: {len(rows)}
-Sample Data (first {len(sample_rows)} rows):
-{str(data_sample)}
+CSV data follows (first {len(sample_rows)} rows, header included):
+{data_block}
 
 Based on the question, data structure, and sample values, determine:
 1. Should this data be visualized? (yes/no)
@@ -204,34 +468,16 @@ Respond ONLY with valid JSON in this exact format:
     
     try:
         model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
-        model = GenerativeModel(
-            model_name,
-            generation_config={
-                "temperature": 0.3,
-                "top_p": 0.8,
-                "top_k": 10,
-                "max_output_tokens": 256,
-                "candidate_count": 1,
-            }
-        )
+        model = _get_model(model_name, _CHART_GENERATION_CONFIG)
         
         log_info("📊 Analyzing data with Gemini to recommend chart type...")
         response = model.generate_content(prompt)
         
         # Extraer JSON de la respuesta
-        import json
-        response_text = response.text.strip()
-        
-        # Limpiar markdown si existe
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0].strip()
-        
-        result = json.loads(response_text)
+        result = _parse_json_response(response.text)
         
         if result.get("should_visualize") and result.get("chart_type"):
-            log_info(f"✅ Chart recommended: {result['chart_type']}")
+            log_info("✅ Chart recommended: %s", result['chart_type'])
             return {
                 "chart_type": result["chart_type"],
                 "chart_config": {
@@ -244,10 +490,61 @@ Respond ONLY with valid JSON in this exact format:
             return {"chart_type": None, "chart_config": None}
             
     except Exception as e:
-        log_warning(f"Error analyzing data for chart: {e}")
+        log_warning("Error analyzing data for chart: %s", e)
         return {"chart_type": None, "chart_config": None}
 
 
+def decompose_question(question: str, max_sub_questions: int = 4) -> List[str]:
+    """
+    Usa Gemini para dividir una pregunta compuesta (comparaciones entre períodos,
+    regiones, productos, etc.) en sub-preguntas independientes que se pueden
+    resolver con queries separadas en paralelo
+    
+    Args:
+        question: Pregunta original del usuario
+        max_sub_questions: Número máximo de sub-preguntas permitidas
+        
+    Returns:
+        Lista de sub-preguntas, o [question] si no conviene dividirla
+    """
+    prompt = f"""Decide if the following question should be split into independent sub-questions, each answerable by a separate SQL query over the same table.
+
+Question: "{question}"
+
+Split ONLY when the question compares separate slices of data (e.g. "Q1 2025 vs Q1 2024", "province A compared to province B").
+Each sub-question must produce the SAME columns so the results can be stacked together.
+Keep each sub-question self-contained. Use at most {max_sub_questions} sub-questions.
+
+Respond ONLY with valid JSON in this exact format:
+{{
+    "sub_questions": ["...", "..."]
+}}
+Return an empty list if the question should not be split.
+"""
+    
+    try:
+        model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
+        model = _get_model(model_name, _DECOMPOSE_GENERATION_CONFIG)
+        
+        log_info("🧩 Asking Gemini whether to decompose the question...")
+        response = model.generate_content(prompt)
+        
+        result = _parse_json_response(response.text)
+        sub_questions = [
+            q.strip() for q in result.get("sub_questions", [])
+            if isinstance(q, str) and q.strip()
+        ]
+        
+        if 1 < len(sub_questions) <= max_sub_questions:
+            log_info("✅ Question decomposed into %s sub-questions", len(sub_questions))
+            return sub_questions
+            
+    except Exception as e:
+        log_warning("Error decomposing question: %s", e)
+    
+    return [question]
+
+
 def extract_sql_from_response(response_text: str) -> str:
     """
     Extrae el SQL limpio de la respuesta del modelo
@@ -259,22 +556,17 @@ def extract_sql_from_response(response_text: str) -> str:
     Returns:
         SQL limpio y ejecutable
     """
-    # Eliminar bloques de código markdown ```sql ... ```
-    sql = re.sub(r'```sql\s*', '', response_text)
-    sql = re.sub(r'```\s*', '', sql)
-    
-    # Eliminar comentarios de una línea
-    sql = re.sub(r'--[^\n]*', '', sql)
+    # Eliminar bloques de código markdown ```sql ... ``` y comentarios de una línea
+    sql = _RE_SQL_NOISE.sub('', response_text)
     
     # Limpiar espacios en blanco excesivos
-    sql = ' '.join(sql.split())
+    sql = _RE_WS.sub(' ', sql).strip()
     
     # Verificar que sea un SELECT
-    sql_upper = sql.strip().upper()
-    if not sql_upper.startswith('SELECT'):
+    if sql[:6].upper() != 'SELECT':
         raise ValueError("El modelo no generó una consulta SELECT válida")
     
-    return sql.strip()
+    return sql
 
 
 def validate_and_fix_table_name(sql: str, prompt: str) -> str:
@@ -289,12 +581,9 @@ def validate_and_fix_table_name(sql: str, prompt: str) -> str:
     Returns:
         SQL con el nombre de tabla corregido si era necesario
     """
-    import os
-    import re
-    
     # Extraer el nombre correcto de la tabla del prompt
     # Buscar el patrón: TABLA PRINCIPAL (FACT TABLE): `project.dataset.table`
-    table_match = re.search(r'TABLA PRINCIPAL.*?: `([^`]+)`', prompt)
+    table_match = _RE_TABLE_FROM_PROMPT.search(prompt)
     if not table_match:
         # Fallback: construir desde variables de entorno
         project_id = os.getenv("PROJECT_ID")
@@ -310,17 +599,9 @@ def validate_and_fix_table_name(sql: str, prompt: str) -> str:
     
     # Buscar cualquier referencia a la tabla en el SQL
     # Patrón: `project.dataset.table` o project.dataset.table (con o sin backticks)
-    # Buscar variaciones comunes del nombre de tabla
-    table_patterns = [
-        # Con backticks completos
-        r'`([^`]+\.(?:Gold|Dim)\.[^`]+)`',
-        # Sin backticks
-        r'([a-zA-Z0-9\-]+\.[a-zA-Z0-9\-]+\.[a-zA-Z0-9_\-]+)',
-    ]
-    
     corrected_sql = sql
-    for pattern in table_patterns:
-        matches = re.finditer(pattern, sql, re.IGNORECASE)
+    for pattern in _TABLE_PATTERNS:
+        matches = pattern.finditer(sql)
         for match in matches:
             found_table = match.group(1)
             # Si el nombre encontrado no coincide exactamente con el correcto
@@ -340,7 +621,7 @@ def validate_and_fix_table_name(sql: str, prompt: str) -> str:
                         else:
                             replacement = correct_table
                         corrected_sql = corrected_sql.replace(match.group(0), replacement)
-                        log_warning(f"⚠️ Fixed table name in SQL: '{found_table}' → '{correct_table}'")
+                        log_warning("⚠️ Fixed table name in SQL: '%s' → '%s'", found_table, correct_table)
     
     return corrected_sql
 
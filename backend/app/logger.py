@@ -2,11 +2,19 @@
 Módulo de logging centralizado con métricas
 Soporta logging local y Google Cloud Logging (si está habilitado)
 """
+import atexit
+import inspect
 import logging
+import threading
 import time
 import os
+from collections import deque
+from itertools import islice
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 from datetime import datetime
 from typing import Dict, Any, Optional
+from contextlib import contextmanager
 from functools import wraps
 import json
 
@@ -18,53 +26,188 @@ except ImportError:
     GCP_LOGGING_AVAILABLE = False
     cloud_logging = None
 
-# Configurar handlers base
-handlers = [
-    logging.StreamHandler(),
-    logging.FileHandler('chatbot.log')
-]
+# ⚡ Escritura a archivo con buffer: se agrupan líneas y se flushea por tiempo (o ante errores)
+_LOG_FILE_BUFFER_BYTES = int(os.getenv("LOG_FILE_BUFFER_BYTES", "65536"))
+_LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv("LOG_FLUSH_INTERVAL_SECONDS", "1"))
 
-# Intentar configurar Google Cloud Logging si está disponible
-gcp_logging_enabled = False
-if GCP_LOGGING_AVAILABLE:
-    try:
+
+class _LocalQueueHandler(QueueHandler):
+    """QueueHandler para una cola en el mismo proceso: encola el record tal cual"""
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # ⚡ Sin formatear en el thread que loguea: el mensaje (args, traceback) lo arma el listener
+        return record
+
+
+class BufferedFileHandler(logging.FileHandler):
+    """FileHandler que no flushea en cada record: el buffer se vacía periódicamente, al cerrar o con ERROR+"""
+
+    def __init__(self, filename: str, buffer_size: int = _LOG_FILE_BUFFER_BYTES,
+                 flush_interval: float = _LOG_FLUSH_INTERVAL_SECONDS, flush_level: int = logging.ERROR):
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+        # Un solo thread flusher para toda la vida del handler (no un Timer nuevo por intervalo)
+        self._stop = threading.Event()
+        super().__init__(filename)
+        self._flusher = threading.Thread(target=self._flush_loop, name="log-flusher", daemon=True)
+        self._flusher.start()
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=self.buffer_size,
+                    encoding=self.encoding, errors=self.errors)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            if record.levelno >= self.flush_level:
+                self.stream.flush()
+        except Exception:
+            self.handleError(record)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        if self._flusher.is_alive() and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        super().close()
+
+
+# Cloud Logging es opt-in: crear el cliente hace lookups de credenciales/metadata que demoran el arranque
+_GCP_LOGGING_REQUESTED = os.getenv("ENABLE_GCP_LOGGING", "false").lower() in ("1", "true")
+
+
+class LazyGCPHandler(logging.Handler):
+    """
+    Proxy del handler de Google Cloud Logging: crea el cliente con el primer record.
+    Corre en el thread del QueueListener, así la inicialización no bloquea el arranque ni los requests.
+    Si falla (API no habilitada, permisos, etc.), queda deshabilitado y se sigue con logging local.
+    """
+    
+    def __init__(self, project_id: str):
+        super().__init__()
+        self.project_id = project_id
+        self._handler: Optional[logging.Handler] = None
+        self._failed = False
+    
+    def _get_handler(self) -> Optional[logging.Handler]:
+        if self._handler is None and not self._failed:
+            try:
+                client = cloud_logging.Client(project=self.project_id)
+                self._handler = client.get_default_handler()
+                if self._handler.formatter is None:
+                    self._handler.setFormatter(self.formatter)
+                print("✅ Google Cloud Logging enabled - Logs will be sent to GCP")
+            except Exception as e:
+                self._failed = True
+                error_msg = str(e).lower()
+                # Solo mostrar detalle si es un error de API no habilitada o permisos
+                if "403" in error_msg or "not enabled" in error_msg or "permission" in error_msg:
+                    print("⚠️  Google Cloud Logging not available (API not enabled or no permissions)")
+                    print("   Continuing with local logging only")
+                    print(f"   Error: {str(e)[:100]}...")
+                    print("   To enable: gcloud services enable logging.googleapis.com --project=<PROJECT_ID>")
+        return self._handler
+    
+    # Loggers del propio cliente de GCP: reenviarlos generaría un loop de logs
+    _EXCLUDED_LOGGERS = ("google.cloud", "google.auth", "google_auth_httplib2", "google.api_core.bidi", "urllib3")
+    
+    def emit(self, record: logging.LogRecord):
+        if record.name.startswith(self._EXCLUDED_LOGGERS):
+            return
+        handler = self._get_handler()
+        if handler is not None:
+            handler.handle(record)
+    
+    def flush(self):
+        if self._handler is not None:
+            self._handler.flush()
+    
+    def close(self):
+        if self._handler is not None:
+            self._handler.close()
+        super().close()
+
+
+def _configure_logging() -> bool:
+    """Configura handlers, cola y listener una sola vez por proceso. Retorna si Cloud Logging quedó habilitado"""
+    root = logging.getLogger()
+    # Idempotente: si el módulo se importa dos veces (ej: como `logger` y como `app.logger`)
+    # no se duplican listeners ni descriptores abiertos sobre chatbot.log
+    if getattr(root, '_nl2sql_configured', False):
+        return getattr(root, '_nl2sql_gcp_enabled', False)
+    
+    # Configurar handlers base
+    file_handler = BufferedFileHandler('chatbot.log')
+    handlers = [
+        logging.StreamHandler(),
+        file_handler
+    ]
+
+    # Google Cloud Logging solo si se pide explícitamente; el cliente se crea recién con el primer record
+    gcp_enabled = False
+    if _GCP_LOGGING_REQUESTED and GCP_LOGGING_AVAILABLE:
         project_id = os.getenv("PROJECT_ID")
         if project_id:
-            # Inicializar cliente de Cloud Logging
-            client = cloud_logging.Client(project=project_id)
-            # Configurar logging estándar para redirigir a GCP
-            # Esto puede fallar si la API no está habilitada o no hay permisos
-            client.setup_logging()
-            gcp_logging_enabled = True
-            # Solo loguear si se configuró exitosamente (evitar spam en cada import)
-            import sys
-            if not hasattr(sys, '_gcp_logging_initialized'):
-                print("✅ Google Cloud Logging enabled - Logs will be sent to GCP")
-                sys._gcp_logging_initialized = True
-    except Exception as e:
-        # Si falla (API no habilitada, permisos, etc.), continuar con logging local
-        # No mostrar warning en cada import, solo la primera vez
-        import sys
-        if not hasattr(sys, '_gcp_logging_failed'):
-            error_msg = str(e).lower()
-            # Solo mostrar warning si es un error de API no habilitada, no errores de importación
-            if "403" in error_msg or "not enabled" in error_msg or "permission" in error_msg:
-                print("⚠️  Google Cloud Logging not available (API not enabled or no permissions)")
-                print("   Continuing with local logging only")
-                print(f"   Error: {str(e)[:100]}...")
-                print("   To enable: gcloud services enable logging.googleapis.com --project=<PROJECT_ID>")
-            # Para otros errores (conexión, etc.), ser más silencioso
-            sys._gcp_logging_failed = True
-
-# Configurar logger
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=handlers,
-    force=True  # Forzar reconfiguración si ya estaba configurado
-)
+            handlers.append(LazyGCPHandler(project_id))
+            gcp_enabled = True
+
+    # ⚡ Los handlers reales (consola, archivo, GCP) corren en un thread dedicado:
+    # los threads de request solo encolan el record y no esperan escrituras a disco/red
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    for handler in handlers:
+        if handler.formatter is None:
+            handler.setFormatter(formatter)
+
+    log_queue: SimpleQueue = SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(file_handler.flush)
+    atexit.register(listener.stop)
+
+    # Configurar logger
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[_LocalQueueHandler(log_queue)],
+        force=True  # Forzar reconfiguración si ya estaba configurado
+    )
+    
+    root._nl2sql_configured = True
+    root._nl2sql_gcp_enabled = gcp_enabled
+    return gcp_enabled
+
+
+gcp_logging_enabled = _configure_logging()
+
+
+class EmojiFilter(logging.Filter):
+    """Antepone el emoji del nivel a los records marcados con extra={'emoji': True} (log_info/log_warning/log_error)"""
+    
+    PREFIXES = {logging.INFO: "ℹ️  ", logging.WARNING: "⚠️  ", logging.ERROR: "❌ "}
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "emoji", False):
+            prefix = self.PREFIXES.get(record.levelno)
+            if prefix:
+                record.msg = prefix + str(record.msg)
+            record.emoji = False
+        return True
+
+
+_EMOJI_EXTRA = {"emoji": True}
 
 logger = logging.getLogger('nl2sql_chatbot')
+if not any(isinstance(f, EmojiFilter) for f in logger.filters):
+    logger.addFilter(EmojiFilter())
+
+
+# Resumen detallado por request (desactivable en despliegues con mucho tráfico)
+_LOG_VERBOSE_METRICS = os.getenv("LOG_VERBOSE_METRICS", "true").lower() == "true"
 
 
 class MetricsCollector:
@@ -74,12 +217,41 @@ class MetricsCollector:
     MAX_METRICS = 1000
     
     def __init__(self):
-        self.metrics = []
+        # ⚡ deque con maxlen: append O(1) y descarte automático de las más antiguas
+        self.metrics = deque(maxlen=self.MAX_METRICS)
+        # ⚡ Agregados acumulados (desde el inicio o el último clear): get_stats es O(1)
+        self._lock = threading.Lock()
+        self._reset_aggregates()
+    
+    def _reset_aggregates(self):
+        """Reinicia los agregados acumulados"""
+        self._n = 0
+        self._ok = 0
+        self._timed = 0
+        self._sum_ms = 0.0
+        self._min_ms = float("inf")
+        self._max_ms = float("-inf")
+    
+    def _add_to_aggregates(self, metric: Dict[str, Any]):
+        """Suma una métrica a los agregados (llamar con el lock tomado)"""
+        self._n += 1
+        if not metric['success']:
+            return
+        self._ok += 1
+        total_time_ms = metric.get('total_time_ms')
+        if total_time_ms:
+            self._timed += 1
+            self._sum_ms += total_time_ms
+            if total_time_ms < self._min_ms:
+                self._min_ms = total_time_ms
+            if total_time_ms > self._max_ms:
+                self._max_ms = total_time_ms
     
     def log_request(self, request_data: Dict[str, Any]):
         """Log de request completo con métricas"""
         metric = {
-            "timestamp": datetime.now().isoformat(),
+            # ⚡ Entero crudo; el ISO se arma solo al exponer la métrica (get_recent_metrics)
+            "timestamp_ns": time.time_ns(),
             "request_id": request_data.get("request_id"),
             "question": request_data.get("question"),
             "steps": request_data.get("steps", []),
@@ -92,49 +264,59 @@ class MetricsCollector:
             "error": request_data.get("error")
         }
         
-        # Limitar tamaño de métricas en memoria (FIFO)
-        if len(self.metrics) >= self.MAX_METRICS:
-            # Eliminar las métricas más antiguas (primeras 100)
-            self.metrics = self.metrics[100:]
-            logger.debug(f"🧹 Memory cleanup: removed 100 old metrics")
-        
-        self.metrics.append(metric)
+        # El deque descarta solo las métricas más antiguas al llegar a MAX_METRICS (FIFO)
+        with self._lock:
+            self.metrics.append(metric)
+            self._add_to_aggregates(metric)
         
         # Log detallado
-        logger.info("=" * 80)
-        logger.info(f"📊 REQUEST SUMMARY - ID: {metric['request_id']}")
-        logger.info(f"❓ Question: {metric['question']}")
-        logger.info(f"⏱️  Total Time: {metric['total_time_ms']/1000:.2f}s")
-        
-        if metric.get('steps'):
-            logger.info("📝 Steps:")
-            for step in metric['steps']:
-                logger.info(f"  - {step['name']}: {step['duration_ms']/1000:.2f}s")
-        
-        if metric.get('sql_generated'):
-            logger.info(f"🔍 SQL: {metric['sql_generated']}")
-        
-        if metric.get('rows_returned') is not None:
-            logger.info(f"📊 Rows: {metric['rows_returned']}")
-        
-        if metric.get('tokens_used'):
-            logger.info(f"🎯 Tokens: {metric['tokens_used']}")
-        
-        if metric.get('model_used'):
-            logger.info(f"🤖 Model: {metric['model_used']}")
+        # ⚡ Solo se arma si algún handler lo va a emitir, y sale como un único record multilínea
+        if _LOG_VERBOSE_METRICS and logger.isEnabledFor(logging.INFO):
+            separator = "=" * 80
+            lines = [
+                separator,
+                f"📊 REQUEST SUMMARY - ID: {metric['request_id']}",
+                f"❓ Question: {metric['question']}",
+                f"⏱️  Total Time: {(metric['total_time_ms'] or 0) / 1000:.2f}s",
+            ]
+            
+            if metric.get('steps'):
+                lines.append("📝 Steps:")
+                lines.extend(f"  - {step['name']}: {step['duration_ms'] / 1000:.2f}s" for step in metric['steps'])
+            
+            if metric.get('sql_generated'):
+                lines.append(f"🔍 SQL: {metric['sql_generated']}")
+            
+            if metric.get('rows_returned') is not None:
+                lines.append(f"📊 Rows: {metric['rows_returned']}")
+            
+            if metric.get('tokens_used'):
+                lines.append(f"🎯 Tokens: {metric['tokens_used']}")
+            
+            if metric.get('model_used'):
+                lines.append(f"🤖 Model: {metric['model_used']}")
+            
+            if metric['success']:
+                lines.append("✅ Success")
+            
+            lines.append(separator)
+            logger.info("%s", "\n".join(lines))
         
+        # Los errores se registran siempre, aunque el resumen esté desactivado
         if not metric['success']:
-            logger.error(f"❌ Error: {metric['error']}")
-        else:
-            logger.info("✅ Success")
-        
-        logger.info("=" * 80)
+            logger.error("❌ Error: %s", metric['error'])
         
         return metric
     
     def get_recent_metrics(self, limit: int = 10) -> list:
         """Obtiene las últimas N métricas"""
-        return self.metrics[-limit:]
+        with self._lock:
+            recent = list(islice(reversed(self.metrics), limit))
+        recent.reverse()
+        return [
+            {**metric, "timestamp": datetime.fromtimestamp(metric["timestamp_ns"] / 1e9).isoformat(timespec='milliseconds')}
+            for metric in recent
+        ]
     
     def clear_metrics(self, keep_recent: int = 0):
         """Limpia las métricas almacenadas
@@ -142,32 +324,41 @@ class MetricsCollector:
         Args:
             keep_recent: Número de métricas recientes a mantener (0 = limpiar todas)
         """
-        if keep_recent > 0 and len(self.metrics) > keep_recent:
-            self.metrics = self.metrics[-keep_recent:]
-            logger.info(f"🧹 Metrics cleanup: kept {keep_recent} most recent")
+        with self._lock:
+            self._reset_aggregates()
+            if keep_recent > 0 and len(self.metrics) > keep_recent:
+                kept = list(islice(reversed(self.metrics), keep_recent))
+                kept.reverse()
+                self.metrics.clear()
+                self.metrics.extend(kept)
+                for metric in kept:
+                    self._add_to_aggregates(metric)
+                count = None
+            else:
+                count = len(self.metrics)
+                self.metrics.clear()
+        if count is None:
+            logger.info("🧹 Metrics cleanup: kept %d most recent", keep_recent)
         else:
-            count = len(self.metrics)
-            self.metrics.clear()
-            logger.info(f"🧹 Metrics cleanup: removed {count} metrics")
+            logger.info("🧹 Metrics cleanup: removed %d metrics", count)
     
     def get_stats(self) -> Dict[str, Any]:
-        """Obtiene estadísticas generales"""
-        if not self.metrics:
-            return {}
+        """Obtiene estadísticas generales (desde el inicio o el último clear)"""
+        with self._lock:
+            n, ok, timed = self._n, self._ok, self._timed
+            sum_ms, min_ms, max_ms = self._sum_ms, self._min_ms, self._max_ms
         
-        successful = [m for m in self.metrics if m['success']]
-        failed = [m for m in self.metrics if not m['success']]
-        
-        times = [m['total_time_ms'] for m in successful if m.get('total_time_ms')]
+        if not n:
+            return {}
         
         return {
-            "total_requests": len(self.metrics),
-            "successful": len(successful),
-            "failed": len(failed),
-            "success_rate": len(successful) / len(self.metrics) * 100 if self.metrics else 0,
-            "avg_response_time_ms": sum(times) / len(times) if times else 0,
-            "min_response_time_ms": min(times) if times else 0,
-            "max_response_time_ms": max(times) if times else 0,
+            "total_requests": n,
+            "successful": ok,
+            "failed": n - ok,
+            "success_rate": ok / n * 100,
+            "avg_response_time_ms": sum_ms / timed if timed else 0,
+            "min_response_time_ms": min_ms if timed else 0,
+            "max_response_time_ms": max_ms if timed else 0,
         }
 
 
@@ -178,81 +369,98 @@ metrics_collector = MetricsCollector()
 def log_step(step_name: str):
     """Decorador para loguear pasos individuales con timing"""
     def decorator(func):
-        @wraps(func)
-        async def async_wrapper(*args, **kwargs):
-            start_time = time.time()
-            logger.info(f"▶️  Starting: {step_name}")
-            
-            try:
-                result = await func(*args, **kwargs)
-                duration_ms = (time.time() - start_time) * 1000
-                logger.info(f"✅ Completed: {step_name} ({duration_ms:.2f}ms)")
-                
-                # Guardar timing en kwargs si existe request_steps
-                if 'request_steps' in kwargs:
-                    kwargs['request_steps'].append({
-                        'name': step_name,
-                        'duration_ms': duration_ms,
-                        'success': True
-                    })
-                
-                return result, duration_ms
-                
-            except Exception as e:
-                duration_ms = (time.time() - start_time) * 1000
-                logger.error(f"❌ Failed: {step_name} ({duration_ms:.2f}ms) - {str(e)}")
-                
-                if 'request_steps' in kwargs:
-                    kwargs['request_steps'].append({
-                        'name': step_name,
-                        'duration_ms': duration_ms,
-                        'success': False,
-                        'error': str(e)
-                    })
+        # ⚡ Referencias locales al closure: evitan lookups de globales/atributos por llamada
+        _info = logger.info
+        _error = logger.error
+        _pc = time.perf_counter_ns
+        
+        # Detectar una sola vez si la función es async o sync y crear solo ese wrapper
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start_ns = _pc()
+                _info("▶️  Starting: %s", step_name)
                 
-                raise
+                try:
+                    result = await func(*args, **kwargs)
+                    duration_ms = (_pc() - start_ns) / 1_000_000
+                    _info("✅ Completed: %s (%.2fms)", step_name, duration_ms)
+                    
+                    # Guardar timing en kwargs si existe request_steps
+                    if 'request_steps' in kwargs:
+                        kwargs['request_steps'].append({
+                            'name': step_name,
+                            'duration_ms': duration_ms,
+                            'success': True
+                        })
+                    
+                    return result, duration_ms
+                    
+                except Exception as e:
+                    duration_ms = (_pc() - start_ns) / 1_000_000
+                    _error("❌ Failed: %s (%.2fms) - %s", step_name, duration_ms, e)
+                    
+                    if 'request_steps' in kwargs:
+                        kwargs['request_steps'].append({
+                            'name': step_name,
+                            'duration_ms': duration_ms,
+                            'success': False,
+                            'error': str(e)
+                        })
+                    
+                    raise
+            
+            return async_wrapper
         
         @wraps(func)
         def sync_wrapper(*args, **kwargs):
-            start_time = time.time()
-            logger.info(f"▶️  Starting: {step_name}")
+            start_ns = _pc()
+            _info("▶️  Starting: %s", step_name)
             
             try:
                 result = func(*args, **kwargs)
-                duration_ms = (time.time() - start_time) * 1000
-                logger.info(f"✅ Completed: {step_name} ({duration_ms:.2f}ms)")
+                duration_ms = (_pc() - start_ns) / 1_000_000
+                _info("✅ Completed: %s (%.2fms)", step_name, duration_ms)
                 
                 return result, duration_ms
                 
             except Exception as e:
-                duration_ms = (time.time() - start_time) * 1000
-                logger.error(f"❌ Failed: {step_name} ({duration_ms:.2f}ms) - {str(e)}")
+                duration_ms = (_pc() - start_ns) / 1_000_000
+                _error("❌ Failed: %s (%.2fms) - %s", step_name, duration_ms, e)
                 raise
         
-        # Detectar si la función es async o sync
-        import inspect
-        if inspect.iscoroutinefunction(func):
-            return async_wrapper
-        else:
-            return sync_wrapper
+        return sync_wrapper
     
     return decorator
 
 
-def log_info(message: str):
-    """Log info con formato"""
-    logger.info(f"ℹ️  {message}")
+@contextmanager
+def timed_step(step_name: str):
+    """
+    Mide la duración de un paso del pipeline.
+    Entrega el dict del paso ({'name', 'duration_ms'}); duration_ms se completa al salir del bloque.
+    """
+    step = {"name": step_name, "duration_ms": 0.0}
+    start_ns = time.perf_counter_ns()
+    try:
+        yield step
+    finally:
+        step["duration_ms"] = (time.perf_counter_ns() - start_ns) / 1_000_000
+
 
+def log_info(message: str, *args):
+    """Log info con formato (acepta args estilo %s, formateados solo si el record se emite)"""
+    logger.info(message, *args, extra=_EMOJI_EXTRA)
 
-def log_warning(message: str):
+
+def log_warning(message: str, *args):
     """Log warning con formato"""
-    logger.warning(f"⚠️  {message}")
+    logger.warning(message, *args, extra=_EMOJI_EXTRA)
 
 
 def log_error(message: str, error: Optional[Exception] = None):
     """Log error con formato"""
     if error:
-        logger.error(f"❌ {message}: {str(error)}", exc_info=True)
+        logger.error("%s: %s", message, error, exc_info=True, extra=_EMOJI_EXTRA)
     else:
-        logger.error(f"❌ {message}")
-
+        logger.error(message, extra=_EMOJI_EXTRA)
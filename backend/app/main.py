@@ -5,51 +5,172 @@ Orquesta todo el flujo: recibe pregunta → genera SQL → ejecuta → retorna r
 import os
 import time
 import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import anyio.to_thread
+import orjson
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from dotenv import load_dotenv
 
 from app.models import AskRequest, AskResponse, ErrorResponse, HealthResponse
-from app.prompts import get_prompt
-from app.llm import init_vertex_ai, nl_to_sql, recommend_chart_type
-from app.db import get_table_schema, get_dimensions_info, execute_query, test_connection, clear_all_caches, get_cache_stats
+from app.prompts import clear_prompt_cache, get_prompt_cache_stats
+from app.llm import init_vertex_ai, nl_to_sql, recommend_chart_type, clear_llm_cache, get_llm_cache_stats
+from app.db import (
+    get_table_schema, get_dimensions_info, refresh_dimensions_state, execute_query,
+    test_connection, clear_all_caches, get_cache_stats
+)
 from app.logger import metrics_collector, log_info, log_error, log_warning
-from app.agent import run_agent
+from app.metrics import metric_aggregator, METRICS_PRECOMPUTE_ENABLED
+from app.agent import run_agent_async, stream_agent_async, clear_sql_cache, get_sql_cache_stats
 
 # Cargar variables de entorno
 load_dotenv()
 
+# ⚡ Configuración requerida resuelta una sola vez al arrancar (no en cada request)
+PROJECT_ID = os.getenv("PROJECT_ID")
+BQ_DATASET = os.getenv("BQ_DATASET")
+BQ_TABLE = os.getenv("BQ_TABLE")
+CONFIG_OK = bool(PROJECT_ID and BQ_DATASET and BQ_TABLE)
+_CONFIG_ERROR_DETAIL = "Configuración incompleta: faltan PROJECT_ID, BQ_DATASET o BQ_TABLE"
+
 # Inicializar Vertex AI al arrancar la aplicación
 log_info("Starting NL → SQL Chatbot application")
+if not CONFIG_OK:
+    log_error("Incomplete configuration: PROJECT_ID, BQ_DATASET and BQ_TABLE are required - /ask will fail")
 try:
     init_vertex_ai()
     log_info("Vertex AI initialized successfully")
 except Exception as e:
-    log_warning(f"Could not initialize Vertex AI: {e}")
+    log_warning("Could not initialize Vertex AI: %s", e)
 
 # Verificar tablas de dimensiones al inicio (silenciosamente)
 try:
-    from app.db import get_dimensions_info
-    # Usar cache si está disponible para evitar logs verbosos
-    dimensions_info = get_dimensions_info(use_cache=True, force_refresh=False)
+    # Usar cache si está disponible para evitar logs verbosos; queda como dimensiones vigentes de /ask
+    dimensions_info = refresh_dimensions_state()
     if dimensions_info.get("dimensions") and len(dimensions_info["dimensions"]) > 0:
         dim_names = list(dimensions_info["dimensions"].keys())
-        log_info(f"✅ Dimension tables available: {', '.join(dim_names)}")
+        log_info("✅ Dimension tables available: %s", ', '.join(dim_names))
         log_info("✅ System can generate JOINs with these tables")
     else:
         # Solo mostrar warning si realmente no hay tablas (no si están en cache como "no encontradas")
         log_info("ℹ️  No dimension tables - system will work only with main table")
         log_info("   To force dimension reload: POST /dimensions/refresh")
 except Exception as e:
-    log_warning(f"⚠️  Error checking dimensions at startup: {e}")
+    log_warning("⚠️  Error checking dimensions at startup: %s", e)
+
+
+# ⚡ Threads para trabajo bloqueante: los nodos síncronos del agente (ainvoke), asyncio.to_thread
+# (BigQuery, métricas, archivos) y Starlette (FileResponse). Con el default (~CPU+4) los /ask
+# concurrentes se encolan esperando thread aunque solo estén esperando I/O de red.
+_THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "64"))
+
+# ⚡ Métricas de /ask: se encolan y las registra una tarea en background, fuera del camino de la respuesta
+_METRICS_QUEUE_MAX_SIZE = int(os.getenv("METRICS_QUEUE_MAX_SIZE", "1000"))
+_METRICS_BATCH_SIZE = 50
+_metrics_queue: asyncio.Queue = asyncio.Queue(maxsize=_METRICS_QUEUE_MAX_SIZE)
+_metrics_task: Optional[asyncio.Task] = None
+
+# Refresco periódico de las dimensiones vigentes (detecta cambios en el dataset sin tocar /ask)
+_DIMENSIONS_REFRESH_SECONDS = int(os.getenv("DIMENSIONS_REFRESH_MINUTES", "5")) * 60
+
+
+def _log_metrics_batch(batch: list):
+    """Registra un lote de métricas en el collector (corre en el thread pool)"""
+    for metric in batch:
+        try:
+            metrics_collector.log_request(metric)
+        except Exception as e:
+            log_error("Error logging request metrics", e)
+
+
+async def _drain_metrics():
+    """Consume la cola de métricas: espera una y se lleva las demás que ya estén encoladas"""
+    while True:
+        batch = [await _metrics_queue.get()]
+        while len(batch) < _METRICS_BATCH_SIZE and not _metrics_queue.empty():
+            batch.append(_metrics_queue.get_nowait())
+        await asyncio.to_thread(_log_metrics_batch, batch)
+
+
+def _flush_metrics_queue():
+    """Registra lo que quedó en la cola (al apagar)"""
+    batch = []
+    while not _metrics_queue.empty():
+        batch.append(_metrics_queue.get_nowait())
+    _log_metrics_batch(batch)
+
+
+async def _refresh_dimensions_periodically():
+    """Re-publica las dimensiones cada _DIMENSIONS_REFRESH_SECONDS (usa el caché y el chequeo de versión)"""
+    while True:
+        await asyncio.sleep(_DIMENSIONS_REFRESH_SECONDS)
+        try:
+            await asyncio.to_thread(refresh_dimensions_state)
+        except Exception as e:
+            log_warning("⚠️  Could not refresh dimensions: %s", e)
+
+
+def _enqueue_metric(metric: dict):
+    """Encola la métrica de un request sin esperar a que se registre"""
+    if _metrics_task is None:
+        # Sin lifespan (ej: TestClient sin context manager) no hay consumidor: registrar en el momento
+        _log_metrics_batch([metric])
+        return
+    try:
+        _metrics_queue.put_nowait(metric)
+    except asyncio.QueueFull:
+        log_warning("⚠️  Metrics queue full, dropping metric for request %s", metric.get("request_id"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranque de la app: dimensiona los pools de threads y arranca las tareas en background"""
+    global _metrics_task
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=_THREADPOOL_SIZE, thread_name_prefix="nl2sql-io")
+    loop.set_default_executor(executor)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = _THREADPOOL_SIZE
+    log_info("Thread pool size for blocking I/O: %d", _THREADPOOL_SIZE)
+    _metrics_task = asyncio.create_task(_drain_metrics())
+    # Sin configuración no hay dimensiones que refrescar
+    dimensions_task = asyncio.create_task(_refresh_dimensions_periodically()) if CONFIG_OK else None
+    # Pre-calcular métricas frecuentes en background (se sirven desde memoria en /ask)
+    if METRICS_PRECOMPUTE_ENABLED:
+        try:
+            metric_aggregator.start_background_refresh()
+        except Exception as e:
+            log_warning("⚠️  Could not start metric pre-computation: %s", e)
+    try:
+        yield
+    finally:
+        metric_aggregator.stop()
+        if dimensions_task:
+            dimensions_task.cancel()
+        _metrics_task.cancel()
+        try:
+            await _metrics_task
+        except asyncio.CancelledError:
+            pass
+        _metrics_task = None
+        _flush_metrics_queue()
+        # Los threads ociosos del pool se liberan; las tareas en curso terminan solas
+        executor.shutdown(wait=False)
+
 
 # Crear aplicación FastAPI
 app = FastAPI(
+    lifespan=lifespan,
     title="NL to SQL Chatbot",
     description="Chatbot que convierte lenguaje natural a SQL usando Gemini y BigQuery",
-    version="1.0.0"
+    version="1.0.0",
+    # ⚡ orjson serializa las respuestas (métricas, filas de resultados) mucho más rápido que json
+    default_response_class=ORJSONResponse
 )
 
 # Configurar CORS para permitir requests desde el frontend
@@ -62,16 +183,13 @@ app.add_middleware(
 )
 
 
-@app.get("/", include_in_schema=False)
-async def root():
-    """Servir el frontend construido"""
-    # Intentar servir desde dist (build de producción)
-    dist_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "frontend", "dist", "index.html")
-    if os.path.exists(dist_path):
-        return FileResponse(dist_path)
-    # Fallback a index.html del frontend (desarrollo)
-    frontend_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "frontend", "index.html")
-    return FileResponse(frontend_path)
+# ⚡ Rutas del frontend resueltas una sola vez al importar
+FRONTEND_SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "frontend")
+FRONTEND_DIST = os.path.join(FRONTEND_SRC, "dist")
+FRONTEND_DIST_EXISTS = os.path.exists(FRONTEND_DIST)
+# Priorizar index.html de dist (build de producción); fallback al del frontend (desarrollo)
+_DIST_INDEX = os.path.join(FRONTEND_DIST, "index.html")
+FRONTEND_INDEX = _DIST_INDEX if os.path.exists(_DIST_INDEX) else os.path.join(FRONTEND_SRC, "index.html")
 
 
 @app.get("/health", response_model=HealthResponse)
@@ -80,8 +198,9 @@ async def health_check():
     Endpoint de health check
     Verifica que BigQuery y Vertex AI estén funcionando
     """
-    bigquery_ok = test_connection()
-    vertex_ai_ok = os.getenv("PROJECT_ID") is not None
+    # El chequeo puede hacer un dry-run a BigQuery: corre en el thread pool, no en el event loop
+    bigquery_ok = await asyncio.to_thread(test_connection)
+    vertex_ai_ok = PROJECT_ID is not None
     
     status = "healthy" if (bigquery_ok and vertex_ai_ok) else "degraded"
     
@@ -92,6 +211,22 @@ async def health_check():
     )
 
 
+def _conversation_history(request: AskRequest, request_id: str) -> Optional[list]:
+    """Convierte el historial del request al formato que espera el agente (None si no hay)"""
+    if not request.conversation_history:
+        return None
+    conversation_history = [
+        {
+            "role": msg.role,
+            "content": msg.content,
+            "sql": msg.sql
+        }
+        for msg in request.conversation_history
+    ]
+    log_info("[%s] Including %d previous messages in context", request_id, len(conversation_history))
+    return conversation_history
+
+
 @app.post("/ask", response_model=AskResponse, responses={500: {"model": ErrorResponse}})
 async def ask_question(request: AskRequest):
     """
@@ -109,47 +244,30 @@ async def ask_question(request: AskRequest):
     """
     # Generar ID único para este request
     request_id = str(uuid.uuid4())[:8]
-    start_time = time.time()
+    start_ns = time.perf_counter_ns()
     
-    log_info(f"🔵 New request [{request_id}]: {request.question}")
+    log_info("🔵 New request [%s]: %s", request_id, request.question)
     
     try:
-        # Verificar configuración
-        project_id = os.getenv("PROJECT_ID")
-        dataset = os.getenv("BQ_DATASET")
-        table = os.getenv("BQ_TABLE")
-        
-        if not all([project_id, dataset, table]):
-            raise HTTPException(
-                status_code=500,
-                detail="Configuración incompleta: faltan PROJECT_ID, BQ_DATASET o BQ_TABLE"
-            )
+        # Verificar configuración (validada al arrancar)
+        if not CONFIG_OK:
+            raise HTTPException(status_code=500, detail=_CONFIG_ERROR_DETAIL)
         
         # Preparar historial de conversación si está disponible
-        conversation_history = None
-        if request.conversation_history:
-            conversation_history = [
-                {
-                    "role": msg.role,
-                    "content": msg.content,
-                    "sql": msg.sql
-                }
-                for msg in request.conversation_history
-            ]
-            log_info(f"[{request_id}] Including {len(conversation_history)} previous messages in context")
+        conversation_history = _conversation_history(request, request_id)
         
-        # Ejecutar el agente LangGraph
-        agent_result = run_agent(
+        # Ejecutar el agente LangGraph (async: no bloquea el event loop mientras espera I/O)
+        agent_result = await run_agent_async(
             question=request.question,
             conversation_history=conversation_history,
             request_id=request_id
         )
         
         # Calcular tiempo total
-        total_time_ms = (time.time() - start_time) * 1000
+        total_time_ms = (time.perf_counter_ns() - start_ns) / 1_000_000
         
-        # Log de métricas
-        metrics_collector.log_request({
+        # Log de métricas (se registra en background, no demora la respuesta)
+        _enqueue_metric({
             "request_id": request_id,
             "question": request.question,
             "steps": agent_result.get("steps", []),
@@ -160,23 +278,26 @@ async def ask_question(request: AskRequest):
         })
         
         # Retornar respuesta
-        log_info(f"✅ Request [{request_id}] completed successfully in {total_time_ms/1000:.2f}s")
+        log_info("✅ Request [%s] completed successfully in %.2fs", request_id, total_time_ms / 1000)
         
-        return AskResponse(
-            question=request.question,
-            sql=agent_result["sql"],
-            columns=agent_result["columns"],
-            rows=agent_result["rows"],
-            total_rows=agent_result["total_rows"],
-            chart_type=agent_result.get("chart_type"),
-            chart_config=agent_result.get("chart_config")
-        )
+        # ⚡ Las filas ya vienen como tipos nativos de JSON (db.py convierte Decimal, bytes y fechas):
+        # devolver el ORJSONResponse directo evita re-validar AskResponse y pasar por jsonable_encoder.
+        # response_model se mantiene para documentar el contrato en OpenAPI.
+        return ORJSONResponse({
+            "question": request.question,
+            "sql": agent_result["sql"],
+            "columns": agent_result["columns"],
+            "rows": agent_result["rows"],
+            "total_rows": agent_result["total_rows"],
+            "chart_type": agent_result.get("chart_type"),
+            "chart_config": agent_result.get("chart_config")
+        })
         
     except ValueError as e:
-        total_time_ms = (time.time() - start_time) * 1000
+        total_time_ms = (time.perf_counter_ns() - start_ns) / 1_000_000
         log_error(f"[{request_id}] Validation error", e)
         
-        metrics_collector.log_request({
+        _enqueue_metric({
             "request_id": request_id,
             "question": request.question,
             "steps": [],
@@ -188,10 +309,10 @@ async def ask_question(request: AskRequest):
         raise HTTPException(status_code=400, detail=str(e))
         
     except Exception as e:
-        total_time_ms = (time.time() - start_time) * 1000
+        total_time_ms = (time.perf_counter_ns() - start_ns) / 1_000_000
         log_error(f"[{request_id}] Error processing question", e)
         
-        metrics_collector.log_request({
+        _enqueue_metric({
             "request_id": request_id,
             "question": request.question,
             "steps": [],
@@ -206,6 +327,60 @@ async def ask_question(request: AskRequest):
         )
 
 
+@app.post(
+    "/ask/stream",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}, "description": "Eventos NDJSON"}}
+)
+async def ask_question_stream(request: AskRequest):
+    """
+    Igual que /ask pero responde NDJSON (un evento JSON por línea) a medida que avanza el agente
+    
+    Eventos en orden: {"type": "sql"}, {"type": "rows"}, {"type": "chart"} (solo si hay
+    recomendación) y {"type": "done"}. Si algo falla se emite {"type": "error", "detail": ...}.
+    """
+    request_id = str(uuid.uuid4())[:8]
+    start_ns = time.perf_counter_ns()
+    
+    log_info("🔵 New streaming request [%s]: %s", request_id, request.question)
+    
+    # Verificar configuración (validada al arrancar) antes de empezar a responder
+    if not CONFIG_OK:
+        raise HTTPException(status_code=500, detail=_CONFIG_ERROR_DETAIL)
+    
+    conversation_history = _conversation_history(request, request_id)
+    
+    async def events():
+        metric = {"request_id": request_id, "question": request.question, "steps": [], "success": True}
+        try:
+            async for event in stream_agent_async(
+                question=request.question,
+                conversation_history=conversation_history,
+                request_id=request_id
+            ):
+                if event["type"] == "sql":
+                    metric["sql"] = event["sql"]
+                elif event["type"] == "rows":
+                    metric["rows_returned"] = event["total_rows"]
+                elif event["type"] == "error":
+                    metric.update(success=False, error=event["detail"])
+                elif event["type"] == "done":
+                    metric["steps"] = event["steps"]
+                # ⚡ Cada evento sale apenas está listo (orjson directo a bytes)
+                yield orjson.dumps(event, default=str) + b"\n"
+        except Exception as e:
+            # Los headers ya se enviaron: el error viaja como último evento
+            log_error(f"[{request_id}] Error processing question", e)
+            metric.update(success=False, error=str(e))
+            yield orjson.dumps({"type": "error", "detail": f"Error procesando la pregunta: {str(e)}"}) + b"\n"
+        
+        metric["total_time_ms"] = (time.perf_counter_ns() - start_ns) / 1_000_000
+        _enqueue_metric(metric)
+        log_info("✅ Streaming request [%s] finished in %.2fs", request_id, metric["total_time_ms"] / 1000)
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
 @app.post("/dimensions/refresh")
 async def refresh_dimensions():
     """
@@ -215,8 +390,12 @@ async def refresh_dimensions():
     try:
         from app.db import clear_dimensions_cache
         log_info("🔄 Forcing dimension tables reload...")
-        clear_dimensions_cache()
-        dimensions_info = get_dimensions_info(force_refresh=True)
+        # La limpieza espera el lock de dimensiones y la recarga va a BigQuery: ambas fuera del event loop
+        await asyncio.to_thread(clear_dimensions_cache)
+        clear_prompt_cache()
+        clear_llm_cache()
+        clear_sql_cache()
+        dimensions_info = await asyncio.to_thread(refresh_dimensions_state, force_refresh=True)
         
         if dimensions_info.get("dimensions") and len(dimensions_info["dimensions"]) > 0:
             return {
@@ -245,17 +424,38 @@ async def get_schema(refresh: bool = False):
     Query params:
         - refresh: Si es True, fuerza recarga del schema (ignora caché)
     """
+    # Configuración validada al arrancar: sin ella no tiene sentido ir a BigQuery
+    if not CONFIG_OK:
+        raise HTTPException(status_code=500, detail=_CONFIG_ERROR_DETAIL)
+    
     try:
-        schema_text, table_id = get_table_schema(use_cache=not refresh)
+        # ⚡ Schema y dimensiones son independientes: se obtienen en paralelo, fuera del event loop.
+        # Con refresh, las dimensiones recargadas también se publican para /ask (DIMENSIONS_STATE)
+        if refresh:
+            dimensions_call = asyncio.to_thread(refresh_dimensions_state, force_refresh=True)
+        else:
+            dimensions_call = asyncio.to_thread(get_dimensions_info, use_cache=True)
+        schema_result, dimensions_result = await asyncio.gather(
+            asyncio.to_thread(get_table_schema, use_cache=not refresh),
+            dimensions_call,
+            return_exceptions=True
+        )
+        if isinstance(schema_result, Exception):
+            raise schema_result
+        schema_text, table_id = schema_result
+        if refresh:
+            clear_prompt_cache()
+            clear_llm_cache()
+            clear_sql_cache()
         cached_str = " (sin caché)" if refresh else " (caché)"
-        log_info(f"Schema requested for table: {table_id}{cached_str}")
+        log_info("Schema requested for table: %s%s", table_id, cached_str)
         
-        # Intentar obtener información de dimensiones
+        # Las dimensiones son opcionales: si fallan, se informa solo el schema
         dimensions_info = None
-        try:
-            dimensions_info = get_dimensions_info(use_cache=not refresh)
-        except Exception as e:
-            log_warning(f"Could not load dimensions: {e}")
+        if isinstance(dimensions_result, Exception):
+            log_warning("Could not load dimensions: %s", dimensions_result)
+        else:
+            dimensions_info = dimensions_result
         
         result = {
             "table": table_id,
@@ -290,26 +490,53 @@ async def get_metrics():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Máximo de líneas que se pueden pedir a /logs
+_MAX_LOG_LINES = 10000
+_LOG_TAIL_CHUNK_BYTES = 8192
+
+
+def _tail_lines(path: str, lines: int) -> list:
+    """Lee las últimas N líneas de un archivo recorriéndolo desde el final (sin cargarlo entero)"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        chunks = []
+        newlines = 0
+        # Se necesita un salto de línea más que N para asegurar que la primera línea está completa
+        while pos > 0 and newlines <= lines:
+            step = min(_LOG_TAIL_CHUNK_BYTES, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step)
+            newlines += chunk.count(b'\n')
+            chunks.append(chunk)
+    data = b''.join(reversed(chunks))
+    tail = data.splitlines()[-lines:] if lines > 0 else []
+    return [line.decode('utf-8', errors='replace') for line in tail]
+
+
 @app.get("/logs")
 async def get_logs(lines: int = 50):
     """
     Endpoint para obtener los últimos logs
     """
-    log_info(f"Logs requested (last {lines} lines)")
+    if lines > _MAX_LOG_LINES:
+        raise HTTPException(status_code=413, detail=f"Máximo {_MAX_LOG_LINES} líneas por request")
+    
+    log_info("Logs requested (last %d lines)", lines)
     try:
-        import os
         log_file = "chatbot.log"
         
         if not os.path.exists(log_file):
             return {"logs": [], "message": "No hay logs disponibles aún"}
         
-        with open(log_file, 'r') as f:
-            all_lines = f.readlines()
-            recent_lines = all_lines[-lines:] if len(all_lines) > lines else all_lines
+        # ⚡ Solo se leen los bytes finales necesarios: costo independiente del tamaño del archivo.
+        # La lectura corre en el thread pool para no bloquear el event loop.
+        recent_lines = await asyncio.to_thread(_tail_lines, log_file, lines)
             
         return {
             "logs": [line.strip() for line in recent_lines],
-            "total_lines": len(all_lines),
+            "file_size_bytes": os.path.getsize(log_file),
             "showing": len(recent_lines)
         }
     except Exception as e:
@@ -328,7 +555,13 @@ async def clear_cache(clear_metrics: bool = False):
     log_info("🧹 Cache cleanup requested")
     try:
         clear_all_caches()
-        cache_stats = get_cache_stats()
+        clear_sql_cache()
+        clear_prompt_cache()
+        clear_llm_cache()
+        metric_aggregator.clear()
+        cache_stats = {
+            **get_cache_stats(), **get_sql_cache_stats(), **get_prompt_cache_stats(), **get_llm_cache_stats()
+        }
         
         metrics_cleared = False
         if clear_metrics:
@@ -359,55 +592,61 @@ async def get_cache_statistics():
     Endpoint para obtener estadísticas de los cachés (monitoreo de memoria)
     """
     try:
-        cache_stats = get_cache_stats()
+        cache_stats = {
+            **get_cache_stats(), **get_sql_cache_stats(), **get_prompt_cache_stats(), **get_llm_cache_stats()
+        }
         metrics_stats = {
             "total_metrics": len(metrics_collector.metrics),
             "max_metrics": metrics_collector.MAX_METRICS
         }
         return {
             "cache_stats": cache_stats,
-            "metrics_stats": metrics_stats
+            "metrics_stats": metrics_stats,
+            "precomputed_metrics": metric_aggregator.get_stats()
         }
     except Exception as e:
         log_error("Error getting cache statistics", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# Montar archivos estáticos del frontend construido
-frontend_dist = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "frontend", "dist")
-frontend_src = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "frontend")
+# Montar archivos estáticos del frontend construido (rutas definidas arriba)
 
 # Rutas de API que no deben ser capturadas por el SPA
-API_ROUTES = ["/ask", "/health", "/schema", "/metrics", "/logs", "/docs", "/openapi.json", "/redoc"]
+API_ROUTES = ("/ask", "/health", "/schema", "/metrics", "/logs", "/docs", "/openapi.json", "/redoc")
+# El path que recibe StaticFiles llega sin "/" inicial
+_API_PREFIXES = tuple(route.lstrip("/") for route in API_ROUTES)
 
-# Priorizar dist (build de producción) si existe
-if os.path.exists(frontend_dist):
-    # Montar assets estáticos
-    assets_dir = os.path.join(frontend_dist, "assets")
-    if os.path.exists(assets_dir):
-        app.mount("/assets", StaticFiles(directory=assets_dir), name="assets")
+
+class SPAStaticFiles(StaticFiles):
+    """StaticFiles que devuelve index.html para rutas desconocidas (routing de React)"""
     
-    # Servir otros archivos estáticos del build y manejar routing de React
-    @app.get("/{path:path}", include_in_schema=False)
-    async def serve_spa(path: str):
-        """Servir archivos del SPA o redirigir a index.html para routing de React"""
-        # No interceptar rutas de API
-        if path in API_ROUTES or path.startswith(tuple(API_ROUTES)):
-            raise HTTPException(status_code=404, detail="Not found")
-        
-        full_path = os.path.join(frontend_dist, path)
-        if os.path.exists(full_path) and os.path.isfile(full_path):
-            return FileResponse(full_path)
-        # Si no existe, servir index.html para que React Router maneje la ruta
-        return FileResponse(os.path.join(frontend_dist, "index.html"))
+    async def get_response(self, path: str, scope):
+        try:
+            return await super().get_response(path, scope)
+        except StarletteHTTPException as e:
+            # No enmascarar rutas de API inexistentes con el index del SPA
+            if e.status_code != 404 or path.startswith(_API_PREFIXES):
+                raise
+            return await super().get_response("index.html", scope)
+
+
+# Priorizar dist (build de producción) si existe
+if FRONTEND_DIST_EXISTS:
+    # ⚡ Un solo mount sirve "/", assets y rutas del SPA sin pasar por el router de FastAPI.
+    # Va al final: las rutas de API registradas arriba se resuelven primero.
+    app.mount("/", SPAStaticFiles(directory=FRONTEND_DIST, html=True), name="spa")
 else:
     # Fallback: servir desde el directorio fuente (desarrollo)
-    app.mount("/static", StaticFiles(directory=frontend_src), name="static")
-
+    @app.get("/", include_in_schema=False)
+    async def root():
+        """Servir el frontend fuente"""
+        return FileResponse(FRONTEND_INDEX)
+    
+    app.mount("/static", StaticFiles(directory=FRONTEND_SRC), name="static")
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8080))
-    log_info(f"Starting server on port {port}")
+    log_info("Starting server on port %s", port)
     uvicorn.run(app, host="0.0.0.0", port=port)
 
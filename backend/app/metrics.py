@@ -0,0 +1,144 @@
+"""
+Módulo de métricas pre-calculadas (MetricAggregator)
+Responde preguntas agregadas frecuentes desde memoria, sin llamar a Gemini ni a BigQuery
+"""
+import os
+import re
+import threading
+import time
+from typing import Dict, Any, Optional, List
+
+from app.db import execute_query
+from app.logger import log_info, log_warning, log_error
+
+# Atajo de métricas pre-calculadas: si está apagado, /ask nunca responde desde memoria ni refresca en background
+METRICS_PRECOMPUTE_ENABLED = os.getenv("METRICS_PRECOMPUTE_ENABLED", "true").lower() == "true"
+
+# Intervalo de refresco en background (minutos)
+_REFRESH_INTERVAL_SECONDS = int(os.getenv("METRICS_REFRESH_MINUTES", "15")) * 60
+
+# ⚡ Métricas canónicas registradas por defecto
+# sql: template con {table} = project.dataset.table de la fact table
+# patterns: regex que deben coincidir con la pregunta COMPLETA ya normalizada
+#           (minúsculas, espacios colapsados, sin ¿¡ iniciales ni ?!. finales)
+REGISTERED_METRICS: Dict[str, Dict[str, Any]] = {
+    "total_contracts": {
+        "sql": "SELECT COUNT(*) AS total_contracts FROM `{table}`",
+        "patterns": [
+            r"(what is the )?total (number of )?contracts",
+            r"how many contracts (are there|do we have|exist)( in total)?",
+            r"(cuántos|cuantos) contratos (hay|existen|tenemos)( en total)?",
+            r"(el )?(total|número|numero|cantidad) (total )?de contratos",
+        ],
+    },
+}
+
+
+class MetricAggregator:
+    """Registra métricas canónicas, las pre-calcula periódicamente y las sirve desde memoria"""
+
+    def __init__(self, refresh_interval_seconds: int = _REFRESH_INTERVAL_SECONDS):
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self._values: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, name: str, sql: str, patterns: List[str]):
+        """Registra una métrica con su SQL (template con {table}) y patrones de pregunta"""
+        self._metrics[name] = {
+            "sql": sql,
+            "patterns": [re.compile(p) for p in patterns],
+        }
+
+    def match(self, normalized_question: str) -> Optional[str]:
+        """Retorna el nombre de la métrica si la pregunta normalizada coincide con algún patrón"""
+        for name, metric in self._metrics.items():
+            if any(p.fullmatch(normalized_question) for p in metric["patterns"]):
+                return name
+        return None
+
+    def refresh(self, name: Optional[str] = None):
+        """Recalcula una métrica (o todas) ejecutando su SQL en BigQuery"""
+        project_id = os.getenv("PROJECT_ID")
+        dataset = os.getenv("BQ_DATASET")
+        table = os.getenv("BQ_TABLE")
+        if not all([project_id, dataset, table]):
+            return
+        table_full_id = f"{project_id}.{dataset}.{table}"
+
+        names = [name] if name else list(self._metrics.keys())
+        for metric_name in names:
+            sql = self._metrics[metric_name]["sql"].format(table=table_full_id)
+            try:
+                result = execute_query(sql)
+                with self._lock:
+                    self._values[metric_name] = {
+                        "sql": sql,
+                        "columns": result["columns"],
+                        "rows": result["rows"],
+                        "total_rows": result["total_rows"],
+                        "refreshed_at": time.time(),
+                    }
+                log_info("📈 Metric '%s' refreshed", metric_name)
+            except Exception as e:
+                log_warning("Could not refresh metric '%s': %s", metric_name, e)
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Obtiene el valor pre-calculado de una métrica.
+        Si aún no se calculó (o quedó muy viejo), lo calcula en el momento.
+        """
+        with self._lock:
+            value = self._values.get(name)
+        max_age = self.refresh_interval_seconds * 2
+        if value is None or time.time() - value["refreshed_at"] > max_age:
+            self.refresh(name)
+            with self._lock:
+                value = self._values.get(name)
+        return value
+
+    def _refresh_loop(self):
+        """Refresca al arrancar y luego cada refresh_interval_seconds, hasta que se llame a stop()"""
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                log_error("Error refreshing metrics", e)
+            if self._stop.wait(self.refresh_interval_seconds):
+                return
+
+    def start_background_refresh(self):
+        """Inicia el refresco periódico en un único thread daemon (no bloquea el arranque)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, name="metrics-refresh", daemon=True)
+        self._thread.start()
+        log_info("📈 Metric pre-computation enabled (every %s min)", self.refresh_interval_seconds // 60)
+
+    def stop(self):
+        """Detiene el refresco periódico (un refresh en curso termina, pero no se programa otro)"""
+        self._stop.set()
+        self._thread = None
+
+    def clear(self):
+        """Limpia los valores pre-calculados"""
+        with self._lock:
+            self._values.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadísticas para monitoreo"""
+        return {
+            "enabled": METRICS_PRECOMPUTE_ENABLED,
+            "registered_metrics": list(self._metrics.keys()),
+            "computed_metrics": len(self._values),
+            "refresh_interval_seconds": self.refresh_interval_seconds,
+        }
+
+
+# Instancia global del aggregator
+metric_aggregator = MetricAggregator()
+for _name, _metric in REGISTERED_METRICS.items():
+    metric_aggregator.register(_name, _metric["sql"], _metric["patterns"])
@@ -2,6 +2,14 @@
 Prompts para la generación de SQL desde lenguaje natural
 """
 import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+# Cantidad de mensajes del historial que se incluyen en el prompt
+HISTORY_WINDOW = 5
 
 # ⚡ Prompt ultra-optimizado para respuesta rápida
 BASE_PROMPT = """Convierte esta pregunta a SQL de BigQuery. Responde SOLO con el SQL, sin explicaciones.
@@ -26,29 +34,12 @@ PREGUNTA ACTUAL: {question}
 SQL:"""
 
 
-def get_prompt(
-    question: str, 
-    schema: str, 
-    project_id: str, 
-    dataset: str, 
-    table: str,
-    dimensions_info: dict = None,
-    conversation_history: list = None
-) -> str:
+def _build_dimensions_text(project_id: str, dataset: str, table: str, dimensions_info: dict = None) -> Tuple[str, str]:
     """
-    Construye el prompt completo para enviar a Gemini
+    Construye la sección de dimensiones y sus reglas
     
-    Args:
-        question: Pregunta en lenguaje natural del usuario
-        schema: Schema de la tabla principal (columnas con tipos)
-        project_id: ID del proyecto GCP
-        dataset: Dataset de BigQuery
-        table: Nombre de la tabla principal
-        dimensions_info: Dict con información de tablas de dimensiones (opcional)
-        conversation_history: Lista de mensajes anteriores para contexto (opcional)
-        
     Returns:
-        Prompt formateado listo para enviar al LLM
+        Tupla con (dim_text, dimension_rules)
     """
     # Construir información de dimensiones si está disponible Y existen tablas
     dim_text = ""
@@ -88,11 +79,16 @@ def get_prompt(
         # Sin dimensiones disponibles
         dimension_rules = "- Usa solo las columnas de la tabla principal proporcionada"
     
+    return dim_text, dimension_rules
+
+
+def _build_conversation_context(conversation_history: list = None) -> str:
+    """Construye la sección de contexto de conversación a partir del historial"""
     # Construir contexto de conversación si hay historial
     conversation_context = ""
     if conversation_history and len(conversation_history) > 0:
-        # Limitar a las últimas 5 interacciones para no hacer el prompt muy largo
-        recent_history = conversation_history[-5:] if len(conversation_history) > 5 else conversation_history
+        # Limitar a las últimas interacciones para no hacer el prompt muy largo
+        recent_history = conversation_history[-HISTORY_WINDOW:]
         conversation_context = "\n\n📋 CONTEXTO DE CONVERSACIÓN ANTERIOR (para referencias como 'the same', 'previous query', etc.):\n"
         for msg in recent_history:
             if msg.get("role") == "user":
@@ -105,14 +101,119 @@ def get_prompt(
                     conversation_context += f"Asistente: {msg.get('content', '')}\n"
         conversation_context += "\n💡 Si la pregunta actual hace referencia a algo anterior (ej: 'the same', 'that query', 'previous results'), usa el contexto de arriba para entender qué se refiere.\n"
     
-    return BASE_PROMPT.format(
-        question=question,
+    return conversation_context
+
+
+# ⚡ Prompts pre-especializados por (tabla, schema, dimensiones)
+# La parte estática (schema, dimensiones, reglas) se formatea una sola vez;
+# cada request solo completa la pregunta y el historial.
+_MAX_PROMPT_FN_CACHE_SIZE = 16
+_PROMPT_FN_CACHE: "OrderedDict[tuple, Callable[[str, Optional[list]], str]]" = OrderedDict()
+_PROMPT_FN_CACHE_LOCK = threading.Lock()
+
+# Marcadores para partir el template ya formateado (no pueden aparecer en el schema)
+_QUESTION_MARK = "\x00question\x00"
+_CONTEXT_MARK = "\x00conversation_context\x00"
+
+
+def build_prompt_fn(
+    schema: str,
+    project_id: str,
+    dataset: str,
+    table: str,
+    dimensions_info: dict = None
+) -> Callable[[str, Optional[list]], str]:
+    """
+    Especializa el prompt para un schema y unas dimensiones dadas (evaluación parcial)
+    
+    Args:
+        schema: Schema de la tabla principal (columnas con tipos)
+        project_id: ID del proyecto GCP
+        dataset: Dataset de BigQuery
+        table: Nombre de la tabla principal
+        dimensions_info: Dict con información de tablas de dimensiones (opcional)
+        
+    Returns:
+        Función (question, conversation_history) -> prompt. Se cachea por hash de
+        schema y dimensiones: si alguno cambia, se construye una nueva.
+    """
+    schema_hash = hashlib.md5(schema.encode()).hexdigest()
+    dims_hash = hashlib.md5(json.dumps(dimensions_info, sort_keys=True, default=str).encode()).hexdigest()
+    key = (project_id, dataset, table, schema_hash, dims_hash)
+    
+    with _PROMPT_FN_CACHE_LOCK:
+        prompt_fn = _PROMPT_FN_CACHE.get(key)
+        if prompt_fn is not None:
+            _PROMPT_FN_CACHE.move_to_end(key)
+            return prompt_fn
+    
+    dim_text, dimension_rules = _build_dimensions_text(project_id, dataset, table, dimensions_info)
+    
+    # Formatear todo lo estático y partir el resultado en los huecos dinámicos.
+    # Partir (en vez de re-formatear) evita problemas con llaves dentro del schema.
+    static_prompt = BASE_PROMPT.format(
+        question=_QUESTION_MARK,
         schema=schema,
         project_id=project_id,
         dataset=dataset,
         table=table,
         dimensions_info=dim_text,
         dimension_rules=dimension_rules,
-        conversation_context=conversation_context
+        conversation_context=_CONTEXT_MARK
     )
+    head, rest = static_prompt.split(_CONTEXT_MARK)
+    middle, tail = rest.split(_QUESTION_MARK)
+    
+    def prompt_fn(question: str, conversation_history: Optional[list] = None) -> str:
+        return head + _build_conversation_context(conversation_history) + middle + question + tail
+    
+    with _PROMPT_FN_CACHE_LOCK:
+        _PROMPT_FN_CACHE[key] = prompt_fn
+        if len(_PROMPT_FN_CACHE) > _MAX_PROMPT_FN_CACHE_SIZE:
+            _PROMPT_FN_CACHE.popitem(last=False)
+    
+    return prompt_fn
+
+
+def clear_prompt_cache() -> int:
+    """Descarta los prompts pre-especializados (ej: al refrescar schemas o dimensiones). Retorna la cantidad eliminada"""
+    with _PROMPT_FN_CACHE_LOCK:
+        count = len(_PROMPT_FN_CACHE)
+        _PROMPT_FN_CACHE.clear()
+    return count
 
+
+def get_prompt_cache_stats() -> dict:
+    """Estadísticas del caché de prompts pre-especializados"""
+    return {
+        "prompt_cache_size": len(_PROMPT_FN_CACHE),
+        "prompt_cache_max": _MAX_PROMPT_FN_CACHE_SIZE
+    }
+
+
+def get_prompt(
+    question: str, 
+    schema: str, 
+    project_id: str, 
+    dataset: str, 
+    table: str,
+    dimensions_info: dict = None,
+    conversation_history: list = None
+) -> str:
+    """
+    Construye el prompt completo para enviar a Gemini
+    
+    Args:
+        question: Pregunta en lenguaje natural del usuario
+        schema: Schema de la tabla principal (columnas con tipos)
+        project_id: ID del proyecto GCP
+        dataset: Dataset de BigQuery
+        table: Nombre de la tabla principal
+        dimensions_info: Dict con información de tablas de dimensiones (opcional)
+        conversation_history: Lista de mensajes anteriores para contexto (opcional)
+        
+    Returns:
+        Prompt formateado listo para enviar al LLM
+    """
+    prompt_fn = build_prompt_fn(schema, project_id, dataset, table, dimensions_info)
+    return prompt_fn(question, conversation_history)
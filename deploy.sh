@@ -37,7 +37,7 @@ gcloud run deploy nl2sql-poc \
     --region ${VERTEX_LOCATION:-us-central1} \
     --platform managed \
     --allow-unauthenticated \
-    --set-env-vars "PROJECT_ID=$PROJECT_ID,BQ_DATASET=$BQ_DATASET,BQ_TABLE=$BQ_TABLE,VERTEX_LOCATION=$VERTEX_LOCATION,GEMINI_MODEL=$GEMINI_MODEL"
+    --set-env-vars "PROJECT_ID=$PROJECT_ID,BQ_DATASET=$BQ_DATASET,BQ_TABLE=$BQ_TABLE,VERTEX_LOCATION=$VERTEX_LOCATION,GEMINI_MODEL=$GEMINI_MODEL,ENABLE_GCP_LOGGING=${ENABLE_GCP_LOGGING:-1}"
 
 echo "✅ Deployment completado!"
 echo "🌐 Tu aplicación está disponible en la URL proporcionada por Cloud Run"